@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+城市代码表加载基准
+对比 json.load 得到的dict 与 mmap的二进制表（scripts/city_code_table.py）：加载耗时、加载后新增的Python堆内存、单次查找耗时
+
+用法: python3 benchmarks/bench_city_code_table.py [-n 次数]
+二进制表不存在或已过期时先编译
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'scripts')
+sys.path.insert(0, SCRIPT_DIR)
+
+from city_code_table import CityCodeTable, build_city_code_table, load_city_code_table, table_path_for
+
+JSON_PATH = os.path.join(SCRIPT_DIR, 'complete_china_weather_city_codes.json')
+
+
+def load_json():
+    with open(JSON_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_table():
+    return CityCodeTable(table_path_for(JSON_PATH))
+
+
+def heap_bytes(loader) -> int:
+    """加载后仍被持有的Python堆内存（字节）；mmap映射的文件页不计入"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = loader()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description='城市代码表加载基准')
+    parser.add_argument('-n', '--number', type=int, default=2000, help='每轮加载次数')
+    args = parser.parse_args()
+
+    if load_city_code_table(JSON_PATH) is None:
+        build_city_code_table(load_json(), table_path_for(JSON_PATH))
+
+    codes = load_json()
+    table = load_table()
+    names = list(codes)
+    print(f"条目数: {len(codes)}，JSON {os.path.getsize(JSON_PATH)} 字节，"
+          f"二进制表 {os.path.getsize(table_path_for(JSON_PATH))} 字节")
+
+    print(f"{'':<14}{'load(us)':>10}{'heap(KB)':>10}{'lookup(ns)':>12}")
+    for label, loader, mapping in (('json dict', load_json, codes), ('mmap table', load_table, table)):
+        load = min(timeit.repeat(loader, number=args.number, repeat=5)) / args.number * 1e6
+        heap = heap_bytes(loader) / 1024
+        rounds = max(1, args.number * 10 // len(names))
+        lookup = min(timeit.repeat(lambda: [mapping[name] for name in names], number=rounds, repeat=5))
+        lookup = lookup / (rounds * len(names)) * 1e9
+        print(f"{label:<14}{load:>10.1f}{heap:>10.1f}{lookup:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
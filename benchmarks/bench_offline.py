@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+离线端到端基准
+启动本地上游替身服务（stub_upstream.py），所有上游请求改发到替身服务，
+测量各查询路径的延迟分位数（p50/p95/p99）和吞吐量（QPS），不访问真实的天气服务
+
+场景:
+  router         query_china_weather(use_cache=False)，完整的路由和回退链
+  router_cached  query_china_weather()，结果缓存命中路径
+  router_async   async_query_china_weather(use_cache=False)，同一个事件循环中并发
+  china_weather  ChinaWeather(use_cache=False).query_weather()，按 service_priority 查询（和风/高德/Open-Meteo/wttr.in）
+  batch          query_weather_batch(use_cache=False)，每批 --batch-size 个位置，延迟为整批耗时
+
+用法: python3 benchmarks/bench_offline.py [-n 查询数] [-c 并发数] [--profile 规则 ...] [--scenario 名称 ...]
+延迟/故障规则同 stub_upstream.py，例如 --profile latency:20,p99:150 --profile weather_index=error:0.3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+sys.path.insert(0, REPO_DIR)
+
+from stub_upstream import StubUpstream, parse_profiles
+
+# 国际位置走 wttr.in / Open-Meteo
+INTERNATIONAL_LOCATIONS = ['London', 'Paris', 'Tokyo', 'New York', 'Sydney', 'Berlin', 'Moscow', 'Cairo']
+
+SCENARIOS = ('router', 'router_cached', 'router_async', 'china_weather', 'batch')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法分位数"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def pick_locations(count: int, international: float, seed: int) -> List[str]:
+    """从城市代码表中随机取位置，按比例混入国际位置"""
+    from city_code_registry import CityCodeRegistry
+
+    rng = random.Random(seed)
+    names = list(CityCodeRegistry.instance().city_codes)
+    return [rng.choice(INTERNATIONAL_LOCATIONS) if rng.random() < international else rng.choice(names)
+            for _ in range(count)]
+
+
+def answered(result: str) -> bool:
+    return bool(result) and not result.startswith('无法获取')
+
+
+def run_threaded(fn: Callable[[str], str], locations: List[str], concurrency: int) -> Tuple[List[float], int, float]:
+    """并发执行，返回 (每次调用的延迟秒数, 成功次数, 总耗时)"""
+    def timed(location):
+        started = time.perf_counter()
+        result = fn(location)
+        return time.perf_counter() - started, answered(result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, locations))
+    elapsed = time.perf_counter() - started
+    return [latency for latency, _ in outcomes], sum(ok for _, ok in outcomes), elapsed
+
+
+def run_async(locations: List[str], concurrency: int) -> Tuple[List[float], int, float]:
+    from intelligent_weather_router import async_query_china_weather
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(location):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await async_query_china_weather(location, use_cache=False)
+                return time.perf_counter() - started, answered(result)
+
+        return await asyncio.gather(*(timed(location) for location in locations))
+
+    started = time.perf_counter()
+    outcomes = asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return [latency for latency, _ in outcomes], sum(ok for _, ok in outcomes), elapsed
+
+
+def run_batches(locations: List[str], concurrency: int, batch_size: int) -> Tuple[List[float], int, float]:
+    """延迟为每批的耗时；成功数按位置计"""
+    from intelligent_weather_router import query_weather_batch
+
+    latencies, ok = [], 0
+    started = time.perf_counter()
+    for offset in range(0, len(locations), batch_size):
+        batch_started = time.perf_counter()
+        results = query_weather_batch(locations[offset:offset + batch_size], max_workers=concurrency, use_cache=False)
+        latencies.append(time.perf_counter() - batch_started)
+        ok += sum(1 for item in results if item['backend'])
+    return latencies, ok, time.perf_counter() - started
+
+
+def reset_state():
+    """场景之间清空结果缓存（含负缓存）和服务健康统计，避免前一个场景影响后一个"""
+    from backend_health import get_backend_health
+    from weather_cache import get_weather_cache
+
+    get_weather_cache().invalidate()
+    get_backend_health().reset()
+
+
+def run_scenario(name: str, locations: List[str], args, stub: StubUpstream) -> Tuple[List[float], int, float]:
+    from intelligent_weather_router import query_china_weather
+    from query_china_weather import ChinaWeather
+
+    if name == 'router':
+        return run_threaded(lambda location: query_china_weather(location, use_cache=False), locations,
+                            args.concurrency)
+    if name == 'router_cached':
+        # 先把所有位置查询一遍填充缓存，再测量命中路径
+        run_threaded(query_china_weather, list(dict.fromkeys(locations)), args.concurrency)
+        stub.reset_stats()
+        return run_threaded(query_china_weather, locations, args.concurrency)
+    if name == 'router_async':
+        return run_async(locations, args.concurrency)
+    if name == 'china_weather':
+        china_weather = ChinaWeather(use_cache=False)
+        return run_threaded(china_weather.query_weather, locations, args.concurrency)
+    if name == 'batch':
+        return run_batches(locations, args.concurrency, args.batch_size)
+    raise ValueError(f"未知的场景: {name}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='使用本地上游替身服务的离线基准')
+    parser.add_argument('-n', '--number', type=int, default=200, help='每个场景的查询数')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='并发数（线程数/协程数/批量线程数）')
+    parser.add_argument('--batch-size', type=int, default=50, help='batch 场景每批的位置数')
+    parser.add_argument('--international', type=float, default=0.1, help='国际位置的比例')
+    parser.add_argument('--profile', action='append', default=[], help='延迟/故障规则，可重复（默认 latency:20,p99:100）')
+    parser.add_argument('--scenario', nargs='*', choices=SCENARIOS, default=list(SCENARIOS), help='要运行的场景')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子（位置选择和替身服务）')
+    parser.add_argument('--no-keys', action='store_true', help='不设置和风/高德密钥，china_weather 只走免密钥服务')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示查询过程输出')
+    args = parser.parse_args(argv)
+
+    try:
+        profiles = parse_profiles(args.profile or ['latency:20,p99:100'])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix='bench-offline-')
+    # 地理编码缓存写到临时目录，不污染也不受 ~/.cache 中已有坐标影响
+    os.environ['WEATHER_GEOCODE_CACHE'] = os.path.join(workdir, 'geocode.sqlite3')
+    if not args.no_keys:
+        os.environ.setdefault('QWEATHER_API_KEY', 'stub')
+        os.environ.setdefault('AMAP_API_KEY', 'stub')
+
+    from weather_hedge import get_executor
+    from weather_http import set_upstream_base
+
+    locations = pick_locations(args.number, args.international, args.seed)
+    print(f"{len(locations)} 个查询/场景，{len(set(locations))} 个不同位置，并发 {args.concurrency}")
+    print(f"替身服务设置: {', '.join(f'{name}={profile}' for name, profile in profiles.items())}")
+    print(f"{'':<16}{'calls':>7}{'ok%':>7}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}"
+          f"{'QPS':>9}{'upstream/call':>15}{'faults':>8}")
+
+    report = sys.stdout
+    # 被对冲放弃的阶段可能在场景结束后才输出错误信息，因此整个运行期间都重定向查询输出
+    sink = contextlib.nullcontext() if args.verbose else open(os.devnull, 'w')
+    with sink as devnull, contextlib.redirect_stdout(devnull or sys.stdout), \
+            contextlib.redirect_stderr(devnull or sys.stderr), StubUpstream(profiles, seed=args.seed) as stub:
+        set_upstream_base(stub.base_url)
+        for name in args.scenario:
+            reset_state()
+            stub.reset_stats()
+            latencies, ok, elapsed = run_scenario(name, locations, args, stub)
+
+            latencies = sorted(latency * 1000 for latency in latencies)
+            outcomes = stub.stats().values()
+            upstream = sum(sum(counts.values()) for counts in outcomes)
+            faults = sum(count for counts in outcomes for outcome, count in counts.items() if outcome != 'ok')
+            print(f"{name:<16}{len(locations):>7}{ok / len(locations) * 100:>7.1f}"
+                  f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}"
+                  f"{percentile(latencies, 99):>10.1f}{latencies[-1]:>10.1f}"
+                  f"{len(locations) / elapsed:>9.1f}{upstream / len(locations):>15.2f}{faults:>8}",
+                  file=report, flush=True)
+        # 等被放弃的阶段结束（挂起的请求随替身服务关闭而失败），它们的输出仍被重定向
+        stub.close()
+        get_executor().shutdown(wait=True)
+        set_upstream_base(None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
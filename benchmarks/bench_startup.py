@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准
+每个入口脚本在新的解释器中运行（与shell包装脚本每次提问启动一个进程相同），测量：
+  wall    冷启动墙钟时间，扣除空解释器（python -c pass）的启动时间
+  import  -X importtime 统计的导入耗时（不含site阶段，site受当前环境的.pth影响）
+并检查入口是否导入了不该在启动时导入的重模块（requests、asyncio等应在首次请求时才导入）
+超出预算或导入了禁止的模块时退出码为1，可用于防止启动耗时回归
+
+用法: python3 benchmarks/bench_startup.py [-n 次数] [--scale 倍数] [--only 名称 ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 启动时不需要的重模块
+HEAVY_MODULES = ('requests', 'urllib3', 'asyncio', 'aiohttp')
+
+# (名称, 命令行参数, wall预算ms, import预算ms, 不应导入的模块)
+# 所有入口都不访问网络：打印用法、空的批量输入或连接不存在的socket
+ENTRY_POINTS = [
+    ('router', ['intelligent_weather_router.py'], 80, 45, HEAVY_MODULES + ('query_china_weather',)),
+    ('router_batch', ['intelligent_weather_router.py', '--batch'], 90, 50, HEAVY_MODULES + ('query_china_weather',)),
+    ('client', ['intelligent_weather_client.py', '--ping'], 35, 15, HEAVY_MODULES + ('intelligent_weather_router',)),
+    ('daemon_help', ['intelligent_weather_daemon.py', '--help'], 100, 70, HEAVY_MODULES),
+    ('china_weather_with_cnn', ['scripts/china_weather_with_cnn.py'], 45, 25, HEAVY_MODULES),
+    ('query_china_weather', ['scripts/query_china_weather.py'], 55, 40, HEAVY_MODULES),
+    ('enhanced_query_china_weather', ['scripts/enhanced_query_china_weather.py'], 45, 30, HEAVY_MODULES),
+    ('simple_china_weather', ['scripts/simple_china_weather.py'], 40, 20, HEAVY_MODULES),
+]
+
+
+def _environment() -> dict:
+    env = dict(os.environ)
+    # 写入.pyc，测量的是第二次及以后的启动，而不是每次都重新编译
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    # 客户端连接一个不存在的socket，立即以75退出
+    env['WEATHER_DAEMON_SOCKET'] = os.path.join(tempfile.gettempdir(), f'bench-startup-{os.getpid()}.sock')
+    return env
+
+
+def run_once(args, env, importtime: bool = False):
+    """运行一次，返回 (墙钟秒数, stderr)"""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + args
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=REPO_DIR, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return time.perf_counter() - started, result.stderr.decode('utf-8', errors='replace')
+
+
+def median_wall(args, env, number: int) -> float:
+    return statistics.median(run_once(args, env)[0] for _ in range(number))
+
+
+def parse_importtime(stderr: str):
+    """
+    解析 -X importtime 输出，返回 (site之后的导入总耗时ms, 导入的模块名集合, 最慢的顶层导入)
+    子模块先于父模块输出；site 一行出现之后的顶层导入都来自入口脚本
+    """
+    total_us = 0
+    modules = set()
+    top_level = []
+    after_site = False
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        # 名称前一个空格为顶层导入，每深一层多两个空格
+        top = not name.startswith('  ')
+        if not after_site:
+            after_site = top and module == 'site'
+            continue
+        modules.add(module)
+        if top:
+            total_us += int(cumulative_us)
+            top_level.append((int(cumulative_us), module))
+    top_level.sort(reverse=True)
+    return total_us / 1000, modules, top_level[:3]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='入口脚本启动耗时基准')
+    parser.add_argument('-n', '--number', type=int, default=10, help='每个入口运行的次数（取中位数）')
+    parser.add_argument('--scale', type=float, default=float(os.environ.get('STARTUP_BUDGET_SCALE', 1.0)),
+                        help='预算倍数，较慢的机器上调大（默认 STARTUP_BUDGET_SCALE 或 1.0）')
+    parser.add_argument('--only', nargs='*', default=None, help='只测量这些入口')
+    args = parser.parse_args(argv)
+
+    env = _environment()
+    entries = [entry for entry in ENTRY_POINTS if not args.only or entry[0] in args.only]
+    for _, entry_args, *_ in entries:
+        run_once(entry_args, env)  # 预热：写入.pyc、填充页缓存
+
+    baseline = median_wall(['-c', 'pass'], env, args.number)
+    print(f"空解释器启动: {baseline * 1000:.1f} ms (python {sys.version.split()[0]})")
+    print(f"{'':<30}{'wall(ms)':>10}{'budget':>8}{'import(ms)':>12}{'budget':>8}  最慢的导入")
+
+    failures = []
+    for name, entry_args, wall_budget, import_budget, forbidden in entries:
+        wall = (median_wall(entry_args, env, args.number) - baseline) * 1000
+        imports = [parse_importtime(run_once(entry_args, env, importtime=True)[1]) for _ in range(3)]
+        import_ms = min(item[0] for item in imports)
+        modules, slowest = imports[0][1], imports[0][2]
+        wall_budget *= args.scale
+        import_budget *= args.scale
+
+        slowest_text = ', '.join(f"{module} {us / 1000:.1f}" for us, module in slowest)
+        print(f"{name:<30}{wall:>10.1f}{wall_budget:>8.0f}{import_ms:>12.1f}{import_budget:>8.0f}  {slowest_text}")
+        if wall > wall_budget:
+            failures.append(f"{name}: 启动 {wall:.1f} ms 超出预算 {wall_budget:.0f} ms")
+        if import_ms > import_budget:
+            failures.append(f"{name}: 导入 {import_ms:.1f} ms 超出预算 {import_budget:.0f} ms")
+        loaded = sorted(module for module in forbidden if module in modules)
+        if loaded:
+            failures.append(f"{name}: 启动时导入了 {', '.join(loaded)}")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+中国天气网响应解析微基准
+对比原有解析流程（解码重试 + find/rfind切片 + json.loads + 多次正则）与 weather_com_cn_parser
+
+用法: python3 benchmarks/bench_weather_com_cn_parser.py [-n 次数]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures', 'weather_com_cn')
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'scripts'))
+
+from weather_com_cn_parser import parse_weather_fields, parse_weather_observation
+
+
+# ---------------------------------------------------------------------------
+# 原有实现（intelligent_weather_router.py / china_weather_with_cnn.py），仅用于对比
+# ---------------------------------------------------------------------------
+
+def legacy_decode(content: bytes) -> str:
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('gbk')
+
+
+def legacy_parse_by_regex(content: str):
+    temp_match = re.search(r'"temp":"([^"]*)"', content)
+    weather_match = re.search(r'"weather":"([^"]*)"', content)
+    city_match = re.search(r'"city":"([^"]*)"', content)
+    if temp_match:
+        temp = temp_match.group(1)
+        weather = weather_match.group(1) if weather_match else "天气"
+        city = city_match.group(1) if city_match else "城市"
+        return f"{city}: {weather} {temp}°C"
+    return None
+
+
+def legacy_parse_v2(content: str):
+    try:
+        start = content.find('{')
+        end = content.rfind('}') + 1
+        if start != -1 and end != 0:
+            data = json.loads(content[start:end])
+            city = data.get('city', '未知城市')
+            temp = data.get('temp', data.get('real', {}).get('temp', '未知'))
+            weather = data.get('weather', data.get('real', {}).get('weather', '未知'))
+            return f"{city}: {weather} {temp}°C"
+    except json.JSONDecodeError:
+        return legacy_parse_by_regex(content)
+    return None
+
+
+def legacy_parse_v1(content: str):
+    try:
+        data = json.loads(content)
+        real_data = data.get('data', {}).get('real', {})
+        if real_data:
+            return f"{real_data.get('city', '未知城市')}: {real_data.get('weather', '未知')} {real_data.get('temp', '未知')}°C"
+    except json.JSONDecodeError:
+        return legacy_parse_by_regex(content)
+    return None
+
+
+def legacy_parse(name: str, payload: bytes):
+    content = legacy_decode(payload)
+    if name.startswith('data_sk'):
+        return legacy_parse_v1(content)
+    return legacy_parse_v2(content)
+
+
+def new_fields(name: str, payload: bytes):
+    return parse_weather_fields(payload)
+
+
+def new_observation(name: str, payload: bytes):
+    source = 'weather_com_cn_v1' if name.startswith('data_sk') else 'weather_com_cn_v2'
+    return parse_weather_observation(payload, source)
+
+
+def new_parse(name: str, payload: bytes):
+    observation = new_observation(name, payload)
+    return observation.render() if observation else None
+
+
+# ---------------------------------------------------------------------------
+
+def load_fixtures():
+    fixtures = []
+    for name in sorted(os.listdir(FIXTURE_DIR)):
+        with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+            fixtures.append((name, f.read()))
+    return fixtures
+
+
+def bench(fn, name: str, payload: bytes, number: int) -> float:
+    """返回单次调用的平均耗时（微秒），取5轮中最快的一轮"""
+    best = min(timeit.repeat(lambda: fn(name, payload), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='中国天气网响应解析微基准')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='每轮调用次数')
+    args = parser.parse_args()
+
+    # legacy: 原有流程，输出文本；fields: 新解析器取出字段；observation: 再构造 WeatherObservation
+    print(f"{'fixture':<32}{'bytes':>7}{'legacy(us)':>12}{'fields(us)':>12}{'observation(us)':>17}")
+    for name, payload in load_fixtures():
+        legacy = bench(legacy_parse, name, payload, args.number)
+        fields = bench(new_fields, name, payload, args.number)
+        observation = bench(new_observation, name, payload, args.number)
+        print(f"{name:<32}{len(payload):>7}{legacy:>12.2f}{fields:>12.2f}{observation:>17.2f}")
+        print(f"  legacy: {legacy_parse(name, payload)}")
+        print(f"  new:    {new_parse(name, payload)}")
+
+
+if __name__ == '__main__':
+    main()
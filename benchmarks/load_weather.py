@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+智能路由负载测试
+N 个虚拟用户并发查询，位置按Zipf分布取自城市代码表（表中靠前的大城市占大部分请求），
+另有一部分错别字和不存在的地名；上游为本地替身服务（stub_upstream.py），可以注入延迟、5xx、超时、
+截断的响应体，以及周期性的故障爆发。报告尾延迟、各回退阶段的表现、结果缓存和熔断统计，用于确定缓存容量和超时设置
+
+用法: python3 benchmarks/load_weather.py [-u 用户数] [-d 秒数 | -n 请求数] [--zipf 指数] [--unknown 比例]
+        [--mode inprocess|cli] [--profile 规则 ...] [--burst 规则 ...] [--burst-every 秒] [--burst-length 秒]
+        [--cache-size N] [--no-cache] [--config INI] [--json]
+例如: python3 benchmarks/load_weather.py -u 32 -d 60 --profile latency:30,p99:400,error:0.02 \\
+        --burst weather_index=timeout:0.8 --burst-every 20 --burst-length 5
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+ROUTER_SCRIPT = os.path.join(REPO_DIR, 'intelligent_weather_router.py')
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+sys.path.insert(0, REPO_DIR)
+
+from bench_offline import INTERNATIONAL_LOCATIONS, percentile
+from stub_upstream import StubUpstream, parse_profile_rule, parse_profiles
+
+# Zipf 排名前 HEAD_RANKS 个位置计为 head
+HEAD_RANKS = 10
+
+# 生成错别字和不存在地名用的常见字
+FILLER_CHARS = '东南西北中新安平山河阳城江湖州口镇村乡屯营堡'
+UNKNOWN_LATIN = ('Qzx', 'Vrel', 'Norb', 'Kaltz', 'Yml', 'Thrun')
+
+
+class ZipfWorkload:
+    """按Zipf分布（第k名的权重为 1/k^s）抽取位置，并按比例混入错别字和不存在的地名"""
+
+    def __init__(self, names: List[str], exponent: float = 1.1, unknown: float = 0.05):
+        self.names = names
+        self.unknown = unknown
+        total = 0.0
+        self._cumulative = []
+        for rank in range(1, len(names) + 1):
+            total += 1.0 / rank ** exponent
+            self._cumulative.append(total)
+
+    def _rank(self, rng: random.Random) -> int:
+        return rng.choices(range(len(self.names)), cum_weights=self._cumulative)[0]
+
+    @staticmethod
+    def misspell(name: str, rng: random.Random) -> str:
+        """删除、替换、插入或交换一个字"""
+        chars = list(name)
+        position = rng.randrange(len(chars))
+        operation = rng.choice(('delete', 'replace', 'insert', 'swap') if len(chars) > 1 else ('replace', 'insert'))
+        if operation == 'delete':
+            del chars[position]
+        elif operation == 'replace':
+            chars[position] = rng.choice(FILLER_CHARS)
+        elif operation == 'insert':
+            chars.insert(position, rng.choice(FILLER_CHARS))
+        else:
+            position = min(position, len(chars) - 2)
+            chars[position], chars[position + 1] = chars[position + 1], chars[position]
+        return ''.join(chars)
+
+    @staticmethod
+    def unknown_name(rng: random.Random) -> str:
+        if rng.random() < 0.5:
+            return rng.choice(UNKNOWN_LATIN) + rng.choice(('ville', 'burg', 'stad', 'ton'))
+        return ''.join(rng.choice(FILLER_CHARS) for _ in range(3)) + rng.choice('镇村乡')
+
+    def draw(self, rng: random.Random) -> Tuple[str, str]:
+        """返回 (位置, 类别)，类别为 head/tail/typo/unknown"""
+        if rng.random() < self.unknown:
+            if rng.random() < 0.5:
+                return self.misspell(self.names[self._rank(rng)], rng), 'typo'
+            return self.unknown_name(rng), 'unknown'
+        rank = self._rank(rng)
+        return self.names[rank], 'head' if rank < HEAD_RANKS else 'tail'
+
+
+class BurstSchedule:
+    """每 every 秒让 burst_profiles 生效 length 秒，模拟上游成片故障"""
+
+    def __init__(self, stub: StubUpstream, burst_profiles: Dict[str, object], every: float, length: float):
+        self.stub = stub
+        self.burst_profiles = burst_profiles
+        self.every = every
+        self.length = length
+        self.windows: List[Tuple[float, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='burst-schedule', daemon=True)
+
+    def _run(self):
+        normal = {endpoint: self.stub.profiles.get(endpoint) for endpoint in self.burst_profiles}
+        while not self._stop.wait(max(0.0, self.every - self.length)):
+            started = time.monotonic()
+            for endpoint, profile in self.burst_profiles.items():
+                self.stub.set_profile(endpoint, profile)
+            self._stop.wait(self.length)
+            for endpoint, profile in normal.items():
+                if profile is None:
+                    self.stub.profiles.pop(endpoint, None)
+                else:
+                    self.stub.set_profile(endpoint, profile)
+            self.windows.append((started, time.monotonic()))
+
+    def in_burst(self, at: float) -> bool:
+        return any(start <= at < end for start, end in self.windows)
+
+    def start(self):
+        if self.burst_profiles:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class Sample:
+    __slots__ = ('started', 'latency', 'ok', 'kind', 'backend', 'fallback')
+
+    def __init__(self, started: float, latency: float, ok: bool, kind: str,
+                 backend: Optional[str], fallback: bool):
+        self.started = started
+        self.latency = latency
+        self.ok = ok
+        self.kind = kind
+        self.backend = backend
+        self.fallback = fallback
+
+
+def query_inprocess(location: str, use_cache: bool) -> Tuple[bool, Optional[str], bool]:
+    """返回 (是否得到结果, 来源服务, 是否来自省会/相近城市等回退)"""
+    from intelligent_weather_router import query_weather_record
+
+    record = query_weather_record(location, use_cache=use_cache)
+    observation = record['observation']
+    if observation is None:
+        return False, None, False
+    return True, record['backend'], observation.note is not None
+
+
+def query_cli(location: str, env: dict, timeout: float) -> Tuple[bool, Optional[str], bool]:
+    """每次查询启动一个路由进程，与shell包装脚本相同"""
+    try:
+        result = subprocess.run([sys.executable, ROUTER_SCRIPT, location], env=env, timeout=timeout,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        return False, None, False
+    lines = result.stdout.decode('utf-8', errors='replace').strip().splitlines()
+    answer = lines[-1] if lines else ''
+    ok = result.returncode == 0 and bool(answer) and not answer.startswith('无法获取')
+    return ok, 'cli' if ok else None, ok and answer.startswith('[')
+
+
+def run_load(args, workload: ZipfWorkload, query, started: float) -> List[Sample]:
+    samples: List[Sample] = []
+    lock = threading.Lock()
+    issued = [0]
+    deadline = started + args.duration if args.duration else None
+
+    def user(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        while True:
+            with lock:
+                if args.requests and issued[0] >= args.requests:
+                    return
+                issued[0] += 1
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            location, kind = workload.draw(rng)
+            ok, backend, fallback = query(location)
+            sample = Sample(now, time.monotonic() - now, ok, kind, backend, fallback)
+            with lock:
+                samples.append(sample)
+            if args.think:
+                time.sleep(rng.expovariate(1000.0 / args.think))
+
+    threads = [threading.Thread(target=user, args=(index,), name=f'vu-{index}', daemon=True)
+               for index in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples: List[Sample]) -> dict:
+    latencies = sorted(sample.latency * 1000 for sample in samples)
+    return {
+        'count': len(samples),
+        'ok_rate': round(sum(sample.ok for sample in samples) / len(samples), 4) if samples else 0.0,
+        'p50': round(percentile(latencies, 50), 1),
+        'p90': round(percentile(latencies, 90), 1),
+        'p99': round(percentile(latencies, 99), 1),
+        'p999': round(percentile(latencies, 99.9), 1),
+        'max': round(latencies[-1], 1) if latencies else 0.0,
+    }
+
+
+def group(samples: List[Sample], key) -> Dict[str, dict]:
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[key(sample)].append(sample)
+    return {name: summarize(items) for name, items in sorted(groups.items(), key=lambda item: -len(item[1]))}
+
+
+def build_report(samples: List[Sample], args, started: float, elapsed: float, bursts: BurstSchedule,
+                 stub: StubUpstream) -> dict:
+    report = {
+        'config': {
+            'mode': args.mode, 'users': args.users, 'zipf': args.zipf, 'unknown': args.unknown,
+            'cache': not args.no_cache, 'cache_size': args.cache_size,
+            'profiles': args.profile, 'bursts': args.burst,
+        },
+        'elapsed': round(elapsed, 2),
+        'qps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'overall': summarize(samples),
+        'by_kind': group(samples, lambda sample: sample.kind),
+        'by_backend': group(samples, lambda sample: (sample.backend or 'failed') + (' (回退)' if sample.fallback else '')),
+        'windows': {},
+        'upstream': stub.stats(),
+    }
+    if bursts.windows:
+        report['burst'] = group(samples, lambda sample: 'burst' if bursts.in_burst(sample.started) else 'steady')
+    windows = defaultdict(list)
+    for sample in samples:
+        windows[int((sample.started - started) // args.window * args.window)].append(sample)
+    report['windows'] = {f"{window}s": summarize(items) for window, items in sorted(windows.items())}
+
+    if args.mode == 'inprocess':
+        from backend_health import get_backend_health
+        from weather_cache import get_weather_cache
+
+        report['stages'] = get_backend_health().snapshot()
+        report['cache'] = get_weather_cache().stats()
+    return report
+
+
+def _row(name: str, summary: dict) -> str:
+    return (f"{name:<28}{summary['count']:>7}{summary['ok_rate'] * 100:>7.1f}{summary['p50']:>9.1f}"
+            f"{summary['p90']:>9.1f}{summary['p99']:>9.1f}{summary['p999']:>9.1f}{summary['max']:>9.1f}")
+
+
+def print_report(report: dict, out):
+    config = report['config']
+    print(f"模式 {config['mode']}，{config['users']} 个用户，Zipf指数 {config['zipf']}，"
+          f"错别字/未知地名 {config['unknown']:.0%}，缓存 {'开' if config['cache'] else '关'}", file=out)
+    print(f"{report['overall']['count']} 个请求，用时 {report['elapsed']} s，{report['qps']} QPS", file=out)
+    header = f"{'':<28}{'count':>7}{'ok%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'max(ms)':>9}"
+
+    sections = [('总体', {'all': report['overall']}), ('按输入类别', report['by_kind']),
+                ('按结果来源', report['by_backend'])]
+    if 'burst' in report:
+        sections.append(('故障爆发期间/平稳期间', report['burst']))
+    sections.append(('按时间窗口', report['windows']))
+    for title, rows in sections:
+        print(f"\n{title}\n{header}", file=out)
+        for name, summary in rows.items():
+            print(_row(name, summary), file=out)
+
+    if report.get('stages'):
+        print(f"\n各查询阶段\n{'':<28}{'calls':>7}{'fail%':>7}{'p50':>9}{'p95':>9}{'opens':>7}  state", file=out)
+        for name, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['calls']):
+            fail = stats['failures'] / stats['calls'] * 100 if stats['calls'] else 0.0
+            p50 = (stats['p50'] or 0) * 1000
+            p95 = (stats['p95'] or 0) * 1000
+            print(f"{name:<28}{stats['calls']:>7}{fail:>7.1f}{p50:>9.1f}{p95:>9.1f}{stats['opens']:>7}  "
+                  f"{stats['state']}", file=out)
+    if report.get('cache'):
+        cache = report['cache']
+        print(f"\n结果缓存: 命中率 {cache['hit_rate']:.1%}，条目 {cache['size']}/{cache['max_entries']}，"
+              f"淘汰 {cache['evictions']}，负缓存命中 {cache['negative_hits']}，合并 {cache['coalesced']}", file=out)
+    print("\n上游替身服务", file=out)
+    for endpoint, counts in sorted(report['upstream'].items()):
+        print(f"  {endpoint:<18}{json.dumps(counts)}", file=out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='智能路由负载测试（Zipf分布的位置 + 上游故障注入）')
+    parser.add_argument('-u', '--users', type=int, default=16, help='并发虚拟用户数')
+    parser.add_argument('-d', '--duration', type=float, default=30.0, help='运行秒数（与 -n 同时设置时先到为止）')
+    parser.add_argument('-n', '--requests', type=int, default=0, help='总请求数')
+    parser.add_argument('--think', type=float, default=0.0, help='用户两次请求之间的平均间隔（毫秒，指数分布）')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf指数，越大越集中在少数城市')
+    parser.add_argument('--unknown', type=float, default=0.05, help='错别字和不存在地名的比例')
+    parser.add_argument('--international', action='store_true', help='城市代码表之后追加国际城市')
+    parser.add_argument('--mode', choices=('inprocess', 'cli'), default='inprocess',
+                        help='inprocess: 进程内调用；cli: 每次查询启动一个路由进程')
+    parser.add_argument('--profile', action='append', default=[], help='替身服务的延迟/故障规则（默认 latency:30,p99:300）')
+    parser.add_argument('--burst', action='append', default=[], help='故障爆发期间生效的规则，格式同 --profile')
+    parser.add_argument('--burst-every', type=float, default=20.0, help='故障爆发的周期（秒）')
+    parser.add_argument('--burst-length', type=float, default=5.0, help='每次故障爆发持续的秒数')
+    parser.add_argument('--cache-size', type=int, default=None, help='结果缓存容量（默认使用缓存模块的默认值）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用结果缓存')
+    parser.add_argument('--config', default=None, help='使用另一份 clawdbot_weather_config.ini（调整超时、回退链）')
+    parser.add_argument('--window', type=float, default=5.0, help='按时间窗口统计的窗口秒数')
+    parser.add_argument('--cli-timeout', type=float, default=60.0, help='cli 模式下单个进程的超时（秒）')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    parser.add_argument('--json', action='store_true', help='以JSON输出报告')
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error('需要 -d 或 -n')
+
+    try:
+        profiles = parse_profiles(args.profile or ['latency:30,p99:300'])
+        # 爆发规则叠加在该端点平时的设置上
+        burst_profiles = {}
+        for rule in args.burst:
+            endpoint = rule.rpartition('=')[0].strip() or '*'
+            base = burst_profiles.get(endpoint) or profiles.get(endpoint) or profiles['*']
+            burst_profiles[endpoint] = parse_profile_rule(rule, base)[1]
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix='load-weather-')
+    os.environ['WEATHER_GEOCODE_CACHE'] = os.path.join(workdir, 'geocode.sqlite3')
+    if args.config:
+        os.environ['CLAWDBOT_WEATHER_CONFIG'] = os.path.abspath(args.config)
+
+    from city_code_registry import CityCodeRegistry
+    from weather_hedge import get_executor
+    from weather_http import set_upstream_base
+
+    out = sys.stdout
+    # 查询过程信息（包括被放弃的对冲阶段稍后输出的错误）全部丢弃，只输出报告
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        names = list(CityCodeRegistry.instance().city_codes)
+        if args.international:
+            names += INTERNATIONAL_LOCATIONS
+        workload = ZipfWorkload(names, args.zipf, args.unknown)
+
+        if args.cache_size is not None:
+            from weather_cache import configure_weather_cache
+            configure_weather_cache(max_entries=args.cache_size)
+
+        with StubUpstream(profiles, seed=args.seed, known_locations=names + INTERNATIONAL_LOCATIONS) as stub:
+            if args.mode == 'cli':
+                env = dict(os.environ, WEATHER_UPSTREAM_BASE=stub.base_url)
+                # 与部署环境一样使用.pyc，不把每次重新编译计入启动耗时
+                env.pop('PYTHONDONTWRITEBYTECODE', None)
+                query = lambda location: query_cli(location, env, args.cli_timeout)
+            else:
+                set_upstream_base(stub.base_url)
+                query = lambda location: query_inprocess(location, not args.no_cache)
+
+            bursts = BurstSchedule(stub, burst_profiles, args.burst_every, args.burst_length)
+            started = time.monotonic()
+            bursts.start()
+            samples = run_load(args, workload, query, started)
+            elapsed = time.monotonic() - started
+            bursts.stop()
+
+            report = build_report(samples, args, started, elapsed, bursts, stub)
+            stub.close()
+            get_executor().shutdown(wait=True)
+            set_upstream_base(None)
+
+    if not samples:
+        print("没有完成任何请求", file=sys.stderr)
+        return 1
+    if args.json:
+        json.dump(report, out, ensure_ascii=False, indent=2)
+        out.write('\n')
+    else:
+        print_report(report, out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
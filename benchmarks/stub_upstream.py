@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+上游天气服务的本地替身
+在本机回放记录的响应（中国天气网 weather_index / sk_2d / data/sk、wttr.in、Nominatim、Open-Meteo、
+和风天气、高德地图），每个端点可以单独设置延迟分布和故障比例（5xx、超时、截断的响应体）
+
+天气脚本设置 WEATHER_UPSTREAM_BASE 后，所有请求改发到替身服务，原主机名作为第一级路径（见 weather_http.upstream_url）
+
+用法: python3 benchmarks/stub_upstream.py [--port 8765] [--profile 规则 ...] [--seed N]
+      WEATHER_UPSTREAM_BASE=http://127.0.0.1:8765 python3 intelligent_weather_router.py 北京
+
+规则格式: [端点=]键:值,键:值 ，不写端点时作为所有端点的默认设置
+  latency  延迟中位数（毫秒）     p99      延迟的99分位（毫秒，按对数正态分布；不设置时延迟固定）
+  error    返回5xx的比例           timeout  不响应直到客户端超时的比例
+  malformed 返回截断响应体的比例   hang     超时故障挂起的时长（毫秒，默认30000）
+例如: --profile latency:20,p99:120 --profile sk_2d=error:0.2,timeout:0.05
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 端点名 -> (主机, 路径前缀, 响应文件, Content-Type)
+ENDPOINTS = {
+    'weather_index': ('d1.weather.com.cn', '/weather_index/', 'weather_com_cn/weather_index_101010100.html',
+                      'text/html'),
+    'sk_2d': ('d1.weather.com.cn', '/sk_2d/', 'weather_com_cn/sk_2d_101210101.html', 'text/html'),
+    'data_sk': ('www.weather.com.cn', '/data/sk/', 'weather_com_cn/data_sk_101010100.html', 'text/html'),
+    'wttr_in': ('wttr.in', '/', None, 'text/plain; charset=utf-8'),
+    'nominatim': ('nominatim.openstreetmap.org', '/search', 'upstream/nominatim_search.json', 'application/json'),
+    'openmeteo': ('api.open-meteo.com', '/v1/forecast', 'upstream/openmeteo_forecast.json', 'application/json'),
+    'qweather_lookup': ('geoapi.qweather.com', '/v2/city/lookup', 'upstream/qweather_city_lookup.json',
+                        'application/json'),
+    'qweather_now': ('devapi.qweather.com', '/v7/weather/now', 'upstream/qweather_now.json', 'application/json'),
+    'amap_geocode': ('restapi.amap.com', '/v3/geocode/geo', 'upstream/amap_geocode.json', 'application/json'),
+    'amap_district': ('restapi.amap.com', '/v3/config/district', 'upstream/amap_district.json', 'application/json'),
+    'amap_weather': ('restapi.amap.com', '/v3/weather/weatherInfo', 'upstream/amap_weather.json',
+                     'application/json'),
+}
+
+# 按地名查询的端点 -> 地名所在的查询参数（None表示在路径中）以及找不到地名时的响应
+NOT_FOUND = {
+    'wttr_in': (None, 404, b'Unknown location; please try ~'),
+    'nominatim': ('q', 200, b'[]'),
+    'qweather_lookup': ('location', 200, b'{"code":"404"}'),
+    'amap_geocode': ('address', 200, b'{"status":"1","info":"OK","infocode":"10000","count":"0","geocodes":[]}'),
+    'amap_district': ('keywords', 200, b'{"status":"1","info":"OK","infocode":"10000","count":"0","districts":[]}'),
+}
+
+# 99分位对应的标准正态分位数
+_Z99 = 2.3263
+
+
+class FaultProfile:
+    """单个端点的延迟分布和故障比例；时间单位为秒"""
+
+    __slots__ = ('latency', 'p99', 'error', 'timeout', 'malformed', 'hang')
+
+    def __init__(self, latency: float = 0.0, p99: Optional[float] = None, error: float = 0.0,
+                 timeout: float = 0.0, malformed: float = 0.0, hang: float = 30.0):
+        self.latency = latency
+        self.p99 = p99
+        self.error = error
+        self.timeout = timeout
+        self.malformed = malformed
+        self.hang = hang
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """按中位数和99分位确定的对数正态分布取一个延迟"""
+        if self.latency <= 0:
+            return 0.0
+        if not self.p99 or self.p99 <= self.latency:
+            return self.latency
+        sigma = math.log(self.p99 / self.latency) / _Z99
+        return rng.lognormvariate(math.log(self.latency), sigma)
+
+    def sample_fault(self, rng: random.Random) -> Optional[str]:
+        """返回 'timeout'、'error'、'malformed' 或None（正常响应）"""
+        roll = rng.random()
+        for fault in ('timeout', 'error', 'malformed'):
+            rate = getattr(self, fault)
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def copy(self, **changes) -> 'FaultProfile':
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return FaultProfile(**values)
+
+    def __repr__(self) -> str:
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"FaultProfile({values})"
+
+
+_MS_KEYS = ('latency', 'p99', 'hang')
+
+
+def parse_profile_rule(rule: str, base: Optional[FaultProfile] = None) -> Tuple[str, FaultProfile]:
+    """
+    解析 '[端点=]键:值,...'，返回 (端点名或'*', FaultProfile)
+    未出现的键沿用 base（通常是默认设置）
+    """
+    endpoint, _, spec = rule.rpartition('=')
+    endpoint = endpoint.strip() or '*'
+    if endpoint != '*' and endpoint not in ENDPOINTS:
+        raise ValueError(f"未知的端点: {endpoint}（可用: {', '.join(ENDPOINTS)}）")
+    changes = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key, sep, value = item.partition(':')
+        if not sep or key not in FaultProfile.__slots__:
+            raise ValueError(f"无法解析的设置: {item}")
+        changes[key] = float(value) / 1000 if key in _MS_KEYS else float(value)
+    return endpoint, (base or FaultProfile()).copy(**changes)
+
+
+def parse_profiles(rules) -> Dict[str, FaultProfile]:
+    """解析多条规则；端点规则以默认规则为基础，与书写顺序无关"""
+    rules = list(rules or ())
+    profiles = {'*': FaultProfile()}
+    for rule in rules:
+        if '=' not in rule:
+            profiles['*'] = parse_profile_rule(rule, profiles['*'])[1]
+    for rule in rules:
+        if '=' in rule:
+            endpoint, profile = parse_profile_rule(rule, profiles['*'])
+            profiles[endpoint] = profile
+    return profiles
+
+
+def _load_fixtures() -> Dict[str, bytes]:
+    bodies = {}
+    for name, (_, _, fixture, _) in ENDPOINTS.items():
+        if fixture:
+            with open(os.path.join(FIXTURE_DIR, fixture), 'rb') as f:
+                bodies[name] = f.read()
+    return bodies
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # keep-alive，与真实上游一样复用连接池中的连接
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出；不关闭Nagle时会和客户端的延迟确认叠加出约40ms的额外延迟
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, content_type, body = self.server.stub.respond(self.path)
+        if status is None:
+            # 超时故障：客户端已放弃，直接关闭连接
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except OSError:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class StubUpstream:
+    """
+    本地替身服务，在后台线程中运行
+        with StubUpstream(parse_profiles(['latency:20,p99:100'])) as stub:
+            set_upstream_base(stub.base_url)
+    设置 known_locations 时，按地名查询的端点只认识包含其中某个地名的查询，其余返回各服务"找不到"的响应；
+    不设置时任何地名都返回记录的结果
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, FaultProfile]] = None, host: str = '127.0.0.1',
+                 port: int = 0, seed: Optional[int] = None, known_locations: Optional[Iterable[str]] = None):
+        self.profiles = dict(profiles or {})
+        self.known_locations = frozenset(known_locations) if known_locations is not None else None
+        self.profiles.setdefault('*', FaultProfile())
+        self._bodies = _load_fixtures()
+        self._rng = random.Random(seed)
+        self._closing = threading.Event()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._server = _StubServer((host, port), _StubHandler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def profile_for(self, endpoint: str) -> FaultProfile:
+        return self.profiles.get(endpoint) or self.profiles['*']
+
+    def set_profile(self, endpoint: str, profile: FaultProfile):
+        """运行中替换某个端点（或'*'）的设置"""
+        self.profiles[endpoint] = profile
+
+    def match(self, path: str) -> Tuple[Optional[str], str]:
+        """'/主机/路径?查询' -> (端点名, 去掉主机后的路径)"""
+        parts = urllib.parse.urlsplit(path)
+        host, _, rest = parts.path.lstrip('/').partition('/')
+        rest = '/' + rest
+        best = None
+        for name, (endpoint_host, prefix, _, _) in ENDPOINTS.items():
+            if endpoint_host == host and rest.startswith(prefix):
+                if best is None or len(prefix) > len(ENDPOINTS[best][1]):
+                    best = name
+        return best, rest
+
+    def _known(self, endpoint: str, path: str) -> bool:
+        if self.known_locations is None or endpoint not in NOT_FOUND:
+            return True
+        param = NOT_FOUND[endpoint][0]
+        parts = urllib.parse.urlsplit(path)
+        if param is None:
+            location = urllib.parse.unquote(parts.path.rpartition('/')[2])
+        else:
+            location = urllib.parse.parse_qs(parts.query).get(param, [''])[0]
+        return location in self.known_locations or any(
+            len(name) > 1 and name in location for name in self.known_locations)
+
+    def _body(self, endpoint: str, rest: str) -> bytes:
+        if endpoint == 'wttr_in':
+            location = urllib.parse.unquote(rest.lstrip('/')) or 'Beijing'
+            return f"{location}: ⛅️  +28°C\n".encode('utf-8')
+        return self._bodies[endpoint]
+
+    def _count(self, endpoint: str, outcome: str):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def respond(self, path: str) -> Tuple[Optional[int], str, bytes]:
+        """返回 (状态码, Content-Type, 响应体)；状态码为None表示不响应"""
+        endpoint, rest = self.match(path)
+        if endpoint is None:
+            self._count('unknown', 'not_found')
+            return 404, 'text/plain', b'not found'
+
+        profile = self.profile_for(endpoint)
+        fault = profile.sample_fault(self._rng)
+        delay = profile.sample_latency(self._rng)
+        known = self._known(endpoint, path)
+        self._count(endpoint, fault or ('ok' if known else 'not_found'))
+
+        if fault == 'timeout':
+            self._closing.wait(profile.hang)
+            return None, '', b''
+        self._closing.wait(delay)
+        if fault == 'error':
+            return self._rng.choice((500, 502, 503, 504)), 'text/plain', b'upstream error'
+        if not known:
+            _, status, body = NOT_FOUND[endpoint]
+            return status, ENDPOINTS[endpoint][3], body
+        body = self._body(endpoint, rest)
+        if fault == 'malformed':
+            body = body[:len(body) // 2]
+        return 200, ENDPOINTS[endpoint][3], body
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """端点 -> {结果: 次数}，结果为 ok/not_found/error/timeout/malformed"""
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+    def start(self) -> 'StubUpstream':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        # 先唤醒挂起和延迟中的请求，再停止服务
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StubUpstream':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='上游天气服务的本地替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--profile', action='append', default=[], help='延迟/故障规则，可重复（格式见模块说明）')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    args = parser.parse_args(argv)
+
+    try:
+        profiles = parse_profiles(args.profile)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    stub = StubUpstream(profiles, args.host, args.port, args.seed).start()
+    print(f"上游替身服务已启动: {stub.base_url}")
+    print(f"使用: WEATHER_UPSTREAM_BASE={stub.base_url} python3 intelligent_weather_router.py 北京")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.close()
+        for endpoint, counts in sorted(stub.stats().items()):
+            print(f"{endpoint}: {counts}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
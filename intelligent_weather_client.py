@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+智能天气常驻服务的客户端
+只依赖标准库，不导入路由模块、不加载代码表，每次查询只是一次本地socket往返
+
+用法: python3 intelligent_weather_client.py <城市名称>
+      python3 intelligent_weather_client.py --stats | --ping | --shutdown
+常驻服务未启动（socket不存在或拒绝连接）时退出码为 75（EX_TEMPFAIL），调用方可以改为直接运行 intelligent_weather_router.py；
+请求已发出后等待响应超时的退出码为 124，此时常驻服务可能仍在查询，调用方不应再重复查询
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+from typing import Optional
+
+# 常驻服务不可用（无法连接）时的退出码
+EXIT_UNAVAILABLE = 75
+# 请求已发出、等待响应超时的退出码（与 timeout(1) 相同）
+EXIT_TIMEOUT = 124
+
+# 说明常驻服务没有运行的连接错误；其他错误（如权限不足）不应回退到重新查询
+UNAVAILABLE_ERRNOS = (errno.ENOENT, errno.ECONNREFUSED)
+
+# 单次请求的超时（秒）；回退链最长可能需要几十秒
+DEFAULT_CLIENT_TIMEOUT = 60.0
+
+
+class DaemonUnavailable(Exception):
+    """常驻服务未启动：socket不存在或拒绝连接"""
+
+
+class DaemonTimeout(Exception):
+    """请求已发出，等待响应超时"""
+
+
+def default_socket_path() -> str:
+    """socket路径：WEATHER_DAEMON_SOCKET > $XDG_RUNTIME_DIR/clawdbot-weather.sock > /tmp/clawdbot-weather-<uid>.sock"""
+    path = os.environ.get('WEATHER_DAEMON_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'clawdbot-weather.sock')
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join('/tmp', f'clawdbot-weather-{uid}.sock')
+
+
+def call_daemon(request: dict, path: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+    """发送一个请求（一行JSON）并读取一行JSON响应"""
+    if not hasattr(socket, 'AF_UNIX'):
+        raise DaemonUnavailable('当前平台不支持Unix socket')
+    path = path or default_socket_path()
+    if timeout is None:
+        timeout = float(os.environ.get('WEATHER_DAEMON_TIMEOUT', DEFAULT_CLIENT_TIMEOUT))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(path)
+        except OSError as e:
+            if e.errno in UNAVAILABLE_ERRNOS:
+                raise DaemonUnavailable(f"无法连接常驻服务 {path}: {e}")
+            raise
+        try:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        except socket.timeout:
+            raise DaemonTimeout(f"常驻服务 {timeout:g} 秒内没有响应")
+    finally:
+        sock.close()
+    if not line:
+        raise OSError('常驻服务关闭了连接')
+    return json.loads(line.decode('utf-8'))
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("使用方法: python3 intelligent_weather_client.py <城市名称>")
+        print("         python3 intelligent_weather_client.py --stats | --ping | --shutdown")
+        return 1
+
+    if argv[0] in ('--stats', '--ping', '--shutdown'):
+        request = {'op': argv[0][2:]}
+    else:
+        request = {'op': 'query', 'location': ' '.join(argv)}
+
+    try:
+        response = call_daemon(request)
+    except DaemonUnavailable as e:
+        print(e, file=sys.stderr)
+        return EXIT_UNAVAILABLE
+    except DaemonTimeout as e:
+        print(e, file=sys.stderr)
+        return EXIT_TIMEOUT
+    except (OSError, ValueError) as e:
+        print(f"常驻服务请求失败: {e}", file=sys.stderr)
+        return 1
+
+    if not response.get('ok'):
+        print(response.get('error', '常驻服务返回错误'), file=sys.stderr)
+        return 1
+    if request['op'] == 'query':
+        print(response['result'])
+    else:
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
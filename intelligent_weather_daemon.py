@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+智能天气常驻服务
+进程常驻，代码表、地名索引、HTTP连接池、结果缓存和服务健康统计在查询之间保持预热；
+通过本地Unix socket接收请求，每个请求和响应都是一行JSON
+
+请求:
+  {"op": "query", "location": "北京", "use_cache": true}
+  {"op": "batch", "locations": ["北京", "上海"], "workers": 16}
+  {"op": "stats"} / {"op": "ping"} / {"op": "shutdown"}
+响应:
+  {"ok": true, ...} 或 {"ok": false, "error": "..."}
+
+用法: python3 intelligent_weather_daemon.py [--socket 路径] [--quiet]
+客户端见 intelligent_weather_client.py
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+
+from backend_health import get_backend_health
+from city_code_index import get_city_code_index
+from intelligent_weather_client import DaemonTimeout, DaemonUnavailable, call_daemon, default_socket_path
+from intelligent_weather_router import (
+    DEFAULT_BATCH_WORKERS, get_geo_completer, is_china_location, load_city_codes, load_province_codes,
+    query_weather_batch, query_weather_record,
+)
+from weather_backends import get_backend_registry
+from weather_cache import get_weather_cache
+from weather_http import get_http_client
+
+
+def warm_up():
+    """启动时加载代码表、构建索引和自动机、读取配置、创建连接池"""
+    started = time.perf_counter()
+    load_city_codes()
+    load_province_codes()
+    get_city_code_index()
+    get_geo_completer()
+    is_china_location('北京')
+    get_backend_registry()
+    get_backend_health()
+    get_weather_cache()
+    get_http_client()
+    print(f"预热完成，用时 {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def _serialize(record: dict) -> dict:
+    observation = record['observation']
+    return {**record, 'observation': observation.to_dict() if observation is not None else None}
+
+
+class WeatherRequestHandler(socketserver.StreamRequestHandler):
+    """一个连接上可以依次发送多个请求，每行一个"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = self.server.dispatch(request)
+            except Exception as e:
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class WeatherDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每个连接一个线程；并发的相同查询由缓存和回退链的请求合并共享一次上游请求"""
+
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.time()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        super().__init__(path, WeatherRequestHandler)
+        os.chmod(path, 0o600)
+
+    def dispatch(self, request: dict) -> dict:
+        with self._count_lock:
+            self.requests += 1
+        op = request.get('op')
+        if op == 'query':
+            location = str(request.get('location', '')).strip()
+            if not location:
+                return {'ok': False, 'error': '缺少 location'}
+            record = query_weather_record(location, use_cache=request.get('use_cache', True))
+            return {'ok': True, **_serialize(record)}
+        if op == 'batch':
+            locations = [str(item).strip() for item in request.get('locations', []) if str(item).strip()]
+            results = query_weather_batch(locations, max_workers=int(request.get('workers', DEFAULT_BATCH_WORKERS)),
+                                          use_cache=request.get('use_cache', True))
+            return {'ok': True, 'results': [_serialize(item) for item in results]}
+        if op == 'stats':
+            return {
+                'ok': True,
+                'requests': self.requests,
+                'uptime': round(time.time() - self.started_at, 1),
+                'cache': get_weather_cache().stats(),
+                'backends': get_backend_health().snapshot(),
+            }
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'uptime': round(time.time() - self.started_at, 1)}
+        if op == 'shutdown':
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {'ok': True}
+        return {'ok': False, 'error': f"未知的请求: {op}"}
+
+
+def _claim_socket(path: str) -> bool:
+    """socket文件已存在时：有服务在监听则返回False，否则删除残留文件"""
+    if not os.path.exists(path):
+        return True
+    try:
+        call_daemon({'op': 'ping'}, path, timeout=2)
+        return False
+    except DaemonTimeout:
+        # 有服务接受了连接但暂时没有响应，不能删除它的socket
+        return False
+    except (DaemonUnavailable, OSError, ValueError):
+        os.unlink(path)
+        return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='智能天气常驻服务')
+    parser.add_argument('--socket', default=None, help='Unix socket路径（默认见 WEATHER_DAEMON_SOCKET）')
+    parser.add_argument('--quiet', action='store_true', help='不输出查询过程信息')
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print("当前平台不支持Unix socket", file=sys.stderr)
+        return 1
+
+    path = args.socket or default_socket_path()
+    if not _claim_socket(path):
+        print(f"常驻服务已在运行: {path}", file=sys.stderr)
+        return 1
+
+    if args.quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+    warm_up()
+    server = WeatherDaemon(path)
+    # SIGTERM 与 Ctrl-C 一样正常退出并删除socket文件
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    print(f"智能天气常驻服务已启动: {path} (pid {os.getpid()})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        print("智能天气常驻服务已停止", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
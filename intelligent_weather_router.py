@@ -4,14 +4,37 @@
 当无法查询到具体城市时，自动回退到省级或附近城市
 """
 
-import requests
+import argparse
+import contextlib
 import json
 import sys
+import time
 import urllib.parse
 import re
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple, Union
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+
+from backend_health import OUTCOME_OK, BackendAttempt, get_backend_health
+from city_code_index import PROVINCE_PREFIX_LEN, get_city_code_index
+from city_code_registry import CityCodeRegistry
+from daemon_executor import DaemonThreadPoolExecutor
+from geocode_cache import get_geocode_cache
+from location_matcher import AhoCorasickMatcher
+from single_flight import AsyncSingleFlight, SingleFlight
+from weather_async_http import async_fetch_wttr_in, async_http_get
+from weather_backends import CAP_CITY_CODE, CAP_FALLBACK, get_backend_registry
+from weather_cache import get_weather_cache, weather_cache_key
+from weather_com_cn_parser import parse_weather_observation
+from weather_hedge import DEFAULT_HEDGE_DELAY, MODE_HEDGED, MODE_RACE, async_run_hedged, run_hedged
+from weather_http import fetch_wttr_in, http_get
+from weather_observation import WeatherObservation, parse_temp
+from weather_trace import (CAT_CACHE, CAT_FALLBACK, CAT_PLAN, CAT_QUERY, CAT_RESOLVE, CAT_STAGE,
+                           bind_trace_context, trace_query, trace_span, traced)
+
 class GeoInfoCompleter:
     def __init__(self):
         # 地理层级关系映射
@@ -250,70 +273,55 @@ class GeoInfoCompleter:
             "星子": ["江西省", "九江市", "庐山市"],
         }
 
+        # 省份关键词
+        self.provinces = [
+            '北京', '上海', '天津', '重庆',
+            '河北', '山西', '内蒙古', '辽宁', '吉林', '黑龙江',
+            '江苏', '浙江', '安徽', '福建', '江西', '山东',
+            '河南', '湖北', '湖南', '广东', '广西', '海南',
+            '四川', '贵州', '云南', '西藏', '陕西', '甘肃', '青海', '宁夏', '新疆'
+        ]
+
+        # 把县级市、地级市和省份一次性编译进同一个自动机
+        self._matcher = AhoCorasickMatcher()
+        for county, hierarchy in self.county_cities.items():
+            self._matcher.add(county, ('county', hierarchy))
+        for city, hierarchy in self.administrative_hierarchy.items():
+            self._matcher.add(city, ('city', hierarchy))
+        for prov in self.provinces:
+            self._matcher.add(prov, ('province', prov))
+        self._matcher.build()
+
     def complete_geo_info(self, location: str) -> Tuple[str, str, str]:
         """
         补全地理位置信息
         返回: (省份, 城市, 区县)
         """
+        # 一次扫描得到所有匹配，最长的在前
+        matches = self._matcher.find_all(location)
+
         # 检查是否是县级市
-        for county, hierarchy in self.county_cities.items():
-            if county in location:
+        for match in matches:
+            kind, hierarchy = match.payload
+            if kind == 'county':
                 return tuple(hierarchy)
         
         # 检查是否是地级市
-        for city, hierarchy in self.administrative_hierarchy.items():
-            if city in location:
+        for match in matches:
+            kind, hierarchy = match.payload
+            if kind == 'city':
                 if len(hierarchy) == 1:  # 直辖市
                     return hierarchy[0], hierarchy[0], hierarchy[0]
                 elif len(hierarchy) == 2:  # 省市
                     return hierarchy[0], hierarchy[1], hierarchy[1]
         
-        # 如果无法匹配，尝试从输入中提取信息
-        province = None
-        city = None
-        district = None
+        # 如果无法匹配城市，尝试从输入中提取省份
+        for match in matches:
+            kind, prov = match.payload
+            if kind == 'province':
+                return prov, location, location
         
-        # 尝试匹配省份
-        provinces = [
-            '北京', '上海', '天津', '重庆',
-            '河北', '山西', '内蒙古', '辽宁', '吉林', '黑龙江',
-            '江苏', '浙江', '安徽', '福建', '江西', '山东',
-            '河南', '湖北', '湖南', '广东', '广西', '海南',
-            '四川', '贵州', '云南', '西藏', '陕西', '甘肃', '青海', '宁夏', '新疆'
-        ]
-        
-        for prov in provinces:
-            if prov in location:
-                province = prov
-                break
-        
-        # 尝试匹配城市
-        cities = list(self.administrative_hierarchy.keys())
-        for cit in cities:
-            if cit in location and province:
-                # 确保城市属于该省份
-                hierarchy = self.administrative_hierarchy[cit]
-                if province in hierarchy[0] if isinstance(hierarchy[0], str) else province in hierarchy:
-                    city = cit
-                    break
-        
-        # 如果城市未找到，尝试从县级市中查找
-        if not city:
-            for county in self.county_cities:
-                if county in location and province:
-                    hierarchy = self.county_cities[county]
-                    if province == hierarchy[0]:
-                        city = hierarchy[1]  # 使用所属的地级市
-                        district = hierarchy[2]
-                        break
-        
-        # 构造返回值
-        if district:
-            return province or "", city or "", district
-        elif city:
-            return province or "", city, city
-        else:
-            return province or "", location, location
+        return "", location, location
 
     def normalize_location(self, location: str) -> str:
         """
@@ -336,108 +344,30 @@ class GeoInfoCompleter:
         
         return location
 
+_geo_completer = None
+
+def get_geo_completer() -> GeoInfoCompleter:
+    """获取共享的地理信息补全器（自动机只构建一次）"""
+    global _geo_completer
+    if _geo_completer is None:
+        _geo_completer = GeoInfoCompleter()
+    return _geo_completer
+
 def load_city_codes():
-    """加载城市代码"""
-    # 尝试多个可能的路径
-    possible_paths = [
-        '/home/Tim/BotRoom/complete_china_weather_city_codes.json',
-        '/home/Tim/BotRoom/clawdbot-skills/scripts/complete_china_weather_city_codes.json',
-        '/home/Tim/BotRoom/skills_workspace/china-weather/scripts/complete_china_weather_city_codes.json',
-        './complete_china_weather_city_codes.json'
-    ]
-
-    for path in possible_paths:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    print(f"从 {path} 加载了 {len(json.load(f))} 个城市代码")
-                    f.seek(0)  # 重置文件指针
-                    return json.load(f)
-        except FileNotFoundError:
-            continue
-    
-    # 如果没有找到完整文件，使用备用字典
-    backup_codes = {
-        "北京": "101010100", "上海": "101020100", "广州": "101280101", "深圳": "101280601",
-        "杭州": "101210101", "南京": "101190101", "武汉": "101200101", "成都": "101270101",
-        "重庆": "101040100", "西安": "101110101", "天津": "101030100", "苏州": "101190401",
-        "青岛": "101120201", "大连": "101070201", "厦门": "101230201", "宁波": "101210401",
-        "长沙": "101250101", "郑州": "101180101", "济南": "101120101", "福州": "101230101",
-        "南昌": "101240101", "沈阳": "101060101", "哈尔滨": "101050101", "石家庄": "101090101",
-        "太原": "101100101", "昆明": "101290101", "南宁": "101300101", "合肥": "101220101",
-        "海口": "101310101", "兰州": "101160101", "银川": "101170101", "西宁": "101150101",
-        "拉萨": "101140101", "乌鲁木齐": "101130101", "呼和浩特": "101080101", "长春": "101060201",
-        "唐山": "101090301", "秦皇岛": "101091101", "邯郸": "101090402", "保定": "101090201",
-        "张家口": "101090301", "承德": "101090402", "沧州": "101090701", "廊坊": "101090601",
-        "衡水": "101090801", "邢台": "101090901", "晋城": "101100601", "朔州": "101100901",
-        "忻州": "101101001", "大同": "101100201", "阳泉": "101100301", "长治": "101100501",
-        "临汾": "101100701", "吕梁": "101101100", "运城": "101100801", "鞍山": "101070101",
-        "抚顺": "101070101", "本溪": "101070101", "丹东": "101070201", "锦州": "101070101",
-        "营口": "101070201", "阜新": "101070101", "辽阳": "101070101", "盘锦": "101070401",
-        "铁岭": "101070201", "朝阳": "101070101", "葫芦岛": "101070101", "吉林": "101060301",
-        "四平": "101060201", "辽源": "101060201", "通化": "101060501", "白山": "101060901",
-        "松原": "101060701", "白城": "101060601", "延边": "101060801", "齐齐哈尔": "101050201",
-        "鸡西": "101050301", "鹤岗": "101050301", "双鸭山": "101050301", "大庆": "101050901",
-        "伊春": "101050801", "牡丹江": "101050301", "佳木斯": "101050401", "七台河": "101050301",
-        "黑河": "101050601", "绥化": "101050501", "大兴安岭": "101050701"
-    }
-    print("警告: 未能加载完整城市代码文件，使用备用字典")
-    return backup_codes
+    """加载城市代码（进程内共享，只解析一次）"""
+    return CityCodeRegistry.instance().city_codes
 
 def load_province_codes():
-    """加载省份代码"""
-    # 尝试多个可能的路径
-    possible_paths = [
-        '/home/Tim/BotRoom/china_weather_province_codes.json',
-        '/home/Tim/BotRoom/clawdbot-skills/scripts/china_weather_province_codes.json',
-        '/home/Tim/BotRoom/skills_workspace/china-weather/scripts/china_weather_province_codes.json',
-        './china_weather_province_codes.json'
-    ]
-
-    for path in possible_paths:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except FileNotFoundError:
-            continue
-    
-    # 如果没有找到省份代码文件，返回空字典
-    return {}
+    """加载省份代码（进程内共享，只解析一次）"""
+    return CityCodeRegistry.instance().province_codes
 
 def find_city_code(city_name: str, city_codes: dict, province_codes: dict):
     """查找城市代码，支持城市名和省份+城市名的组合"""
-    # 首先尝试精确匹配城市名
-    if city_name in city_codes:
-        return city_codes[city_name]
-    
-    # 如果找不到，尝试查找包含该城市名的条目
-    for name, code in city_codes.items():
-        if city_name in name or name in city_name:
-            return code
-    
-    # 如果输入包含省份信息，尝试解析
-    for prov_name in province_codes:
-        if city_name.startswith(prov_name):
-            # 提取城市名部分
-            city_part = city_name[len(prov_name):]
-            if city_part:  # 如果还有剩余部分
-                # 查找以该省份代码开头且包含城市名部分的城市
-                prov_code_prefix = province_codes[prov_name]['code']
-                for name, code in city_codes.items():
-                    if code.startswith(prov_code_prefix) and city_part in name:
-                        return code
-    
-    return None
+    return get_city_code_index(city_codes, province_codes).find_city_code(city_name)
 
 def get_province_from_city_code(city_code: str, province_codes: dict):
     """从城市代码推断省份代码"""
-    if len(city_code) >= 5:
-        prov_code_prefix = city_code[:5]
-        for prov_name, prov_info in province_codes.items():
-            if prov_info['code'] == prov_code_prefix:
-                return prov_name
-    return None
+    return get_city_code_index(province_codes=province_codes).province_of_code(city_code)
 
 def find_cities_by_province(province_name: str, city_codes: dict, province_codes: dict):
     """查找省份下的所有城市"""
@@ -445,107 +375,138 @@ def find_cities_by_province(province_name: str, city_codes: dict, province_codes
         return []
     
     prov_code = province_codes[province_name]['code']
-    province_cities = []
+    return get_city_code_index(city_codes, province_codes).cities_with_prefix(prov_code)
+
+# 中国天气网请求头
+WEATHER_COM_CN_HEADERS = {
+    'Referer': 'http://www.weather.com.cn/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+NOMINATIM_HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'}
+
+# wttr.in 英文天气描述的简单翻译
+WTTR_TRANSLATIONS = {
+    'Clear': '晴', 'Sunny': '晴', 'Partly cloudy': '多云', 
+    'Cloudy': '阴', 'Overcast': '阴', 'Rain': '雨',
+    'Light rain': '小雨', 'Moderate rain': '中雨', 'Heavy rain': '大雨',
+    'Showers': '阵雨', 'Snow': '雪', 'Light snow': '小雪',
+    'Moderate snow': '中雪', 'Heavy snow': '大雪', 'Fog': '雾',
+    'Thunderstorm': '雷暴'
+}
+
+# Open-Meteo 天气代码映射
+OPENMETEO_WEATHER_MAP = {
+    0: '晴', 1: '晴间多云', 2: '阴', 3: '阴',
+    45: '雾', 48: '雾', 51: '小雨', 53: '中雨', 55: '大雨',
+    61: '小雨', 63: '中雨', 65: '大雨', 71: '小雪', 73: '中雪', 75: '大雪',
+    95: '雷暴', 96: '雷暴伴冰雹', 99: '雷暴伴大冰雹'
+}
+
+def parse_weather_com_cn_v2(content: Union[str, bytes]) -> Optional[WeatherObservation]:
+    """解析中国天气网 weather_index / sk_2d 接口返回的内容（原始字节或文本）"""
+    return parse_weather_observation(content, 'weather_com_cn_v2')
+
+def parse_weather_com_cn_v1(content: Union[str, bytes]) -> Optional[WeatherObservation]:
+    """解析中国天气网 data/sk 接口返回的内容（原始字节或文本）"""
+    return parse_weather_observation(content, 'weather_com_cn_v1')
+
+def translate_wttr_output(output: str) -> str:
+    """把wttr.in输出中的英文天气描述翻译为中文"""
+    for eng, chi in WTTR_TRANSLATIONS.items():
+        output = output.replace(eng, chi)
+    return output
+
+def parse_nominatim_coords(data) -> Optional[Tuple[float, float]]:
+    """从Nominatim搜索结果中取出第一个坐标 (纬度, 经度)"""
+    if data:
+        return float(data[0]['lat']), float(data[0]['lon'])
+    return None
+
+def parse_openmeteo_weather(city_name: str, weather_data: dict) -> WeatherObservation:
+    """解析Open-Meteo当前天气"""
+    current = weather_data['current_weather']
     
-    for city_name, city_code in city_codes.items():
-        if city_code.startswith(prov_code):
-            province_cities.append((city_name, city_code))
+    weathercode = current.get('weathercode', 0)
     
-    return province_cities
+    return WeatherObservation(
+        city_name,
+        condition=OPENMETEO_WEATHER_MAP.get(weathercode, '天气'),
+        temp=parse_temp(current['temperature']),
+        condition_code=weathercode,
+        wind_speed=parse_temp(current['windspeed']),
+        source='openmeteo',
+    )
+
+def format_openmeteo_weather(city_name: str, weather_data: dict) -> str:
+    """格式化Open-Meteo当前天气"""
+    return parse_openmeteo_weather(city_name, weather_data).render()
+
+def nominatim_search_url(city_name: str) -> str:
+    return f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(city_name)}&format=json&limit=1"
 
-def query_weather_com_cn_api_v2(city_code: str) -> Optional[str]:
+def openmeteo_forecast_url(lat: float, lon: float) -> str:
+    return f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&temperature_unit=celsius&windspeed_unit=kmh"
+
+def backend_timeout(name: str) -> float:
+    """单次请求的超时：clawdbot_weather_config.ini 中的设置，或服务声明的默认值"""
+    return get_backend_registry().timeout_for(name)
+
+def request_timeout() -> float:
+    """多次请求组成的查询中，每个请求的超时"""
+    return get_backend_registry().config.request_timeout
+
+def query_weather_com_cn_api_v2(city_code: str) -> Optional[WeatherObservation]:
     """
     使用中国天气网API v2版本
     """
     try:
         # 尝试使用新的API端点
         url = f"http://d1.weather.com.cn/weather_index/{city_code}.shtml"
-        headers = {
-            'Referer': 'http://www.weather.com.cn/',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_get(url, headers=WEATHER_COM_CN_HEADERS, timeout=backend_timeout('weather_com_cn_v2'))
         
         if response.status_code == 200:
-            content = response.text
-            # 尝试解析返回的JSON数据
-            try:
-                # 查找JSON数据部分
-                start = content.find('{')
-                end = content.rfind('}') + 1
-                if start != -1 and end != 0:
-                    json_part = content[start:end]
-                    # 尝试解析为JSON
-                    data = json.loads(json_part)
-                    
-                    # 根据可能的字段名提取数据
-                    city = data.get('city', '未知城市')
-                    temp = data.get('temp', data.get('real', {}).get('temp', '未知'))
-                    weather = data.get('weather', data.get('real', {}).get('weather', '未知'))
-                    
-                    return f"{city}: {weather} {temp}°C"
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，尝试正则表达式解析
-                temp_match = re.search(r'"temp":"([^"]*)"', content)
-                weather_match = re.search(r'"weather":"([^"]*)"', content)
-                city_match = re.search(r'"city":"([^"]*)"', content)
-                
-                if temp_match:
-                    temp = temp_match.group(1)
-                    weather = weather_match.group(1) if weather_match else "天气"
-                    city = city_match.group(1) if city_match else "城市"
-                    return f"{city}: {weather} {temp}°C"
+            return parse_weather_com_cn_v2(response.content)
         
         return None
     except Exception as e:
         print(f"API v2查询失败: {e}", file=sys.stderr)
         return None
 
-def query_weather_com_cn_api_v1(city_code: str) -> Optional[str]:
+def query_weather_com_cn_api_v1(city_code: str) -> Optional[WeatherObservation]:
     """
     使用中国天气网API v1版本（备用）
     """
     try:
         # 尝试使用旧的API端点
         url = f"http://www.weather.com.cn/data/sk/{city_code}.html"
-        headers = {
-            'Referer': 'http://www.weather.com.cn/',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_get(url, headers=WEATHER_COM_CN_HEADERS, timeout=backend_timeout('weather_com_cn_v1'))
         
         if response.status_code == 200:
-            try:
-                data = response.json()
-                real_data = data.get('data', {}).get('real', {})
-                
-                if real_data:
-                    city = real_data.get('city', '未知城市')
-                    temp = real_data.get('temp', '未知')
-                    weather = real_data.get('weather', '未知')
-                    
-                    return f"{city}: {weather} {temp}°C"
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，尝试正则表达式
-                content = response.text
-                temp_match = re.search(r'"temp":"([^"]*)"', content)
-                weather_match = re.search(r'"weather":"([^"]*)"', content)
-                city_match = re.search(r'"city":"([^"]*)"', content)
-                
-                if temp_match:
-                    temp = temp_match.group(1)
-                    weather = weather_match.group(1) if weather_match else "天气"
-                    city = city_match.group(1) if city_match else "城市"
-                    return f"{city}: {weather} {temp}°C"
+            return parse_weather_com_cn_v1(response.content)
         
         return None
     except Exception as e:
         print(f"API v1查询失败: {e}", file=sys.stderr)
         return None
 
-def query_weather_com_cn(city_name: str) -> Optional[str]:
+def query_weather_com_cn_sk_2d(city_code: str) -> Optional[WeatherObservation]:
+    """
+    使用中国天气网 sk_2d 实况接口
+    """
+    try:
+        url = f"http://d1.weather.com.cn/sk_2d/{city_code}.html"
+        response = http_get(url, headers=WEATHER_COM_CN_HEADERS, timeout=backend_timeout('sk_2d'))
+        
+        if response.status_code == 200:
+            return parse_weather_observation(response.content, 'sk_2d')
+        
+        return None
+    except Exception as e:
+        print(f"sk_2d查询失败: {e}", file=sys.stderr)
+        return None
+
+def query_weather_com_cn(city_name: str) -> Optional[WeatherObservation]:
     """
     查询中国天气网API，支持城市代码和省份代码
     """
@@ -575,196 +536,359 @@ def query_weather_com_cn(city_name: str) -> Optional[str]:
     
     return None
 
-def query_wttr_in(location: str) -> Optional[str]:
+def query_wttr_in(location: str) -> Optional[WeatherObservation]:
     """
     查询wttr.in服务（备用）
     """
     try:
-        import subprocess
-        cmd = f'curl -s "wttr.in/{location}?format=3"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-        if result.returncode == 0 and result.stdout.strip():
-            output = result.stdout.strip()
-            # 简单翻译
-            translations = {
-                'Clear': '晴', 'Sunny': '晴', 'Partly cloudy': '多云', 
-                'Cloudy': '阴', 'Overcast': '阴', 'Rain': '雨',
-                'Light rain': '小雨', 'Moderate rain': '中雨', 'Heavy rain': '大雨',
-                'Showers': '阵雨', 'Snow': '雪', 'Light snow': '小雪',
-                'Moderate snow': '中雪', 'Heavy snow': '大雪', 'Fog': '雾',
-                'Thunderstorm': '雷暴'
-            }
-            
-            for eng, chi in translations.items():
-                output = output.replace(eng, chi)
-            
-            return output
+        output = fetch_wttr_in(location, timeout=backend_timeout('wttr_in'))
+        if output:
+            return WeatherObservation.from_text(location, translate_wttr_output(output), 'wttr_in')
     except Exception:
         pass
     return None
 
-def query_openmeteo_by_city(city_name: str) -> Optional[str]:
+def geocode_city(city_name: str) -> Optional[Tuple[float, float]]:
+    """
+    通过Nominatim获取城市坐标 (纬度, 经度)
+    坐标会持久化缓存，同一地名只需查询一次
+    """
+    def lookup():
+        response = http_get(nominatim_search_url(city_name), headers=NOMINATIM_HEADERS, timeout=request_timeout())
+        if response.status_code == 200:
+            return parse_nominatim_coords(response.json())
+        return None
+    
+    return get_geocode_cache().get_or_lookup('nominatim', city_name, lookup)
+
+def query_openmeteo_by_city(city_name: str) -> Optional[WeatherObservation]:
     """
     通过城市名使用Open-Meteo服务（需要先获取坐标）
     """
     try:
         # 先获取坐标
-        geocode_url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(city_name)}&format=json&limit=1"
-        response = requests.get(geocode_url, headers={'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'})
-        
-        if response.status_code == 200 and response.json():
-            data = response.json()[0]
-            lat = float(data['lat'])
-            lon = float(data['lon'])
+        coords = geocode_city(city_name)
+        if coords:
+            lat, lon = coords
             
             # 查询天气
-            meteo_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&temperature_unit=celsius&windspeed_unit=kmh"
-            weather_response = requests.get(meteo_url)
+            weather_response = http_get(openmeteo_forecast_url(lat, lon), timeout=request_timeout())
             
             if weather_response.status_code == 200:
-                weather_data = weather_response.json()
-                current = weather_data['current_weather']
-                
-                temp = current['temperature']
-                weathercode = current.get('weathercode', 0)
-                windspeed = current['windspeed']
-                
-                # 天气代码映射
-                weather_map = {
-                    0: '晴', 1: '晴间多云', 2: '阴', 3: '阴',
-                    45: '雾', 48: '雾', 51: '小雨', 53: '中雨', 55: '大雨',
-                    61: '小雨', 63: '中雨', 65: '大雨', 71: '小雪', 73: '中雪', 75: '大雪',
-                    95: '雷暴', 96: '雷暴伴冰雹', 99: '雷暴伴大冰雹'
-                }
-                
-                desc = weather_map.get(weathercode, '天气')
-                
-                return f"{city_name}: {desc} {temp}°C 风速:{windspeed}km/h"
+                return parse_openmeteo_weather(city_name, weather_response.json())
     except Exception as e:
         print(f"Open-Meteo查询失败: {e}", file=sys.stderr)
     
     return None
 
+# 省份及特别行政区关键词
+CHINA_PROVINCE_KEYWORDS = [
+    '北京', '天津', '河北', '山西', '内蒙古', '辽宁', '吉林', '黑龙江', 
+    '上海', '江苏', '浙江', '安徽', '福建', '江西', '山东', '河南', '湖北', 
+    '湖南', '广东', '广西', '海南', '重庆', '四川', '贵州', '云南', '西藏', 
+    '陕西', '甘肃', '青海', '宁夏', '新疆', '台湾', '香港', '澳门'
+]
+
+def _build_china_location_matcher(registry: CityCodeRegistry) -> AhoCorasickMatcher:
+    """使用所有城市名称和省份名称构建中国地名自动机"""
+    matcher = AhoCorasickMatcher()
+    for keyword in registry.city_codes:
+        matcher.add(keyword.lower())
+    for prov in CHINA_PROVINCE_KEYWORDS:
+        matcher.add(prov)
+    return matcher.build()
+
+@traced(cat=CAT_RESOLVE, result='china')
 def is_china_location(location):
     """
     判断位置是否在中国境内
     """
-    # 加载城市代码
-    city_codes = load_city_codes()
+    # 城市名和省份名的自动机随代码表一起缓存
+    matcher = CityCodeRegistry.instance().derived('china_location_matcher', _build_china_location_matcher)
     
-    # 使用所有城市名称作为关键词
-    china_keywords = list(city_codes.keys())
-    
-    # 检查是否包含中国关键词
+    # 检查是否包含中国城市或省份关键词
     location_lower = location.lower()
-    for keyword in china_keywords:
-        if keyword.lower() in location_lower:
-            return True
+    if matcher.contains_any(location_lower):
+        return True
     
     # 检查是否以中国开头或结尾
     if '中国' in location or 'China' in location_lower:
         return True
     
-    # 检查省份关键词
-    provinces = [
-        '北京', '天津', '河北', '山西', '内蒙古', '辽宁', '吉林', '黑龙江', 
-        '上海', '江苏', '浙江', '安徽', '福建', '江西', '山东', '河南', '湖北', 
-        '湖南', '广东', '广西', '海南', '重庆', '四川', '贵州', '云南', '西藏', 
-        '陕西', '甘肃', '青海', '宁夏', '新疆', '台湾', '香港', '澳门'
-    ]
-    
-    for prov in provinces:
-        if prov in location:
-            return True
-    
     return False
 
-def query_fallback_weather(location: str) -> str:
+# 各省份省会城市
+PROVINCE_CAPITALS = {
+    '北京': '北京', '上海': '上海', '天津': '天津', '重庆': '重庆',
+    '河北': '石家庄', '山西': '太原', '内蒙古': '呼和浩特',
+    '辽宁': '沈阳', '吉林': '长春', '黑龙江': '哈尔滨',
+    '江苏': '南京', '浙江': '杭州', '安徽': '合肥', '福建': '福州', '江西': '南昌', '山东': '济南',
+    '河南': '郑州', '湖北': '武汉', '湖南': '长沙',
+    '广东': '广州', '广西': '南宁', '海南': '海口',
+    '四川': '成都', '贵州': '贵阳', '云南': '昆明',
+    '西藏': '拉萨', '陕西': '西安', '甘肃': '兰州', '青海': '西宁', '宁夏': '银川', '新疆': '乌鲁木齐'
+}
+
+# 回退查询执行模式: sequential（依次）/ hedged（对冲）/ race（全部同时）
+FALLBACK_MODE = os.environ.get('WEATHER_FALLBACK_MODE', MODE_HEDGED)
+# 对冲模式下，启动下一个阶段前等待的秒数
+FALLBACK_HEDGE_DELAY = float(os.environ.get('WEATHER_HEDGE_DELAY', DEFAULT_HEDGE_DELAY))
+
+# 相近城市回退最多同时查询的候选城市数
+SIMILAR_CITY_LIMIT = int(os.environ.get('WEATHER_SIMILAR_CITY_LIMIT', 3))
+
+# 回退链全部失败时的提示
+FALLBACK_FAILURE_MESSAGE = "无法获取 {location} 的天气信息，建议尝试查询省会城市或邻近城市"
+
+def _announce_backend(name: str):
+    """输出提供结果的服务名；省会、相近城市等回退策略内部已输出过程信息"""
+    backend = get_backend_registry().get(name)
+    if backend is not None and CAP_FALLBACK not in backend.capabilities:
+        print(f"使用{backend.label}")
+
+_china_weather = None
+
+def _get_china_weather():
+    """和风天气、高德地图等需要API密钥的服务由 ChinaWeather 实现；只在用到这两个服务时才导入"""
+    global _china_weather
+    if _china_weather is None:
+        from query_china_weather import ChinaWeather
+        _china_weather = ChinaWeather(use_cache=False)
+    return _china_weather
+
+def query_qweather(location: str) -> Optional[WeatherObservation]:
+    """查询和风天气（需要 QWEATHER_API_KEY）"""
+    return _get_china_weather().query_qweather(location)
+
+def query_amap_weather(location: str) -> Optional[WeatherObservation]:
+    """查询高德地图天气（需要 AMAP_API_KEY）"""
+    return _get_china_weather().query_amap_weather(location)
+
+def _query_province_capital(location: str, prov_name: str, capital: str) -> Optional[WeatherObservation]:
+    """省份+城市的形式，回退到查询省会"""
+    print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省会 {capital}")
+    result = query_weather_com_cn(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}省会]")
+    
+    # 如果省会也查不到，尝试wttr.in
+    result = query_wttr_in(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}省会] {capital}:")
+    return None
+
+def similar_city_candidates(location: str, city_code: Optional[str] = None,
+                            limit: Optional[int] = None) -> List[Tuple[str, str]]:
     """
-    智能回退天气查询
-    当无法查询到具体城市时，自动回退到省级或附近城市
+    相近城市候选 [(城市名, 城市代码)]，按相似度排序，最多 limit（默认 SIMILAR_CITY_LIMIT）个
+    位置以省份开头时只在该省份内、按去掉省份后的部分查找；已解析出的城市代码不再作为候选
+    """
+    text, prefix = location, None
+    for prov_name, prov_info in load_province_codes().items():
+        if location.startswith(prov_name) and len(location) > len(prov_name):
+            text, prefix = location[len(prov_name):], prov_info['code']
+            break
+    else:
+        if city_code:
+            prefix = city_code[:PROVINCE_PREFIX_LEN]
+    limit = SIMILAR_CITY_LIMIT if limit is None else limit
+    return get_city_code_index().similar_cities(text, limit, prefix=prefix,
+                                                exclude=(city_code,) if city_code else ())
+
+def query_weather_com_cn_by_code(city_code: str) -> Optional[WeatherObservation]:
+    """按城市代码查询中国天气网，v2失败时尝试v1"""
+    return query_weather_com_cn_api_v2(city_code) or query_weather_com_cn_api_v1(city_code)
+
+_candidate_executor: Optional[DaemonThreadPoolExecutor] = None
+
+def _get_candidate_executor() -> DaemonThreadPoolExecutor:
+    """
+    相近城市候选使用单独的线程池，回退阶段本身运行在对冲线程池中，共用会互相等待
+    与对冲线程池一样使用守护线程，落败的候选不会拖住进程退出
+    """
+    global _candidate_executor
+    if _candidate_executor is None:
+        _candidate_executor = DaemonThreadPoolExecutor(max_workers=max(1, SIMILAR_CITY_LIMIT) * 4,
+                                                       thread_name_prefix='weather-similar')
+    return _candidate_executor
+
+def _query_similar_city(location: str, city_code: Optional[str] = None) -> Optional[WeatherObservation]:
+    """具体城市名没查到时，同时查询最相近的几个城市，返回第一个有效结果"""
+    candidates = similar_city_candidates(location, city_code)
+    if not candidates:
+        return None
+    names = '、'.join(name for name, _ in candidates)
+    print(f"未找到 {location} 的具体天气，回退到查询相近城市 {names}")
+    _, result = run_hedged([(name, partial(query_weather_com_cn_by_code, code)) for name, code in candidates],
+                           mode=MODE_RACE, executor=_get_candidate_executor())
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示相近城市]")
+    return None
+
+def _query_province_wttr(location: str, prov_name: str, capital: str) -> Optional[WeatherObservation]:
+    """最后的回退：查询省份（省会）天气"""
+    print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省份天气")
+    result = query_wttr_in(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}] {capital}:")
+    return None
+
+# 服务名 -> 同步查询函数；服务的成本、超时和能力声明见 scripts/weather_backends.py
+FALLBACK_STAGE_FUNCS = {
+    'weather_com_cn_v2': query_weather_com_cn_api_v2,
+    'weather_com_cn_v1': query_weather_com_cn_api_v1,
+    'sk_2d': query_weather_com_cn_sk_2d,
+    'qweather': query_qweather,
+    'amap': query_amap_weather,
+    'wttr_in': query_wttr_in,
+    'province_capital': _query_province_capital,
+    'similar_city': _query_similar_city,
+    'openmeteo': query_openmeteo_by_city,
+    'province_wttr': _query_province_wttr,
+}
+
+def _plan_stage_args(name: str, location: str, city_code: Optional[str],
+                     province_codes: dict) -> List[tuple]:
+    """一个服务在回退链中的调用参数；同一服务可以有多组参数（如多个匹配的省份），也可以没有"""
+    if name == 'province_capital':
+        # 省份+城市的形式，查询省会
+        return [(location, prov_name, PROVINCE_CAPITALS[prov_name]) for prov_name in province_codes
+                if location.startswith(prov_name) and prov_name in PROVINCE_CAPITALS]
+    if name == 'province_wttr':
+        # 最后的回退：查询省份
+        return [(location, prov_name, PROVINCE_CAPITALS[prov_name]) for prov_name in province_codes
+                if prov_name in location and prov_name in PROVINCE_CAPITALS]
+    if name == 'similar_city':
+        return [(location, city_code)]
+    if CAP_CITY_CODE in get_backend_registry().get(name).capabilities:
+        return [(city_code,)] if city_code else []
+    return [(location,)]
+
+# 境外位置可用的服务（均按地名查询）
+INTERNATIONAL_STAGE_FUNCS = {
+    'wttr_in': query_wttr_in,
+    'openmeteo': query_openmeteo_by_city,
+    'qweather': query_qweather,
+}
+
+def _adaptive_backend(name: str) -> bool:
+    """直接请求上游的服务参与健康统计和动态排序；组合回退策略保持在回退链中的位置"""
+    backend = get_backend_registry().get(name)
+    return backend is not None and CAP_FALLBACK not in backend.capabilities
+
+def _observe_stage(name: str, latency: float, outcome: str):
+    """记录一次服务调用的耗时和结果，供动态排序和熔断使用；只有上游错误计为失败，地名查不到不计"""
+    if _adaptive_backend(name):
+        get_backend_health().record(name, latency, outcome)
+
+@traced('plan', CAT_PLAN)
+def plan_fallback_stages(location: str) -> List[Tuple[str, tuple]]:
+    """
+    按 clawdbot_weather_config.ini 中 [china_weather] fallback_chain 的顺序规划回退查询的各个阶段
+    返回 [(阶段名, 参数)]，同步和asyncio版本共用同一份规划
+    熔断中的服务会被跳过，近期变慢或频繁失败的服务排到健康服务之后（见 backend_health.py）
     """
     city_codes = load_city_codes()
     province_codes = load_province_codes()
     
-    # 首先尝试直接查询
-    direct_result = query_weather_com_cn(location)
-    if direct_result:
-        return direct_result
-    
-    # 如果直接查询失败，尝试wttr.in
-    wttr_result = query_wttr_in(location)
-    if wttr_result:
-        return wttr_result
-    
-    # 如果城市名查询失败，尝试提取省份信息并查询省会
-    for prov_name in province_codes:
-        if location.startswith(prov_name):
-            # 如果是省份+城市的形式，尝试查询省会
-            capital_mapping = {
-                '北京': '北京', '上海': '上海', '天津': '天津', '重庆': '重庆',
-                '河北': '石家庄', '山西': '太原', '内蒙古': '呼和浩特',
-                '辽宁': '沈阳', '吉林': '长春', '黑龙江': '哈尔滨',
-                '江苏': '南京', '浙江': '杭州', '安徽': '合肥', '福建': '福州', '江西': '南昌', '山东': '济南',
-                '河南': '郑州', '湖北': '武汉', '湖南': '长沙',
-                '广东': '广州', '广西': '南宁', '海南': '海口',
-                '四川': '成都', '贵州': '贵阳', '云南': '昆明',
-                '西藏': '拉萨', '陕西': '西安', '甘肃': '兰州', '青海': '西宁', '宁夏': '银川', '新疆': '乌鲁木齐'
-            }
-            
-            if prov_name in capital_mapping:
-                capital = capital_mapping[prov_name]
-                print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省会 {capital}")
-                result = query_weather_com_cn(capital)
-                if result:
-                    return f"[{location} 天气暂无，显示{prov_name}省会] {result}"
-                
-                # 如果省会也查不到，尝试wttr.in
-                result = query_wttr_in(capital)
-                if result:
-                    return f"[{location} 天气暂无，显示{prov_name}省会] {capital}: {result}"
-    
-    # 如果是具体城市名但没查到，尝试查找相近的城市
-    for city_name in city_codes:
-        if location in city_name or city_name in location:
-            print(f"未找到 {location} 的具体天气，回退到查询相近城市 {city_name}")
-            result = query_weather_com_cn(city_name)
-            if result:
-                return f"[{location} 天气暂无，显示相近城市] {result}"
-    
-    # 如果以上都失败，尝试Open-Meteo
-    openmeteo_result = query_openmeteo_by_city(location)
-    if openmeteo_result:
-        return openmeteo_result
-    
-    # 最后的回退：尝试查询省份
-    for prov_name in province_codes:
-        if prov_name in location:
-            capital_mapping = {
-                '北京': '北京', '上海': '上海', '天津': '天津', '重庆': '重庆',
-                '河北': '石家庄', '山西': '太原', '内蒙古': '呼和浩特',
-                '辽宁': '沈阳', '吉林': '长春', '黑龙江': '哈尔滨',
-                '江苏': '南京', '浙江': '杭州', '安徽': '合肥', '福建': '福州', '江西': '南昌', '山东': '济南',
-                '河南': '郑州', '湖北': '武汉', '湖南': '长沙',
-                '广东': '广州', '广西': '南宁', '海南': '海口',
-                '四川': '成都', '贵州': '贵阳', '云南': '昆明',
-                '西藏': '拉萨', '陕西': '西安', '甘肃': '兰州', '青海': '西宁', '宁夏': '银川', '新疆': '乌鲁木齐'
-            }
-            
-            if prov_name in capital_mapping:
-                capital = capital_mapping[prov_name]
-                print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省份天气")
-                result = query_wttr_in(capital)
-                if result:
-                    return f"[{location} 天气暂无，显示{prov_name}] {capital}: {result}"
+    city_code = find_city_code(location, city_codes, province_codes)
+    if city_code:
+        print(f"使用城市代码: {city_code} 查询 {location}")
     
-    return f"无法获取 {location} 的天气信息，建议尝试查询省会城市或邻近城市"
+    plan = []
+    for name in get_backend_registry().china_fallback_chain(FALLBACK_STAGE_FUNCS):
+        for args in _plan_stage_args(name, location, city_code, province_codes):
+            plan.append((name, args))
+    return get_backend_health().order(plan, key=lambda stage: stage[0], adaptive=_adaptive_backend)
 
+def international_service_plan(functions: dict) -> List[str]:
+    """境外位置的服务顺序：配置中的 [international_weather] service_priority，按健康状况调整"""
+    names = get_backend_registry().international_service_priority(functions)
+    return get_backend_health().order(names)
+
+# 并发执行的相同阶段（同一服务、同一参数，如同一城市代码）合并为一次上游请求
+_stage_flight = SingleFlight()
+_async_stage_flight = AsyncSingleFlight()
+
+def build_fallback_stages(location: str) -> List[Tuple[str, Callable[[], Optional[WeatherObservation]]]]:
+    """
+    按优先级构造回退查询的各个阶段
+    返回 [(阶段名, 无参查询函数)]
+    """
+    return [(name, partial(_stage_flight.do, (name,) + args, partial(FALLBACK_STAGE_FUNCS[name], *args)))
+            for name, args in plan_fallback_stages(location)]
+
+class _StageRecorder:
+    """执行器的observer：记录健康统计，同时按完成顺序记下没有得到结果的阶段（出错或查不到）"""
+
+    def __init__(self):
+        self.failed: List[str] = []
+
+    def __call__(self, name: str, latency: float, outcome: str):
+        _observe_stage(name, latency, outcome)
+        if outcome != OUTCOME_OK:
+            self.failed.append(name)
+
+def _remember_failure(location: str, china: bool, stages: List[str]):
+    """把失败的查询写入负缓存，短时间内重复查询同一位置不再请求上游"""
+    get_weather_cache().put_negative(result_cache_key(location, china), stages)
+
+def _recent_failure(location: str, china: bool) -> bool:
+    """位置近期是否查询失败过（负缓存未过期）"""
+    entry = get_weather_cache().get_negative(result_cache_key(location, china))
+    if entry is None:
+        return False
+    stage = get_backend_registry().label(entry.last_stage) if entry.last_stage else '无可用服务'
+    print(f"{location} 近期查询失败（最后尝试: {stage}），暂不重试")
+    return True
+
+def _run_fallback(location: str, mode: Optional[str] = None,
+                  hedge_delay: Optional[float] = None) -> Tuple[Optional[str], Optional[WeatherObservation]]:
+    """执行回退链，返回 (获胜阶段名, 结果)，全部失败时为 (None, None) 并写入负缓存"""
+    recorder = _StageRecorder()
+    with trace_span('fallback', CAT_FALLBACK, mode=mode or FALLBACK_MODE) as fallback_span:
+        stages = build_fallback_stages(location)
+        name, result = run_hedged(
+            stages,
+            mode=mode or FALLBACK_MODE,
+            hedge_delay=FALLBACK_HEDGE_DELAY if hedge_delay is None else hedge_delay,
+            observer=recorder,
+        )
+        fallback_span.set(stages=len(stages), winner=name)
+    if result:
+        _announce_backend(name)
+    else:
+        _remember_failure(location, True, recorder.failed)
+    return name, result
+
+def query_fallback_weather(location: str, mode: Optional[str] = None,
+                           hedge_delay: Optional[float] = None, use_cache: bool = True) -> str:
+    """
+    智能回退天气查询
+    当无法查询到具体城市时，自动回退到省级或附近城市
+    mode 为 sequential 时依次尝试；hedged 时先启动首选服务，超过 hedge_delay 秒
+    仍无结果再启动下一个；race 时同时启动全部服务。均返回第一个有效结果，
+    同时完成时按原有优先级取舍
+    全部失败的位置会记入负缓存，use_cache 为True时有效期内直接返回失败信息
+    """
+    with trace_query('fallback_query', location=location) as query_span:
+        if use_cache and _recent_failure(location, True):
+            query_span.set(negative_cache=True)
+            return FALLBACK_FAILURE_MESSAGE.format(location=location)
+        
+        name, result = _run_fallback(location, mode, hedge_delay)
+        query_span.set(backend=name)
+        if result:
+            return result.render()
+    
+    return FALLBACK_FAILURE_MESSAGE.format(location=location)
+
+@traced('geo_completion', CAT_RESOLVE, result='query')
 def enhance_weather_query_with_geo_completion(original_location: str) -> str:
     """
     结合地理信息补全的天气查询
     """
-    completer = GeoInfoCompleter()
+    completer = get_geo_completer()
     
     # 补全地理信息
     province, city, district = completer.complete_geo_info(original_location)
@@ -790,10 +914,72 @@ def enhance_weather_query_with_geo_completion(original_location: str) -> str:
         # 最后使用原始位置
         return original_location
 
-def query_china_weather(location: str) -> str:
+def result_cache_key(enhanced_location: str, china: bool) -> str:
+    """结果缓存键：中国境内位置按解析出的城市代码，境外位置按地名"""
+    if china:
+        city_code = find_city_code(enhanced_location, load_city_codes(), load_province_codes())
+        return weather_cache_key(enhanced_location, city_code)
+    return weather_cache_key(enhanced_location)
+
+def render_query_result(observation: Optional[WeatherObservation], enhanced_location: str, china: bool) -> str:
+    """把查询结果渲染为输出文本；查询失败时返回提示信息"""
+    if observation is not None:
+        return observation.render()
+    if china:
+        return FALLBACK_FAILURE_MESSAGE.format(location=enhanced_location)
+    return f"无法获取 {enhanced_location} 的天气信息"
+
+# 结果缓存中回退说明里查询位置的占位符
+NOTE_LOCATION_PLACEHOLDER = '{location}'
+
+def _detach_note(result: WeatherObservation, enhanced_location: str) -> WeatherObservation:
     """
-    综合查询中国天气（带智能回退和地理信息补全）
+    回退说明以查询位置开头（如 "[浙江嘉兴市 天气暂无，…]"），而结果按城市代码缓存、由多个位置共用，
+    缓存前把说明中的查询位置换成占位符
+    """
+    if not result.note:
+        return result
+    return result.replace(note=result.note.replace(enhanced_location, NOTE_LOCATION_PLACEHOLDER, 1))
+
+def _attach_note(observation: Optional[WeatherObservation], enhanced_location: str) -> Optional[WeatherObservation]:
+    """从缓存或查询取出结果后，把回退说明中的占位符换成本次查询的位置"""
+    if observation is None or not observation.note or NOTE_LOCATION_PLACEHOLDER not in observation.note:
+        return observation
+    return observation.replace(note=observation.note.replace(NOTE_LOCATION_PLACEHOLDER, enhanced_location, 1))
+
+def _query_resolved_location(enhanced_location: str,
+                             china: bool) -> Tuple[Optional[WeatherObservation], Optional[str]]:
     """
+    查询已补全的位置，返回 (观测结果, 提供结果的服务名)
+    观测结果的回退说明中查询位置为占位符，调用方用 _attach_note 填入
+    查询失败时均为None，结果不会被缓存，只在负缓存中记下失败的阶段
+    """
+    if china:
+        name, result = _run_fallback(enhanced_location)
+        if result:
+            return _detach_note(result, enhanced_location), name
+        return None, None
+    
+    # 境外位置按 [international_weather] service_priority 依次尝试
+    recorder = _StageRecorder()
+    with trace_span('international', CAT_FALLBACK) as fallback_span:
+        for name in international_service_plan(INTERNATIONAL_STAGE_FUNCS):
+            started = time.monotonic()
+            with trace_span(name, CAT_STAGE) as stage_span, BackendAttempt() as attempt:
+                result = INTERNATIONAL_STAGE_FUNCS[name](enhanced_location)
+            outcome = attempt.outcome(bool(result))
+            stage_span.set(outcome=outcome)
+            recorder(name, time.monotonic() - started, outcome)
+            if result:
+                fallback_span.set(winner=name)
+                _announce_backend(name)
+                return result, name
+    
+    _remember_failure(enhanced_location, False, recorder.failed)
+    return None, None
+
+def _resolve_query_location(location: str) -> Tuple[str, bool]:
+    """补全位置并判断是否在中国境内，返回 (补全后的位置, 是否境内)"""
     print(f"正在查询: {location}")
     
     # 使用地理信息补全功能增强查询
@@ -801,32 +987,491 @@ def query_china_weather(location: str) -> str:
     if enhanced_location != location:
         print(f"位置信息已增强，使用: {enhanced_location}")
     
-    if is_china_location(enhanced_location):
+    china = is_china_location(enhanced_location)
+    if china:
         print("检测到中国境内位置，使用中国天气服务...")
-        return query_fallback_weather(enhanced_location)
     else:
         print("检测到境外位置，使用国际天气服务...")
-        # 尝试wttr.in
-        result = query_wttr_in(enhanced_location)
-        if result:
-            print("使用wttr.in服务")
-            return result
+    return enhanced_location, china
+
+def _cache_backend(fetched: Tuple[Optional[WeatherObservation], Optional[str]]) -> Tuple[Optional[WeatherObservation], Optional[str]]:
+    """
+    把 (观测结果, 阶段名) 转为写入结果缓存的 (观测结果, 服务名)，缓存按服务名决定有效期：
+    省会、相近城市等组合阶段没有单独设置有效期时，按其中实际应答的服务（观测结果的来源）
+    """
+    observation, name = fetched
+    if observation is not None and observation.source and name not in get_weather_cache().backend_ttls:
+        return observation, observation.source
+    return fetched
+
+def _observe_resolved_location(enhanced_location: str, china: bool,
+                               use_cache: bool = True) -> Optional[WeatherObservation]:
+    fetch = partial(_query_resolved_location, enhanced_location, china)
+    if not use_cache:
+        return _attach_note(fetch()[0], enhanced_location)
+    # 命中时这个阶段下没有子阶段
+    with trace_span('result_cache', CAT_CACHE):
+        observation = get_weather_cache().get_or_fetch(result_cache_key(enhanced_location, china),
+                                                       lambda: _cache_backend(fetch()))
+    return _attach_note(observation, enhanced_location)
+
+def _trace_observation(query_span, observation: Optional[WeatherObservation]):
+    """在查询的根阶段记下结果来源"""
+    query_span.set(backend=observation.source if observation is not None else None)
+
+def query_weather_observation(location: str, use_cache: bool = True) -> Optional[WeatherObservation]:
+    """
+    与 query_china_weather 相同，但返回观测结果对象，查询失败时返回None
+    """
+    with trace_query(location=location) as query_span:
+        observation = _observe_resolved_location(*_resolve_query_location(location), use_cache)
+        _trace_observation(query_span, observation)
+    return observation
+
+def query_china_weather(location: str, use_cache: bool = True) -> str:
+    """
+    综合查询中国天气（带智能回退和地理信息补全）
+    use_cache 为True时，同一城市在有效期内直接返回缓存结果
+    开启追踪时（weather_trace.tracing() 或 WEATHER_TRACE）记录各阶段的耗时
+    """
+    with trace_query(location=location) as query_span:
+        enhanced_location, china = _resolve_query_location(location)
+        observation = _observe_resolved_location(enhanced_location, china, use_cache)
+        _trace_observation(query_span, observation)
+    return render_query_result(observation, enhanced_location, china)
+
+def query_weather_record(location: str, use_cache: bool = True) -> dict:
+    """
+    查询单个位置，返回与 query_weather_batch 单条结果相同的字典
+    backend 为观测结果的来源服务，查询失败时为None
+    """
+    with trace_query(location=location) as query_span:
+        enhanced_location, china = _resolve_query_location(location)
+        observation = _observe_resolved_location(enhanced_location, china, use_cache)
+        _trace_observation(query_span, observation)
+    return {
+        'location': location,
+        'query': enhanced_location,
+        'china': china,
+        'key': result_cache_key(enhanced_location, china),
+        'observation': observation,
+        'result': render_query_result(observation, enhanced_location, china),
+        'backend': observation.source if observation is not None else None,
+    }
+
+# ---------------------------------------------------------------------------
+# asyncio 接口
+# 与同步版本共用位置补全、代码表索引、回退规划和响应解析，只把网络请求换成非阻塞调用
+# ---------------------------------------------------------------------------
+
+async def async_query_weather_com_cn_api_v2(city_code: str) -> Optional[WeatherObservation]:
+    """query_weather_com_cn_api_v2 的asyncio版本"""
+    try:
+        url = f"http://d1.weather.com.cn/weather_index/{city_code}.shtml"
+        response = await async_http_get(url, headers=WEATHER_COM_CN_HEADERS,
+                                        timeout=backend_timeout('weather_com_cn_v2'))
+        if response.status_code == 200:
+            return parse_weather_com_cn_v2(response.content)
+        return None
+    except Exception as e:
+        print(f"API v2查询失败: {e}", file=sys.stderr)
+        return None
+
+async def async_query_weather_com_cn_api_v1(city_code: str) -> Optional[WeatherObservation]:
+    """query_weather_com_cn_api_v1 的asyncio版本"""
+    try:
+        url = f"http://www.weather.com.cn/data/sk/{city_code}.html"
+        response = await async_http_get(url, headers=WEATHER_COM_CN_HEADERS,
+                                        timeout=backend_timeout('weather_com_cn_v1'))
+        if response.status_code == 200:
+            return parse_weather_com_cn_v1(response.content)
+        return None
+    except Exception as e:
+        print(f"API v1查询失败: {e}", file=sys.stderr)
+        return None
+
+async def async_query_weather_com_cn_sk_2d(city_code: str) -> Optional[WeatherObservation]:
+    """query_weather_com_cn_sk_2d 的asyncio版本"""
+    try:
+        url = f"http://d1.weather.com.cn/sk_2d/{city_code}.html"
+        response = await async_http_get(url, headers=WEATHER_COM_CN_HEADERS, timeout=backend_timeout('sk_2d'))
+        if response.status_code == 200:
+            return parse_weather_observation(response.content, 'sk_2d')
+        return None
+    except Exception as e:
+        print(f"sk_2d查询失败: {e}", file=sys.stderr)
+        return None
+
+async def async_query_qweather(location: str) -> Optional[WeatherObservation]:
+    """和风天气的asyncio版本，在线程池中调用同步实现"""
+    import asyncio
+    return await asyncio.to_thread(query_qweather, location)
+
+async def async_query_amap_weather(location: str) -> Optional[WeatherObservation]:
+    """高德地图天气的asyncio版本，在线程池中调用同步实现"""
+    import asyncio
+    return await asyncio.to_thread(query_amap_weather, location)
+
+async def async_query_weather_com_cn(city_name: str) -> Optional[WeatherObservation]:
+    """query_weather_com_cn 的asyncio版本"""
+    city_code = find_city_code(city_name, load_city_codes(), load_province_codes())
+    if not city_code:
+        return None
+    
+    print(f"使用城市代码: {city_code} 查询 {city_name}")
+    
+    result = await async_query_weather_com_cn_api_v2(city_code)
+    if result:
+        print("使用中国天气网API v2")
+        return result
+    
+    result = await async_query_weather_com_cn_api_v1(city_code)
+    if result:
+        print("使用中国天气网API v1")
+        return result
+    
+    return None
+
+async def async_query_wttr_in(location: str) -> Optional[WeatherObservation]:
+    """query_wttr_in 的asyncio版本"""
+    try:
+        output = await async_fetch_wttr_in(location, timeout=backend_timeout('wttr_in'))
+        if output:
+            return WeatherObservation.from_text(location, translate_wttr_output(output), 'wttr_in')
+    except Exception:
+        pass
+    return None
+
+async def async_geocode_city(city_name: str) -> Optional[Tuple[float, float]]:
+    """geocode_city 的asyncio版本"""
+    cache = get_geocode_cache()
+    coords = cache.get('nominatim', city_name)
+    if coords is None:
+        response = await async_http_get(nominatim_search_url(city_name), headers=NOMINATIM_HEADERS,
+                                        timeout=request_timeout())
+        if response.status_code == 200:
+            coords = parse_nominatim_coords(response.json())
+            if coords:
+                cache.put('nominatim', city_name, coords)
+    return coords
+
+async def async_query_openmeteo_by_city(city_name: str) -> Optional[WeatherObservation]:
+    """query_openmeteo_by_city 的asyncio版本"""
+    try:
+        coords = await async_geocode_city(city_name)
+        if coords:
+            lat, lon = coords
+            weather_response = await async_http_get(openmeteo_forecast_url(lat, lon), timeout=request_timeout())
+            if weather_response.status_code == 200:
+                return parse_openmeteo_weather(city_name, weather_response.json())
+    except Exception as e:
+        print(f"Open-Meteo查询失败: {e}", file=sys.stderr)
+    
+    return None
+
+async def _async_query_province_capital(location: str, prov_name: str,
+                                        capital: str) -> Optional[WeatherObservation]:
+    print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省会 {capital}")
+    result = await async_query_weather_com_cn(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}省会]")
+    
+    result = await async_query_wttr_in(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}省会] {capital}:")
+    return None
+
+async def async_query_weather_com_cn_by_code(city_code: str) -> Optional[WeatherObservation]:
+    """query_weather_com_cn_by_code 的asyncio版本"""
+    return (await async_query_weather_com_cn_api_v2(city_code)
+            or await async_query_weather_com_cn_api_v1(city_code))
+
+async def _async_query_similar_city(location: str, city_code: Optional[str] = None) -> Optional[WeatherObservation]:
+    candidates = similar_city_candidates(location, city_code)
+    if not candidates:
+        return None
+    names = '、'.join(name for name, _ in candidates)
+    print(f"未找到 {location} 的具体天气，回退到查询相近城市 {names}")
+    _, result = await async_run_hedged(
+        [(name, partial(async_query_weather_com_cn_by_code, code)) for name, code in candidates],
+        mode=MODE_RACE,
+    )
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示相近城市]")
+    return None
+
+async def _async_query_province_wttr(location: str, prov_name: str,
+                                     capital: str) -> Optional[WeatherObservation]:
+    print(f"未找到 {location} 的具体天气，回退到查询 {prov_name} 省份天气")
+    result = await async_query_wttr_in(capital)
+    if result:
+        return result.replace(note=f"[{location} 天气暂无，显示{prov_name}] {capital}:")
+    return None
+
+# 服务名 -> asyncio查询函数
+ASYNC_FALLBACK_STAGE_FUNCS = {
+    'weather_com_cn_v2': async_query_weather_com_cn_api_v2,
+    'weather_com_cn_v1': async_query_weather_com_cn_api_v1,
+    'sk_2d': async_query_weather_com_cn_sk_2d,
+    'qweather': async_query_qweather,
+    'amap': async_query_amap_weather,
+    'wttr_in': async_query_wttr_in,
+    'province_capital': _async_query_province_capital,
+    'similar_city': _async_query_similar_city,
+    'openmeteo': async_query_openmeteo_by_city,
+    'province_wttr': _async_query_province_wttr,
+}
+
+ASYNC_INTERNATIONAL_STAGE_FUNCS = {
+    'wttr_in': async_query_wttr_in,
+    'openmeteo': async_query_openmeteo_by_city,
+    'qweather': async_query_qweather,
+}
+
+async def _async_run_fallback(location: str, mode: Optional[str] = None,
+                              hedge_delay: Optional[float] = None,
+                              timeouts: Optional[dict] = None) -> Tuple[Optional[str], Optional[WeatherObservation]]:
+    """_run_fallback 的asyncio版本"""
+    recorder = _StageRecorder()
+    with trace_span('fallback', CAT_FALLBACK, mode=mode or FALLBACK_MODE) as fallback_span:
+        stages = [(name, partial(_async_stage_flight.do, (name,) + args,
+                                 partial(ASYNC_FALLBACK_STAGE_FUNCS[name], *args)))
+                  for name, args in plan_fallback_stages(location)]
+        name, result = await async_run_hedged(
+            stages,
+            mode=mode or FALLBACK_MODE,
+            hedge_delay=FALLBACK_HEDGE_DELAY if hedge_delay is None else hedge_delay,
+            timeouts={**get_backend_registry().stage_timeouts(), **(timeouts or {})},
+            observer=recorder,
+        )
+        fallback_span.set(stages=len(stages), winner=name)
+    if result:
+        _announce_backend(name)
+    else:
+        _remember_failure(location, True, recorder.failed)
+    return name, result
+
+async def async_query_fallback_weather(location: str, mode: Optional[str] = None,
+                                       hedge_delay: Optional[float] = None,
+                                       timeouts: Optional[dict] = None, use_cache: bool = True) -> str:
+    """
+    query_fallback_weather 的asyncio版本
+    timeouts 可按阶段名覆盖配置中的超时；得到结果后其余阶段会被取消
+    """
+    with trace_query('fallback_query', location=location) as query_span:
+        if use_cache and _recent_failure(location, True):
+            query_span.set(negative_cache=True)
+            return FALLBACK_FAILURE_MESSAGE.format(location=location)
         
-        # 如果wttr.in失败，尝试Open-Meteo
-        result = query_openmeteo_by_city(enhanced_location)
+        name, result = await _async_run_fallback(location, mode, hedge_delay, timeouts)
+        query_span.set(backend=name)
+        if result:
+            return result.render()
+    
+    return FALLBACK_FAILURE_MESSAGE.format(location=location)
+
+async def _async_query_resolved_location(enhanced_location: str, china: bool,
+                                         **fallback_options) -> Tuple[Optional[WeatherObservation], Optional[str]]:
+    """_query_resolved_location 的asyncio版本"""
+    if china:
+        name, result = await _async_run_fallback(enhanced_location, **fallback_options)
         if result:
-            print("使用Open-Meteo服务")
-            return result
+            return _detach_note(result, enhanced_location), name
+        return None, None
+    
+    recorder = _StageRecorder()
+    with trace_span('international', CAT_FALLBACK) as fallback_span:
+        for name in international_service_plan(ASYNC_INTERNATIONAL_STAGE_FUNCS):
+            started = time.monotonic()
+            with trace_span(name, CAT_STAGE) as stage_span, BackendAttempt() as attempt:
+                result = await ASYNC_INTERNATIONAL_STAGE_FUNCS[name](enhanced_location)
+            outcome = attempt.outcome(bool(result))
+            stage_span.set(outcome=outcome)
+            recorder(name, time.monotonic() - started, outcome)
+            if result:
+                fallback_span.set(winner=name)
+                _announce_backend(name)
+                return result, name
+    
+    _remember_failure(enhanced_location, False, recorder.failed)
+    return None, None
+
+async def _async_observe_resolved_location(enhanced_location: str, china: bool, use_cache: bool = True,
+                                           **fallback_options) -> Optional[WeatherObservation]:
+    fetch = partial(_async_query_resolved_location, enhanced_location, china, **fallback_options)
+    if not use_cache:
+        return _attach_note((await fetch())[0], enhanced_location)
+    
+    async def cached_fetch():
+        return _cache_backend(await fetch())
+    
+    with trace_span('result_cache', CAT_CACHE):
+        observation = await get_weather_cache().async_get_or_fetch(result_cache_key(enhanced_location, china),
+                                                                   cached_fetch)
+    return _attach_note(observation, enhanced_location)
+
+async def async_query_weather_observation(location: str, use_cache: bool = True,
+                                          **fallback_options) -> Optional[WeatherObservation]:
+    """query_weather_observation 的asyncio版本"""
+    with trace_query(location=location) as query_span:
+        # 位置补全和境内判断都是纯内存计算，无需放入线程
+        enhanced_location, china = _resolve_query_location(location)
+        observation = await _async_observe_resolved_location(enhanced_location, china, use_cache,
+                                                             **fallback_options)
+        _trace_observation(query_span, observation)
+    return observation
+
+async def async_query_china_weather(location: str, use_cache: bool = True, **fallback_options) -> str:
+    """
+    query_china_weather 的asyncio版本，可在事件循环中直接await
+    fallback_options 透传给 async_query_fallback_weather（mode、hedge_delay、timeouts）
+    """
+    with trace_query(location=location) as query_span:
+        # 位置补全和境内判断都是纯内存计算，无需放入线程
+        enhanced_location, china = _resolve_query_location(location)
+        observation = await _async_observe_resolved_location(enhanced_location, china, use_cache,
+                                                             **fallback_options)
+        _trace_observation(query_span, observation)
+    return render_query_result(observation, enhanced_location, china)
+
+# ---------------------------------------------------------------------------
+# 批量查询
+# ---------------------------------------------------------------------------
+
+DEFAULT_BATCH_WORKERS = 16
+
+def query_weather_batch(locations: List[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                        use_cache: bool = True) -> List[dict]:
+    """
+    批量查询多个位置的天气，结果顺序与输入一致
+    相同的输入只补全一次，解析到同一城市代码的输入只查询一次，
+    不同城市的网络请求在最多 max_workers 个线程中并发执行
+    每条结果: {"location", "query", "china", "key", "observation", "result", "backend"}
+    observation 为观测结果对象（失败时为None），result 为渲染后的文本；
+    backend 为提供结果的服务名；来自缓存时为 "cache"；查询失败（包括命中负缓存）时为None
+    开启追踪时整批是一个trace，每个城市的查询是其中的一个阶段
+    """
+    with trace_query('batch', locations=len(locations)):
+        return _query_weather_batch(locations, max_workers, use_cache)
+
+def _query_weather_batch(locations: List[str], max_workers: int, use_cache: bool) -> List[dict]:
+    # 批量补全地理信息（纯内存计算）
+    resolved = {}
+    for location in dict.fromkeys(locations):
+        enhanced_location = enhance_weather_query_with_geo_completion(location)
+        china = is_china_location(enhanced_location)
+        resolved[location] = (enhanced_location, china, result_cache_key(enhanced_location, china))
+    
+    # 按缓存键去重，每个城市只查询一次
+    jobs = {}
+    for enhanced_location, china, key in resolved.values():
+        jobs.setdefault(key, (enhanced_location, china))
+    
+    cache = get_weather_cache()
+    
+    def run(key: str, enhanced_location: str, china: bool) -> Tuple[Optional[WeatherObservation], Optional[str]]:
+        if not use_cache:
+            return _query_resolved_location(enhanced_location, china)
+        fetched = {}
         
-        return f"无法获取 {enhanced_location} 的天气信息"
+        def fetch():
+            fetched['result'] = _query_resolved_location(enhanced_location, china)
+            return _cache_backend(fetched['result'])
+        
+        result = cache.get_or_fetch(key, fetch)
+        if 'result' in fetched:
+            return fetched['result']
+        if result is None:
+            # 负缓存命中：近期查询失败过
+            return None, None
+        return result, 'cache'
+    
+    def traced_run(key: str, enhanced_location: str, china: bool) -> Tuple[Optional[WeatherObservation], Optional[str]]:
+        with trace_span(enhanced_location, CAT_QUERY, key=key) as job_span:
+            answer = run(key, enhanced_location, china)
+            job_span.set(backend=answer[1])
+            return answer
+    
+    answers = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='weather-batch') as executor:
+        futures = {executor.submit(bind_trace_context(traced_run), key, *job): key for key, job in jobs.items()}
+        for future, key in futures.items():
+            try:
+                answers[key] = future.result()
+            except Exception as e:
+                print(f"查询 {jobs[key][0]} 失败: {e}", file=sys.stderr)
+                answers[key] = (None, None)
+    
+    results = []
+    for location in locations:
+        enhanced_location, china, key = resolved[location]
+        observation, backend = answers[key]
+        # 同一城市代码的各个输入共用一次查询结果，回退说明按各自的位置填入
+        observation = _attach_note(observation, enhanced_location)
+        results.append({
+            'location': location,
+            'query': enhanced_location,
+            'china': china,
+            'key': key,
+            'observation': observation,
+            'result': render_query_result(observation, enhanced_location, china),
+            'backend': backend,
+        })
+    return results
+
+def _read_batch_locations(args) -> List[str]:
+    """从参数、文件或标准输入读取位置列表，每行一个，忽略空行和#注释"""
+    lines = list(args.locations)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            lines.extend(f)
+    if (not args.locations and not args.file) or '-' in args.locations:
+        lines = [line for line in lines if line != '-']
+        lines.extend(sys.stdin)
+    
+    locations = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            locations.append(line)
+    return locations
+
+def batch_main(argv: List[str]) -> int:
+    """批量模式命令行入口，结果以JSON Lines输出到标准输出，过程信息输出到标准错误"""
+    parser = argparse.ArgumentParser(
+        prog='intelligent_weather_router.py --batch',
+        description='批量查询天气，每个位置输出一行JSON',
+    )
+    parser.add_argument('locations', nargs='*', help="位置名称；'-' 或不提供位置和文件时从标准输入读取")
+    parser.add_argument('-f', '--file', help='位置列表文件，每行一个')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_BATCH_WORKERS, help='并发查询的线程数')
+    parser.add_argument('--no-cache', action='store_true', help='不使用结果缓存')
+    args = parser.parse_args(argv)
+    
+    locations = _read_batch_locations(args)
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        results = query_weather_batch(locations, max_workers=args.workers, use_cache=not args.no_cache)
+        for name, stats in get_backend_health().snapshot().items():
+            print(f"服务 {name}: {json.dumps(stats, ensure_ascii=False)}")
+    for item in results:
+        observation = item['observation']
+        item = {**item, 'observation': observation.to_dict() if observation is not None else None}
+        out.write(json.dumps(item, ensure_ascii=False) + '\n')
+    out.flush()
+    return 0 if all(item['backend'] for item in results) else 1
 
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == '--batch':
+        return batch_main(sys.argv[2:])
+    
     if len(sys.argv) < 2:
         print("使用方法: python enhanced_weather_with_geo_completion.py <城市名称>")
         print("示例: python enhanced_weather_with_geo_completion.py 北京")
         print("示例: python enhanced_weather_with_geo_completion.py 浙江嘉兴")
         print("示例: python enhanced_weather_with_geo_completion.py 江西玉山")
         print("示例: python enhanced_weather_with_geo_completion.py 浙江江山")
+        print("批量: python enhanced_weather_with_geo_completion.py --batch 北京 上海 -f cities.txt")
         return
     
     location = sys.argv[1]
@@ -834,4 +1479,4 @@ def main():
     print(result)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -9,10 +9,42 @@ if [ $# -eq 0 ]; then
     echo "用法: $0 <城市/国家名称>"
     echo "示例: $0 北京"
     echo "示例: $0 London"
+    echo "批量: $0 --batch 北京 上海 London"
+    echo "批量: $0 --batch -f cities.txt"
+    echo "常驻服务: $0 --daemon [--quiet]"
     exit 1
 fi
 
+# 批量模式: 参数原样传给Python脚本，每个位置输出一行JSON
+if [ "$1" = "--batch" ]; then
+    exec python3 "${SCRIPT_DIR}/intelligent_weather_router.py" "$@"
+fi
+
+# 常驻服务: 在前台运行，之后的查询通过本地socket完成
+if [ "$1" = "--daemon" ]; then
+    shift
+    exec python3 "${SCRIPT_DIR}/intelligent_weather_daemon.py" "$@"
+fi
+
 LOCATION="$*"
 
-# 使用Python路由脚本
+# 常驻服务的socket路径，与 intelligent_weather_client.py 中的 default_socket_path 一致
+if [ -n "$WEATHER_DAEMON_SOCKET" ]; then
+    SOCKET="$WEATHER_DAEMON_SOCKET"
+elif [ -n "$XDG_RUNTIME_DIR" ] && [ -d "$XDG_RUNTIME_DIR" ]; then
+    SOCKET="${XDG_RUNTIME_DIR}/clawdbot-weather.sock"
+else
+    SOCKET="/tmp/clawdbot-weather-$(id -u).sock"
+fi
+
+# socket存在时优先通过常驻服务查询；连接失败（退出码75，如服务已退出留下的socket）时直接运行Python路由脚本，
+# 其他退出码（包括等待响应超时的124）原样返回，不重复查询
+if [ -S "$SOCKET" ]; then
+    python3 "${SCRIPT_DIR}/intelligent_weather_client.py" "$LOCATION" 2>/dev/null
+    STATUS=$?
+    if [ $STATUS -ne 75 ]; then
+        exit $STATUS
+    fi
+fi
+
 python3 "${SCRIPT_DIR}/intelligent_weather_router.py" "$LOCATION"
\ No newline at end of file
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+天气服务健康统计与熔断
+记录每个服务的延迟（EWMA和滑动窗口分位数）与错误率，据此调整回退链顺序；
+连续失败达到阈值后熔断，熔断一段时间后放行一个试探请求（半开），试探成功再恢复
+只有传输错误、超时和5xx计为失败；上游正常应答但没有结果（地名不存在等）不影响服务的健康状况
+"""
+
+import contextvars
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+
+# 默认配置
+DEFAULT_ALPHA = 0.2              # EWMA平滑系数，越大越偏重最近的请求
+DEFAULT_WINDOW = 100             # 计算分位数的滑动窗口大小
+DEFAULT_FAILURE_THRESHOLD = 5    # 连续失败多少次后熔断
+DEFAULT_RESET_TIMEOUT = 60.0     # 熔断后多少秒进入半开状态
+DEFAULT_SLOW_THRESHOLD = 3.0     # EWMA延迟超过该值（秒）视为降级
+DEFAULT_ERROR_THRESHOLD = 0.5    # EWMA错误率超过该值视为降级
+DEFAULT_PROBE_TIMEOUT = 10.0     # 半开状态的试探请求超过该时间（秒）没有结果（如被对冲取消），再放行一个
+
+# 一次服务调用的结果
+OUTCOME_OK = 'ok'        # 得到有效结果
+OUTCOME_MISS = 'miss'    # 上游正常应答，但没有该位置的结果
+OUTCOME_ERROR = 'error'  # 传输错误、超时或5xx
+
+# 熔断器状态
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+T = TypeVar('T')
+
+_current_attempt: contextvars.ContextVar = contextvars.ContextVar('backend_attempt', default=None)
+
+
+class BackendAttempt:
+    """
+    一次服务调用期间的上游错误记录，用作上下文管理器
+    HTTP层在传输错误、超时和5xx时调用 report_upstream_error()；调用结束后由 outcome() 区分失败和没有结果
+    contextvar随 asyncio.to_thread 复制，线程中的请求也记在这里
+    """
+
+    __slots__ = ('errors', '_token')
+
+    def __init__(self):
+        self.errors = 0
+        self._token = None
+
+    def __enter__(self) -> 'BackendAttempt':
+        self._token = _current_attempt.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_attempt.reset(self._token)
+        return False
+
+    def outcome(self, ok: bool) -> str:
+        if ok:
+            return OUTCOME_OK
+        return OUTCOME_ERROR if self.errors else OUTCOME_MISS
+
+
+def report_upstream_error(count: int = 1):
+    """当前服务调用中发生了 count 次传输错误、超时或5xx"""
+    attempt = _current_attempt.get()
+    if attempt is not None:
+        attempt.errors += count
+
+
+class BackendStats:
+    """单个服务的统计"""
+
+    __slots__ = ('latency_ewma', 'error_ewma', 'samples', 'calls', 'failures', 'misses',
+                 'consecutive_failures', 'opens', 'state', 'opened_at', 'probe_at', 'updated_at')
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.misses = 0
+        self.consecutive_failures = 0
+        self.opens = 0
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        # 半开状态下放行试探请求的时间，0表示尚未放行
+        self.probe_at = 0.0
+        self.updated_at = 0.0
+
+    def percentile(self, p: float) -> Optional[float]:
+        """滑动窗口内延迟的第p百分位（0-100）"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+class BackendHealth:
+    """
+    线程安全的服务健康统计
+    record() 在每次服务调用结束后调用；order() 在规划回退链时调用
+    """
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, window: int = DEFAULT_WINDOW,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+                 slow_threshold: float = DEFAULT_SLOW_THRESHOLD,
+                 error_threshold: float = DEFAULT_ERROR_THRESHOLD,
+                 probe_timeout: float = DEFAULT_PROBE_TIMEOUT,
+                 enabled: bool = True):
+        self.alpha = alpha
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_threshold = slow_threshold
+        self.error_threshold = error_threshold
+        self.probe_timeout = probe_timeout
+        self.enabled = enabled
+        self._stats: Dict[str, BackendStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> BackendStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = BackendStats(self.window)
+        return stats
+
+    def record(self, name: str, latency: float, outcome: str):
+        """
+        记录一次调用的耗时（秒）和结果（OUTCOME_OK/OUTCOME_MISS/OUTCOME_ERROR）
+        没有结果（miss）说明服务可用，与成功一样清零连续失败次数
+        熔断期间结束的调用（熔断前已发出）只计入统计；半开状态由试探请求的结果决定恢复还是继续熔断
+        """
+        failed = outcome == OUTCOME_ERROR
+        with self._lock:
+            stats = self._get(name)
+            stats.calls += 1
+            stats.updated_at = time.monotonic()
+            stats.samples.append(latency)
+            if stats.latency_ewma is None:
+                stats.latency_ewma = latency
+            else:
+                stats.latency_ewma += self.alpha * (latency - stats.latency_ewma)
+            stats.error_ewma += self.alpha * ((1.0 if failed else 0.0) - stats.error_ewma)
+            if outcome == OUTCOME_MISS:
+                stats.misses += 1
+
+            if not failed:
+                stats.consecutive_failures = 0
+                if stats.state != STATE_OPEN:
+                    stats.state = STATE_CLOSED
+                    stats.probe_at = 0.0
+                return
+
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.state == STATE_OPEN:
+                return
+            if stats.state == STATE_HALF_OPEN or stats.consecutive_failures >= self.failure_threshold:
+                stats.opens += 1
+                print(f"{name} 连续失败 {stats.consecutive_failures} 次，暂停使用 {self.reset_timeout:g} 秒",
+                      file=sys.stderr)
+                stats.state = STATE_OPEN
+                stats.opened_at = time.monotonic()
+                stats.probe_at = 0.0
+
+    def state(self, name: str) -> str:
+        """当前熔断状态；熔断时间已到时转为半开"""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return STATE_CLOSED
+            if stats.state == STATE_OPEN and time.monotonic() - stats.opened_at >= self.reset_timeout:
+                stats.state = STATE_HALF_OPEN
+            return stats.state
+
+    def allow(self, name: str) -> bool:
+        """
+        熔断中的服务不参与查询；半开状态只放行一个试探请求，由它的结果决定是否恢复
+        试探请求超过 probe_timeout 没有结果（如排在获胜的服务之后而没有执行）时再放行一个
+        """
+        if not self.enabled:
+            return True
+        state = self.state(name)
+        if state != STATE_HALF_OPEN:
+            return state != STATE_OPEN
+        with self._lock:
+            stats = self._stats[name]
+            now = time.monotonic()
+            if stats.state != STATE_HALF_OPEN or (stats.probe_at and now - stats.probe_at < self.probe_timeout):
+                return False
+            stats.probe_at = now
+            return True
+
+    def degraded(self, name: str) -> bool:
+        """
+        近期错误率或延迟超过阈值
+        排到后面的服务可能很久没有新的调用，超过 reset_timeout 没有记录时不再视为降级，重新按配置顺序试用
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None or stats.latency_ewma is None:
+                return False
+            if time.monotonic() - stats.updated_at >= self.reset_timeout:
+                return False
+            return stats.error_ewma > self.error_threshold or stats.latency_ewma > self.slow_threshold
+
+    def score(self, name: str) -> float:
+        """预期得到有效结果的耗时：EWMA延迟 / 成功率"""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None or stats.latency_ewma is None:
+                return 0.0
+            return stats.latency_ewma / max(1.0 - stats.error_ewma, 0.05)
+
+    def order(self, items: Iterable[T], key: Callable[[T], str] = lambda item: item,
+              adaptive: Callable[[str], bool] = lambda name: True) -> List[T]:
+        """
+        调整执行计划：去掉熔断中的服务，降级的服务移到最后一个健康服务之后（按score排序）
+        adaptive(name) 为False的项（如组合回退策略）不参与统计，与健康服务的相对顺序不变
+        """
+        items = list(items)
+        if not self.enabled:
+            return items
+
+        # allow() 在半开状态下会占用试探名额，每个服务只问一次
+        allowed = {}
+        plan, degraded = [], []
+        for item in items:
+            name = key(item)
+            if not adaptive(name):
+                plan.append(item)
+                continue
+            if name not in allowed:
+                allowed[name] = self.allow(name)
+            if allowed[name]:
+                (degraded if self.degraded(name) else plan).append(item)
+        if not degraded:
+            return plan
+
+        healthy = [i for i, item in enumerate(plan) if adaptive(key(item))]
+        if not healthy:
+            # 没有健康的服务可以提前，保持原有顺序
+            return [item for item in items if not adaptive(key(item)) or allowed[key(item)]]
+        degraded.sort(key=lambda item: self.score(key(item)))
+        insert_at = healthy[-1] + 1
+        return plan[:insert_at] + degraded + plan[insert_at:]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各服务的统计信息，用于诊断"""
+        with self._lock:
+            names = list(self._stats)
+        result = {}
+        for name in names:
+            state = self.state(name)
+            with self._lock:
+                stats = self._stats.get(name)
+                if stats is None:
+                    continue
+                result[name] = {
+                    'state': state,
+                    'calls': stats.calls,
+                    'failures': stats.failures,
+                    'misses': stats.misses,
+                    'consecutive_failures': stats.consecutive_failures,
+                    'opens': stats.opens,
+                    'error_rate': round(stats.error_ewma, 3),
+                    'latency_ewma': _round(stats.latency_ewma),
+                    'p50': _round(stats.percentile(50)),
+                    'p95': _round(stats.percentile(95)),
+                }
+        return result
+
+    def reset(self, name: Optional[str] = None):
+        """清除一个服务（不传name时为全部服务）的统计"""
+        with self._lock:
+            if name is None:
+                self._stats.clear()
+            else:
+                self._stats.pop(name, None)
+
+
+_health: Optional[BackendHealth] = None
+_health_lock = threading.Lock()
+
+
+def get_backend_health() -> BackendHealth:
+    """获取进程内共享的服务健康统计，参数来自 clawdbot_weather_config.ini 的 [adaptive_routing]"""
+    global _health
+    if _health is None:
+        with _health_lock:
+            if _health is None:
+                from weather_backends import get_backend_registry
+                config = get_backend_registry().config
+
+                def option(key, default):
+                    try:
+                        return type(default)(config.get('adaptive_routing', key, default))
+                    except (TypeError, ValueError):
+                        return default
+
+                _health = BackendHealth(
+                    failure_threshold=option('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+                    reset_timeout=option('reset_timeout', DEFAULT_RESET_TIMEOUT),
+                    slow_threshold=option('slow_threshold', DEFAULT_SLOW_THRESHOLD),
+                    error_threshold=option('error_threshold', DEFAULT_ERROR_THRESHOLD),
+                    enabled=config.getboolean('adaptive_routing', 'enabled', True),
+                )
+    return _health
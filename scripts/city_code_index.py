@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+城市代码索引
+在代码表加载时一次性构建：按省份代码前缀分组的倒排索引、地名子串字典树、按字的倒排索引，
+使 省份->城市、城市代码->省份、模糊地名->城市代码、相近城市 的查询不再扫描整张表
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from city_code_registry import CityCodeRegistry
+from location_matcher import AhoCorasickMatcher
+
+# 中国天气网城市代码的前5位即省份代码
+PROVINCE_PREFIX_LEN = 5
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """Levenshtein编辑距离，地名很短，直接按行动态规划"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+class _TrieNode:
+    __slots__ = ('children', 'first')
+
+    def __init__(self, first: int):
+        self.children = {}
+        # 包含从根到此节点这一子串的地名中，在代码表里最靠前的序号
+        self.first = first
+
+
+class CityCodeIndex:
+    """
+    城市代码表的只读索引
+    查询结果与按代码表顺序逐条扫描的结果一致
+    """
+
+    def __init__(self, city_codes: Dict[str, str], province_codes: Dict[str, dict]):
+        self.city_codes = city_codes
+        self.province_codes = province_codes
+        self.names: List[str] = list(city_codes)
+
+        # 省份代码前缀 -> [(城市名, 城市代码)]，保持代码表顺序
+        self.cities_by_prefix: Dict[str, List[Tuple[str, str]]] = {}
+        for name, code in city_codes.items():
+            self.cities_by_prefix.setdefault(code[:PROVINCE_PREFIX_LEN], []).append((name, code))
+
+        # 省份代码前缀 -> 省份名（同一前缀取第一个省份）
+        self.province_by_prefix: Dict[str, str] = {}
+        for prov_name, prov_info in province_codes.items():
+            self.province_by_prefix.setdefault(prov_info['code'], prov_name)
+
+        # 地名子串字典树：查询串是哪些地名的子串
+        self._root = _TrieNode(0 if self.names else -1)
+        for position, name in enumerate(self.names):
+            for start in range(len(name)):
+                node = self._root
+                for ch in name[start:]:
+                    child = node.children.get(ch)
+                    if child is None:
+                        child = _TrieNode(position)
+                        node.children[ch] = child
+                    node = child
+
+        # 字 -> 含有该字的地名序号，用于生成相近城市候选
+        self._positions_by_char: Dict[str, List[int]] = {}
+        for position, name in enumerate(self.names):
+            for ch in set(name):
+                self._positions_by_char.setdefault(ch, []).append(position)
+
+        # 地名自动机：哪些地名是查询串的子串
+        self._name_matcher = AhoCorasickMatcher()
+        for position, name in enumerate(self.names):
+            self._name_matcher.add(name, position)
+        self._name_matcher.build()
+
+    @classmethod
+    def from_registry(cls, registry: CityCodeRegistry) -> 'CityCodeIndex':
+        return cls(registry.city_codes, registry.province_codes)
+
+    def _first_containing(self, text: str) -> int:
+        """包含text的第一个地名序号，没有则返回-1"""
+        node = self._root
+        for ch in text:
+            node = node.children.get(ch)
+            if node is None:
+                return -1
+        return node.first
+
+    def _first_contained(self, text: str) -> int:
+        """出现在text中的第一个地名序号，没有则返回-1"""
+        best = -1
+        for match in self._name_matcher.iter_matches(text):
+            if best == -1 or match.payload < best:
+                best = match.payload
+        return best
+
+    def fuzzy_lookup(self, text: str) -> Optional[str]:
+        """返回代码表中第一个与text互为包含关系的地名对应的代码"""
+        candidates = [p for p in (self._first_containing(text), self._first_contained(text)) if p != -1]
+        if not candidates:
+            return None
+        return self.city_codes[self.names[min(candidates)]]
+
+    def similar_cities(self, text: str, limit: int, prefix: Optional[str] = None,
+                       exclude: Iterable[str] = ()) -> List[Tuple[str, str]]:
+        """
+        与text相近的城市 [(城市名, 城市代码)]，按相似度排序，最多limit个，代码不重复
+        候选只来自与text有公共字的地名；prefix 为省份代码前缀时只在该省份内查找，exclude 为要跳过的城市代码
+        依次按 互相包含、编辑距离、公共前缀长度、代码表顺序 排序；
+        既不互相包含、也没有公共前缀且编辑距离超过text长度一半的地名不算相近
+        """
+        text = text.strip()
+        if not text or limit <= 0:
+            return []
+        exclude = set(exclude)
+
+        positions = set()
+        for ch in set(text):
+            positions.update(self._positions_by_char.get(ch, ()))
+
+        ranked = []
+        for position in positions:
+            name = self.names[position]
+            code = self.city_codes[name]
+            if (prefix and not code.startswith(prefix)) or code in exclude:
+                continue
+            contains = text in name or name in text
+            shared = _common_prefix_len(text, name)
+            distance = _edit_distance(text, name)
+            if not contains and not shared and distance > len(text) // 2:
+                continue
+            ranked.append(((not contains, distance, -shared, position), name, code))
+        ranked.sort()
+
+        result, seen = [], set()
+        for _, name, code in ranked:
+            if code in seen:
+                continue
+            seen.add(code)
+            result.append((name, code))
+            if len(result) == limit:
+                break
+        return result
+
+    def cities_with_prefix(self, prefix: str) -> List[Tuple[str, str]]:
+        """代码以prefix开头的所有城市 [(城市名, 城市代码)]"""
+        if len(prefix) == PROVINCE_PREFIX_LEN:
+            return list(self.cities_by_prefix.get(prefix, []))
+        return [(name, code) for name, code in self.city_codes.items() if code.startswith(prefix)]
+
+    def province_of_code(self, city_code: str) -> Optional[str]:
+        """从城市代码推断省份名"""
+        if len(city_code) >= PROVINCE_PREFIX_LEN:
+            return self.province_by_prefix.get(city_code[:PROVINCE_PREFIX_LEN])
+        return None
+
+    def find_city_code(self, city_name: str) -> Optional[str]:
+        """查找城市代码，支持城市名和省份+城市名的组合"""
+        # 首先尝试精确匹配城市名
+        code = self.city_codes.get(city_name)
+        if code:
+            return code
+
+        # 如果找不到，尝试查找互相包含的条目
+        code = self.fuzzy_lookup(city_name)
+        if code:
+            return code
+
+        # 如果输入包含省份信息，只在该省份的城市中查找
+        for prov_name, prov_info in self.province_codes.items():
+            if city_name.startswith(prov_name):
+                city_part = city_name[len(prov_name):]
+                if city_part:
+                    for name, code in self.cities_with_prefix(prov_info['code']):
+                        if city_part in name:
+                            return code
+
+        return None
+
+
+def get_city_code_index(city_codes: Dict[str, str] = None, province_codes: Dict[str, dict] = None) -> CityCodeIndex:
+    """
+    获取城市代码索引
+    不传参数或传入注册表自身的字典时返回随注册表缓存的索引，否则为传入的字典临时构建
+    """
+    index = CityCodeRegistry.instance().derived('city_code_index', CityCodeIndex.from_registry)
+    if (city_codes is None or city_codes is index.city_codes) and \
+            (province_codes is None or province_codes is index.province_codes):
+        return index
+    return CityCodeIndex(
+        index.city_codes if city_codes is None else city_codes,
+        index.province_codes if province_codes is None else province_codes,
+    )
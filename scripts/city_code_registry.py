@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+城市/省份代码注册表
+整个进程只解析一次代码表JSON，文件修改后按mtime自动重新加载；
+城市代码表已编译为二进制表（见 city_code_table.py）时直接mmap映射，不再解析JSON；
+二进制表不存在或早于JSON时，解析JSON后自动重新编译
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from city_code_table import ensure_city_code_table, load_city_code_table
+from weather_trace import CAT_LOAD, trace_span
+
+# 获取脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 尝试多个可能的路径
+CITY_CODE_PATHS = [
+    os.path.join(SCRIPT_DIR, 'complete_china_weather_city_codes.json'),
+    '/home/Tim/BotRoom/complete_china_weather_city_codes.json',
+    '/home/Tim/BotRoom/clawdbot-skills/scripts/complete_china_weather_city_codes.json',
+    '/home/Tim/BotRoom/skills_workspace/china-weather/scripts/complete_china_weather_city_codes.json',
+    './complete_china_weather_city_codes.json'
+]
+
+PROVINCE_CODE_PATHS = [
+    os.path.join(SCRIPT_DIR, 'china_weather_province_codes.json'),
+    '/home/Tim/BotRoom/china_weather_province_codes.json',
+    '/home/Tim/BotRoom/clawdbot-skills/scripts/china_weather_province_codes.json',
+    '/home/Tim/BotRoom/skills_workspace/china-weather/scripts/china_weather_province_codes.json',
+    './china_weather_province_codes.json'
+]
+
+# 如果没有找到完整文件，使用备用字典
+BACKUP_CITY_CODES = {
+    "北京": "101010100", "上海": "101020100", "广州": "101280101", "深圳": "101280601",
+    "杭州": "101210101", "南京": "101190101", "武汉": "101200101", "成都": "101270101",
+    "重庆": "101040100", "西安": "101110101", "天津": "101030100", "苏州": "101190401",
+    "青岛": "101120201", "大连": "101070201", "厦门": "101230201", "宁波": "101210401",
+    "长沙": "101250101", "郑州": "101180101", "济南": "101120101", "福州": "101230101",
+    "南昌": "101240101", "沈阳": "101060101", "哈尔滨": "101050101", "石家庄": "101090101",
+    "太原": "101100101", "昆明": "101290101", "南宁": "101300101", "合肥": "101220101",
+    "海口": "101310101", "兰州": "101160101", "银川": "101170101", "西宁": "101150101",
+    "拉萨": "101140101", "乌鲁木齐": "101130101", "呼和浩特": "101080101", "长春": "101060201",
+    "唐山": "101090301", "秦皇岛": "101091101", "邯郸": "101090402", "保定": "101090201",
+    "张家口": "101090301", "承德": "101090402", "沧州": "101090701", "廊坊": "101090601",
+    "衡水": "101090801", "邢台": "101090901", "晋城": "101100601", "朔州": "101100901",
+    "忻州": "101101001", "大同": "101100201", "阳泉": "101100301", "长治": "101100501",
+    "临汾": "101100701", "吕梁": "101101100", "运城": "101100801", "鞍山": "101070101",
+    "抚顺": "101070101", "本溪": "101070101", "丹东": "101070201", "锦州": "101070101",
+    "营口": "101070201", "阜新": "101070101", "辽阳": "101070101", "盘锦": "101070401",
+    "铁岭": "101070201", "朝阳": "101070101", "葫芦岛": "101070101", "吉林": "101060301",
+    "四平": "101060201", "辽源": "101060201", "通化": "101060501", "白山": "101060901",
+    "松原": "101060701", "白城": "101060601", "延边": "101060801", "齐齐哈尔": "101050201",
+    "鸡西": "101050301", "鹤岗": "101050301", "双鸭山": "101050301", "大庆": "101050901",
+    "伊春": "101050801", "牡丹江": "101050301", "佳木斯": "101050401", "七台河": "101050301",
+    "黑河": "101050601", "绥化": "101050501", "大兴安岭": "101050701"
+}
+
+
+def _find_existing(paths) -> Optional[str]:
+    """返回第一个存在的文件路径"""
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _mtime(path: Optional[str]) -> Optional[int]:
+    """读取文件修改时间，文件不存在时返回None"""
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class CityCodeRegistry:
+    """
+    进程级城市/省份代码注册表
+    通过 CityCodeRegistry.instance() 获取共享实例
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, city_paths=None, province_paths=None, check_interval: float = 1.0):
+        self.city_paths = list(city_paths or CITY_CODE_PATHS)
+        self.province_paths = list(province_paths or PROVINCE_CODE_PATHS)
+        # 两次mtime检查之间的最小间隔（秒），避免每次查询都stat文件
+        self.check_interval = check_interval
+
+        self._lock = threading.RLock()
+        self._city_codes: Mapping[str, str] = {}
+        self._province_codes: Dict[str, dict] = {}
+        self._city_path: Optional[str] = None
+        self._province_path: Optional[str] = None
+        self._city_mtime: Optional[int] = None
+        self._province_mtime: Optional[int] = None
+        self._last_check = 0.0
+        self._loaded = False
+        self._derived = {}
+        # 每次重新加载后递增，派生索引据此判断是否需要重建
+        self.version = 0
+
+    @classmethod
+    def instance(cls) -> 'CityCodeRegistry':
+        """获取进程内共享的注册表实例"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @property
+    def city_codes(self) -> Mapping[str, str]:
+        """城市名 -> 中国天气网城市代码；来自二进制表时为只读的 CityCodeTable"""
+        self._ensure_fresh()
+        return self._city_codes
+
+    @property
+    def province_codes(self) -> Dict[str, dict]:
+        """省份名 -> {"code": 省份代码前缀, "region": 地区}"""
+        self._ensure_fresh()
+        return self._province_codes
+
+    @property
+    def city_codes_path(self) -> Optional[str]:
+        """当前城市代码表的来源文件，使用备用字典时为None"""
+        self._ensure_fresh()
+        return self._city_path
+
+    def derived(self, name: str, builder: Callable[['CityCodeRegistry'], Any]) -> Any:
+        """
+        获取基于代码表构建的派生数据（索引、匹配器等）
+        builder(registry) 只在首次访问或代码表重新加载后调用
+        """
+        self._ensure_fresh()
+        entry = self._derived.get(name)
+        if entry is None or entry[0] != self.version:
+            with self._lock:
+                entry = self._derived.get(name)
+                if entry is None or entry[0] != self.version:
+                    with trace_span(name, CAT_LOAD):
+                        entry = (self.version, builder(self))
+                    self._derived[name] = entry
+        return entry[1]
+
+    def reload(self):
+        """强制重新加载代码表"""
+        with self._lock:
+            self._load()
+
+    def _ensure_fresh(self):
+        """首次访问时加载，之后按check_interval检查文件是否被修改"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+            return
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        if (_find_existing(self.city_paths) == self._city_path
+                and _find_existing(self.province_paths) == self._province_path
+                and _mtime(self._city_path) == self._city_mtime
+                and _mtime(self._province_path) == self._province_mtime):
+            return
+
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        with trace_span('code_table', CAT_LOAD) as load_span:
+            self._load_tables()
+            if load_span:
+                load_span.set(source=self._city_path, cities=len(self._city_codes),
+                              provinces=len(self._province_codes), version=self.version)
+
+    def _load_tables(self):
+        city_path = _find_existing(self.city_paths)
+        city_codes = None
+        if city_path:
+            city_codes = load_city_code_table(city_path)
+            if city_codes is not None:
+                print(f"从 {city_codes.path} 映射了 {len(city_codes)} 个城市代码")
+        if city_path and city_codes is None:
+            try:
+                with open(city_path, 'r', encoding='utf-8') as f:
+                    city_codes = json.load(f)
+                print(f"从 {city_path} 加载了 {len(city_codes)} 个城市代码")
+            except (OSError, ValueError):
+                city_codes = None
+            if city_codes is not None:
+                # 编译成功后改用映射的表，解析出的字典随之释放
+                city_codes = ensure_city_code_table(city_path, city_codes) or city_codes
+        if city_codes is None:
+            print("警告: 未能加载完整城市代码文件，使用备用字典")
+            city_codes = dict(BACKUP_CITY_CODES)
+            city_path = None
+
+        province_path = _find_existing(self.province_paths)
+        province_codes = {}
+        if province_path:
+            try:
+                with open(province_path, 'r', encoding='utf-8') as f:
+                    province_codes = json.load(f)
+            except (OSError, ValueError):
+                # 如果没有找到省份代码文件，使用空字典
+                province_codes = {}
+
+        self._city_codes = city_codes
+        self._province_codes = province_codes
+        self._city_path = city_path
+        self._province_path = province_path
+        self._city_mtime = _mtime(city_path)
+        self._province_mtime = _mtime(province_path)
+        self._last_check = time.monotonic()
+        self._loaded = True
+        self.version += 1
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+城市代码表的二进制格式
+把 complete_china_weather_city_codes.json 编译为按地名排序的紧凑二进制表，通过mmap只读映射：
+多个进程共享同一份页缓存，加载时不解析JSON、不创建每个条目的Python字符串
+（构建 CityCodeIndex 时仍会为全部地名创建Python对象，内存节省只对不构建地名索引的入口有效）
+表不存在或早于JSON时，注册表在解析JSON后自动重新编译（见 ensure_city_code_table）
+
+文件布局（小端）:
+  头部    magic "CWCT" | 版本 u16 | 哈希槽位数的log2 b u16 | 条目数 n u32 | 地名区字节数 u32
+  offsets (n+1) x u32   按地名排序后第i个地名在地名区中的起止位置
+  codes   n x u32       对应的9位城市代码
+  order   n x u32       JSON中原有顺序 -> 排序后的序号（保持迭代顺序与JSON一致）
+  slots   2^b x u32     按 crc32(UTF-8地名) 线性探测的哈希槽，值为排序后的序号+1，0为空
+  names   UTF-8地名区
+
+用法: python3 scripts/city_code_table.py [JSON路径] [-o 输出路径]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional
+
+MAGIC = b'CWCT'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+
+# 编译后的文件与JSON放在一起，扩展名为 .bin
+TABLE_SUFFIX = '.bin'
+
+
+def table_path_for(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + TABLE_SUFFIX
+
+
+def build_city_code_table(city_codes: Dict[str, str], path: str):
+    """把 城市名 -> 9位城市代码 写成二进制表；写入临时文件后再替换，读者不会看到写了一半的文件"""
+    entries = []
+    for position, (name, code) in enumerate(city_codes.items()):
+        if not (isinstance(code, str) and code.isdigit() and len(code) == 9):
+            raise ValueError(f"城市代码不是9位数字: {name}={code!r}")
+        entries.append((name.encode('utf-8'), int(code), position))
+    entries.sort()
+
+    # 哈希槽位数为不小于2n的2的幂，装载因子不超过0.5
+    hash_bits = max(4, (2 * len(entries) - 1).bit_length())
+    mask = (1 << hash_bits) - 1
+
+    offsets = array('I', [0])
+    codes = array('I')
+    order = array('I', [0] * len(entries))
+    slots = array('I', [0] * (mask + 1))
+    blob = bytearray()
+    for index, (name, code, position) in enumerate(entries):
+        blob += name
+        offsets.append(len(blob))
+        codes.append(code)
+        order[position] = index
+        slot = zlib.crc32(name) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+    if sys.byteorder != 'little':
+        for values in (offsets, codes, order, slots):
+            values.byteswap()
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, hash_bits, len(entries), len(blob)))
+            f.write(offsets.tobytes())
+            f.write(codes.tobytes())
+            f.write(order.tobytes())
+            f.write(slots.tobytes())
+            f.write(blob)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _u32_view(buffer, start: int, count: int):
+    """u32数组视图：小端机器上直接cast映射内存，不复制"""
+    view = memoryview(buffer)[start:start + 4 * count]
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', view.tobytes())
+    values.byteswap()
+    return values
+
+
+class CityCodeTable(Mapping):
+    """
+    只读的 城市名 -> 城市代码 映射，数据来自mmap的二进制表
+    按名称查找走哈希槽（通常只比较一个地名）；迭代顺序与编译时的JSON顺序一致
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, hash_bits, count, blob_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"不是有效的城市代码表: {path}")
+        expected = _HEADER.size + 4 * (3 * count + 1 + (1 << hash_bits)) + blob_len
+        if len(self._mm) != expected:
+            raise ValueError(f"城市代码表大小不正确: {path}")
+
+        self._count = count
+        start = _HEADER.size
+        self._offsets = _u32_view(self._mm, start, count + 1)
+        start += 4 * (count + 1)
+        self._codes = _u32_view(self._mm, start, count)
+        start += 4 * count
+        self._order = _u32_view(self._mm, start, count)
+        start += 4 * count
+        self._mask = (1 << hash_bits) - 1
+        self._slots = _u32_view(self._mm, start, self._mask + 1)
+        self._names_start = start + 4 * (self._mask + 1)
+
+    def _name_bytes(self, index: int) -> bytes:
+        base = self._names_start
+        return self._mm[base + self._offsets[index]:base + self._offsets[index + 1]]
+
+    def _find(self, name: str) -> int:
+        """查找地名，返回排序后的序号，找不到时返回-1"""
+        try:
+            key = name.encode('utf-8')
+        except (AttributeError, UnicodeEncodeError):
+            return -1
+        mm, offsets, slots, base, mask = self._mm, self._offsets, self._slots, self._names_start, self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            value = slots[slot]
+            if not value:
+                return -1
+            index = value - 1
+            if mm[base + offsets[index]:base + offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, name: str) -> str:
+        index = self._find(name)
+        if index == -1:
+            raise KeyError(name)
+        return f"{self._codes[index]:09d}"
+
+    def __contains__(self, name) -> bool:
+        return self._find(name) != -1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for index in self._order:
+            yield self._name_bytes(index).decode('utf-8')
+
+    def items(self):
+        """按JSON顺序迭代 (城市名, 城市代码)，不做二分查找"""
+        for index in self._order:
+            yield self._name_bytes(index).decode('utf-8'), f"{self._codes[index]:09d}"
+
+    def values(self):
+        for index in self._order:
+            yield f"{self._codes[index]:09d}"
+
+    def __repr__(self) -> str:
+        return f"CityCodeTable({self.path!r}, {self._count} entries)"
+
+
+def load_city_code_table(json_path: str) -> Optional[CityCodeTable]:
+    """
+    JSON旁边有不早于JSON的编译结果时映射它，否则返回None（调用方改为解析JSON）
+    表损坏时同样返回None
+    """
+    path = table_path_for(json_path)
+    try:
+        if os.stat(path).st_mtime_ns < os.stat(json_path).st_mtime_ns:
+            return None
+        return CityCodeTable(path)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_city_code_table(json_path: str, city_codes: Dict[str, str]) -> Optional[CityCodeTable]:
+    """
+    由已解析的JSON重新编译缺失或过期的二进制表并映射它，之后的进程直接映射，不再解析JSON
+    目录不可写或代码表格式不符时返回None，调用方继续使用解析出的字典
+    """
+    path = table_path_for(json_path)
+    try:
+        build_city_code_table(city_codes, path)
+        return CityCodeTable(path)
+    except (OSError, ValueError) as e:
+        print(f"无法编译城市代码表 {path}: {e}", file=sys.stderr)
+        return None
+
+
+def main(argv=None) -> int:
+    from city_code_registry import CITY_CODE_PATHS, _find_existing
+
+    parser = argparse.ArgumentParser(description='把城市代码JSON编译为mmap二进制表')
+    parser.add_argument('json_path', nargs='?', default=None, help='城市代码JSON（默认与代码表注册表相同的查找顺序）')
+    parser.add_argument('-o', '--output', default=None, help='输出路径（默认与JSON同名，扩展名为 .bin）')
+    args = parser.parse_args(argv)
+
+    json_path = args.json_path or _find_existing(CITY_CODE_PATHS)
+    if not json_path:
+        print("未找到城市代码JSON文件", file=sys.stderr)
+        return 1
+    with open(json_path, 'r', encoding='utf-8') as f:
+        city_codes = json.load(f)
+    output = args.output or table_path_for(json_path)
+    try:
+        build_city_code_table(city_codes, output)
+    except ValueError as e:
+        print(f"编译失败: {e}", file=sys.stderr)
+        return 1
+
+    table = CityCodeTable(output)
+    if dict(table.items()) != city_codes or list(table) != list(city_codes):
+        print(f"编译结果与 {json_path} 不一致", file=sys.stderr)
+        return 1
+    print(f"已编译 {len(table)} 个城市代码: {json_path} -> {output} ({os.path.getsize(output)} 字节)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+工作线程为守护线程的线程池
+标准库 ThreadPoolExecutor 在解释器退出时会等待所有工作线程，
+对冲落败后仍在等待上游的阶段会把命令行的退出拖到上游超时为止；
+这里的线程池在进程退出时直接放弃仍在运行的任务（任务不会被中断，只是不再等待）
+"""
+
+import queue
+import threading
+from concurrent.futures import Executor, Future
+
+
+class DaemonThreadPoolExecutor(Executor):
+    """
+    与 ThreadPoolExecutor 用法相同的有界线程池，工作线程按需创建、空闲时复用
+    未开始的任务可以取消；进程退出时不等待正在运行的任务
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = 'daemon-pool'):
+        if max_workers <= 0:
+            raise ValueError("max_workers 必须大于0")
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('线程池已关闭，不能再提交任务')
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            # 有空闲线程时由它领取，否则在上限内新建线程
+            if not self._idle.acquire(blocking=False) and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name=f"{self.thread_name_prefix}_{len(self._threads)}")
+                thread.start()
+                self._threads.append(thread)
+            return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            del item
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            del future, fn, args, kwargs
+            self._idle.release()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            threads = list(self._threads)
+            for _ in threads:
+                self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -8,45 +8,71 @@ import json
 import os
 import sys
 import urllib.parse
-import requests
 from datetime import datetime
 import time
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from geocode_cache import get_geocode_cache
+from weather_backends import get_backend_registry
+from weather_http import fetch_wttr_in, http_get
 
 class EnhancedChinaWeather:
     def __init__(self):
-        self.qweather_key = os.environ.get('QWEATHER_API_KEY')
-        self.amap_key = os.environ.get('AMAP_API_KEY')
+        self.backends = get_backend_registry()
+        # 密钥优先取环境变量，其次取 clawdbot_weather_config.ini
+        self.qweather_key = self.backends.config.api_key('qweather')
+        self.amap_key = self.backends.config.api_key('amap')
+        self.geocode_cache = get_geocode_cache()
         
     def get_location_coords(self, location):
         """
         通过高德地图API获取坐标，如果无API密钥则使用OpenStreetMap
+        坐标会持久化缓存，同一地名只需查询一次
         """
+        coords = None
         if self.amap_key:
             # 使用高德地图API
-            try:
-                geocode_url = f"https://restapi.amap.com/v3/geocode/geo?key={self.amap_key}&address={urllib.parse.quote(location)}"
-                response = requests.get(geocode_url)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('status') == '1' and data.get('geocodes'):
-                        location_str = data['geocodes'][0]['location']
-                        lon, lat = location_str.split(',')
-                        return float(lat), float(lon)
-            except:
-                pass
+            coords = self.geocode_cache.get_or_lookup('amap', location,
+                                                      partial(self._geocode_amap, location))
         
         # 如果没有高德API密钥或高德失败，使用OpenStreetMap
+        if not coords:
+            coords = self.geocode_cache.get_or_lookup('nominatim', location,
+                                                      partial(self._geocode_nominatim, location))
+        if coords:
+            return coords
+        return None, None
+
+    def _geocode_amap(self, location):
+        """使用高德地图API获取坐标，失败时返回None"""
+        try:
+            geocode_url = f"https://restapi.amap.com/v3/geocode/geo?key={self.amap_key}&address={urllib.parse.quote(location)}"
+            response = http_get(geocode_url)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get('status') == '1' and data.get('geocodes'):
+                    location_str = data['geocodes'][0]['location']
+                    lon, lat = location_str.split(',')
+                    return float(lat), float(lon)
+        except:
+            pass
+        return None
+
+    def _geocode_nominatim(self, location):
+        """使用OpenStreetMap获取坐标，失败时返回None"""
         try:
             geocode_url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(location)}&format=json&addressdetails=1&limit=1"
-            response = requests.get(geocode_url, headers={'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'})
+            response = http_get(geocode_url, headers={'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'})
             
             if response.status_code == 200 and response.json():
                 data = response.json()[0]
                 return float(data['lat']), float(data['lon'])
         except:
             pass
-        return None, None
+        return None
 
     def query_apibrew_weather(self, location):
         """
@@ -62,11 +88,8 @@ class EnhancedChinaWeather:
                 
             # 尝试一些免费的天气API
             # 示例：wttr.in (无需API密钥)
-            cmd = f'curl -s "wttr.in/{location}?format=3"'
-            import subprocess
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0 and result.stdout.strip():
-                output = result.stdout.strip()
+            output = fetch_wttr_in(location)
+            if output:
                 # 简单的英文天气描述翻译
                 translations = {
                     'Clear': '晴', 'Sunny': '晴', 'Partly cloudy': '多云', 
@@ -98,7 +121,7 @@ class EnhancedChinaWeather:
                 return None
             
             meteo_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&temperature_unit=celsius&windspeed_unit=kmh&precipitation_unit=mm"
-            response = requests.get(meteo_url)
+            response = http_get(meteo_url)
             
             if response.status_code == 200:
                 weather_data = response.json()
@@ -146,32 +169,19 @@ class EnhancedChinaWeather:
         """
         print(f"正在查询 {location} 的天气信息...")
         
-        # 1. 尝试和风天气 (如果有API密钥)
-        if self.qweather_key:
-            result = self.query_qweather(location)
-            if result:
-                print("使用和风天气服务")
-                return result
-        
-        # 2. 尝试高德地图天气 (如果有API密钥)
-        if self.amap_key:
-            result = self.query_amap_weather(location)
+        # 1-4. 按 [china_weather] service_priority 的顺序尝试；缺少API密钥的服务会被跳过
+        services = {
+            'qweather': self.query_qweather,
+            'amap': self.query_amap_weather,
+            'openmeteo': self.query_weather_api_boxes,
+            'wttr_in': self.query_apibrew_weather,
+        }
+        for name in self.backends.china_service_priority(services):
+            result = services[name](location)
             if result:
-                print("使用高德地图天气服务")
+                print(f"使用{self.backends.label(name)}")
                 return result
         
-        # 3. 尝试Open-Meteo (无需API密钥)
-        result = self.query_weather_api_boxes(location)
-        if result:
-            print("使用Open-Meteo服务")
-            return result
-        
-        # 4. 尝试wttr.in (无需API密钥)
-        result = self.query_apibrew_weather(location)
-        if result:
-            print("使用wttr.in服务")
-            return result
-        
         # 5. 尝试其他免费服务
         result = self.query_chinese_free_api(location)
         if result:
@@ -191,7 +201,7 @@ class EnhancedChinaWeather:
             if not lat or not lon:
                 # 尝试直接使用地点名称
                 search_url = f"https://geoapi.qweather.com/v2/city/lookup?location={urllib.parse.quote(location)}&key={self.qweather_key}"
-                search_resp = requests.get(search_url)
+                search_resp = http_get(search_url)
                 if search_resp.status_code == 200:
                     search_data = search_resp.json()
                     if search_data.get('code') == '200' and search_data.get('location'):
@@ -203,7 +213,7 @@ class EnhancedChinaWeather:
             else:
                 # 使用坐标查询天气
                 weather_url = f"https://devapi.qweather.com/v7/weather/now?location={lon},{lat}&key={self.qweather_key}"
-            response = requests.get(weather_url)
+            response = http_get(weather_url)
             
             if response.status_code == 200:
                 data = response.json()
@@ -229,7 +239,7 @@ class EnhancedChinaWeather:
         try:
             # 先获取城市编码
             city_url = f"https://restapi.amap.com/v3/config/district?keywords={urllib.parse.quote(location)}&subdistrict=0&key={self.amap_key}"
-            city_resp = requests.get(city_url)
+            city_resp = http_get(city_url)
             
             if city_resp.status_code == 200:
                 city_data = city_resp.json()
@@ -238,7 +248,7 @@ class EnhancedChinaWeather:
                     
                     # 查询天气
                     weather_url = f"https://restapi.amap.com/v3/weather/weatherInfo?city={city_code}&key={self.amap_key}&extensions=base"
-                    weather_resp = requests.get(weather_url)
+                    weather_resp = http_get(weather_url)
                     
                     if weather_resp.status_code == 200:
                         weather_data = weather_resp.json()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+持久化地理编码缓存
+地名对应的坐标不会变化，查询过一次后保存在SQLite中，多个进程、重启后都可复用
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# 缓存文件位置，可用环境变量 WEATHER_GEOCODE_CACHE 覆盖
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'clawdbot-weather', 'geocode.sqlite3')
+
+Coords = Tuple[float, float]
+
+
+def normalize_location(location: str) -> str:
+    """规范化地名作为缓存键：去掉首尾空白、合并连续空白、转小写"""
+    return ' '.join(location.split()).lower()
+
+
+class GeocodeCache:
+    """
+    两级地理编码缓存：进程内字典 + SQLite文件
+    SQLite使用WAL模式，多个进程可以同时读写同一个缓存文件
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get('WEATHER_GEOCODE_CACHE') or DEFAULT_CACHE_PATH
+        self._memory: Dict[Tuple[str, str], Coords] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disabled = False
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """首次使用时打开数据库；失败时只使用进程内缓存"""
+        if self._conn is not None or self._disabled:
+            return self._conn
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS geocode ('
+                ' provider TEXT NOT NULL,'
+                ' query TEXT NOT NULL,'
+                ' lat REAL NOT NULL,'
+                ' lon REAL NOT NULL,'
+                ' created REAL NOT NULL,'
+                ' PRIMARY KEY (provider, query))'
+            )
+            conn.commit()
+            self._conn = conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"地理编码缓存不可用，仅使用内存缓存: {e}", file=sys.stderr)
+            self._disabled = True
+        return self._conn
+
+    def get(self, provider: str, location: str) -> Optional[Coords]:
+        """读取坐标 (纬度, 经度)，未缓存时返回None"""
+        key = (provider, normalize_location(location))
+        with self._lock:
+            coords = self._memory.get(key)
+            if coords is not None:
+                return coords
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute('SELECT lat, lon FROM geocode WHERE provider = ? AND query = ?', key).fetchone()
+            except sqlite3.Error as e:
+                print(f"读取地理编码缓存失败: {e}", file=sys.stderr)
+                return None
+            if row is None:
+                return None
+            coords = (row[0], row[1])
+            self._memory[key] = coords
+            return coords
+
+    def put(self, provider: str, location: str, coords: Coords):
+        """保存坐标"""
+        key = (provider, normalize_location(location))
+        lat, lon = coords
+        with self._lock:
+            self._memory[key] = (lat, lon)
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute('INSERT OR REPLACE INTO geocode (provider, query, lat, lon, created) VALUES (?, ?, ?, ?, ?)',
+                             (key[0], key[1], lat, lon, time.time()))
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"写入地理编码缓存失败: {e}", file=sys.stderr)
+
+    def get_or_lookup(self, provider: str, location: str,
+                      lookup: Callable[[], Optional[Coords]]) -> Optional[Coords]:
+        """
+        读取缓存，未命中时调用 lookup() 查询并保存
+        lookup 返回None（查询失败）时不写入缓存
+        """
+        coords = self.get(provider, location)
+        if coords is not None:
+            return coords
+        coords = lookup()
+        if coords is not None:
+            self.put(provider, location, coords)
+        return coords
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache: Optional[GeocodeCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    """获取进程内共享的地理编码缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GeocodeCache()
+    return _cache
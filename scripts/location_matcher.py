@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+地名多模式匹配器（Aho-Corasick自动机）
+一次构建，之后对任意输入只需扫描一遍即可找出所有出现的地名
+"""
+
+from collections import deque, namedtuple
+from typing import Any, Iterator, List, Optional
+
+# start/end 为匹配在输入中的切片位置，payload 为添加地名时附带的数据
+LocationMatch = namedtuple('LocationMatch', ['start', 'end', 'word', 'payload'])
+
+
+class AhoCorasickMatcher:
+    """
+    Aho-Corasick 自动机
+    用法: add() 添加所有地名 -> build() -> find_all()/contains_any()
+    同一个地名可以多次添加不同的payload，匹配时会分别返回
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._patterns = []
+        self._built = False
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def add(self, word: str, payload: Any = None):
+        """添加一个地名"""
+        if not word:
+            return
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(len(self._patterns))
+        self._patterns.append((word, payload))
+        self._built = False
+
+    def build(self) -> 'AhoCorasickMatcher':
+        """按广度优先计算失败指针，并把后缀节点的输出合并进来"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+        self._built = True
+        return self
+
+    def iter_matches(self, text: str) -> Iterator[LocationMatch]:
+        """按结束位置顺序返回text中的每一个匹配（允许重叠）"""
+        if not self._built:
+            self.build()
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        patterns = self._patterns
+
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for index in out[node]:
+                word, payload = patterns[index]
+                yield LocationMatch(i + 1 - len(word), i + 1, word, payload)
+
+    def find_all(self, text: str) -> List[LocationMatch]:
+        """返回所有匹配，最长的在前，等长时靠前出现的在前"""
+        matches = list(self.iter_matches(text))
+        matches.sort(key=lambda m: (m.start - m.end, m.start))
+        return matches
+
+    def longest_match(self, text: str) -> Optional[LocationMatch]:
+        """返回最长的一个匹配，没有匹配时返回None"""
+        best = None
+        for match in self.iter_matches(text):
+            if best is None or (match.end - match.start, -match.start) > (best.end - best.start, -best.start):
+                best = match
+        return best
+
+    def contains_any(self, text: str) -> bool:
+        """text中是否出现任意一个地名（找到第一个即返回）"""
+        for _ in self.iter_matches(text):
+            return True
+        return False
@@ -3,125 +3,248 @@
 使用省份代码获取省级天气概览
 """
 
-import json
-import requests
-import re
-from typing import Dict, List
+import os
+import sys
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from city_code_index import get_city_code_index
+from city_code_registry import CityCodeRegistry
+from weather_cache import get_weather_cache
+from weather_com_cn_parser import parse_weather_observation
+from weather_http import rate_limited_get
+from weather_observation import format_temp
 
 def load_province_codes():
-    """加载省份代码"""
-    import os
-    
-    # 尝试多个可能的路径
-    possible_paths = [
-        'scripts/china_weather_province_codes.json',
-        '/home/Tim/BotRoom/clawdbot-skills/scripts/china_weather_province_codes.json',
-        '/home/Tim/BotRoom/china_weather_province_codes.json',
-        './china_weather_province_codes.json'
-    ]
-    
-    for path in possible_paths:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except FileNotFoundError:
-            continue
-    
-    # 如果文件不存在，返回空字典
-    return {}
+    """加载省份代码（进程内共享，只解析一次）"""
+    return CityCodeRegistry.instance().province_codes
 
 def get_city_codes_by_province(province_code: str) -> List[tuple]:
     """根据省份代码获取该省主要城市的代码"""
-    import os
-    
-    # 这里我们可以从完整的城市代码列表中筛选
-    possible_paths = [
-        'scripts/complete_china_weather_city_codes.json',
-        '/home/Tim/BotRoom/clawdbot-skills/scripts/complete_china_weather_city_codes.json',
-        '/home/Tim/BotRoom/complete_china_weather_city_codes.json',
-        './complete_china_weather_city_codes.json'
-    ]
-    
-    all_cities = {}
-    for path in possible_paths:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    all_cities = json.load(f)
-                break
-        except FileNotFoundError:
-            continue
-    
-    province_cities = []
-    for city_name, city_code in all_cities.items():
-        if city_code.startswith(province_code):
-            province_cities.append((city_name, city_code))
-    
-    return province_cities
+    # 直接使用按省份代码前缀分组的索引，无需扫描完整城市代码表
+    return get_city_code_index().cities_with_prefix(province_code)
 
-def get_province_weather_overview(province_name: str) -> str:
-    """获取省份天气概览"""
-    province_codes = load_province_codes()
-    
+# 中国天气网 sk_2d 实况接口
+SK_2D_URL = "http://d1.weather.com.cn/sk_2d/{code}.html"
+# sk_2d 实况的来源名，与路由脚本和服务注册表（weather_backends）中的服务名相同，
+# 结果缓存按它设置有效期（见 weather_cache.DEFAULT_BACKEND_TTLS）
+SK_2D_SOURCE = 'sk_2d'
+SK_2D_HEADERS = {
+    'Referer': 'http://www.weather.com.cn/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# 全国扫描的默认并发数
+DEFAULT_SWEEP_WORKERS = 16
+
+def fetch_city_weather(city_name: str, city_code: str) -> Dict:
+    """
+    查询单个城市的sk_2d实况，返回结构化结果
+    成功时 observation 为 WeatherObservation、error 为None；失败时 observation 为None，error 为失败原因
+    """
+    row = {'city': city_name, 'code': city_code, 'observation': None, 'error': None}
+    url = SK_2D_URL.format(code=city_code)
+    try:
+        # 批量并发时按主机限流，避免被中国天气网拒绝
+        response = rate_limited_get(url, headers=SK_2D_HEADERS, timeout=10)
+
+        if response.status_code != 200:
+            row['error'] = f"请求失败 (状态码: {response.status_code})"
+            return row
+
+        # 与路由脚本使用同一个解析器，同一份sk_2d响应得到相同的天气描述
+        row['observation'] = parse_weather_observation(response.content, SK_2D_SOURCE, default_city=city_name)
+        if row['observation'] is None:
+            row['error'] = "无法解析天气数据"
+    except Exception as e:
+        row['error'] = f"请求异常 - {str(e)}"
+    return row
+
+def format_province_row(row: Dict) -> str:
+    """把一行省份结果格式化为概览文本"""
+    province_name = row['province']
+    if row['error']:
+        return f"{province_name}: {row['error']}"
+    observation = row['observation']
+    return f"{province_name}({row['city']}): {observation.condition} {format_temp(observation.temp)}°C"
+
+def _province_row(province_name: str, province_codes: Dict) -> Dict:
+    """解析省份的代表城市；找不到时返回带 error 的行"""
+    row = {'province': province_name, 'province_code': None,
+           'city': None, 'code': None, 'observation': None, 'error': None}
     if province_name not in province_codes:
-        return f"未找到省份: {province_name}"
-    
+        row['error'] = f"未找到省份: {province_name}"
+        return row
+
     province_code = province_codes[province_name]["code"]
-    
-    # 获取该省的主要城市
+    row['province_code'] = province_code
+
+    # 获取该省的主要城市，第一个城市的天气作为省份概览
     cities = get_city_codes_by_province(province_code)
-    
     if not cities:
-        return f"未找到 {province_name} 的城市数据"
-    
-    # 获取第一个城市的天气作为省份概览
-    first_city_name, first_city_code = cities[0]
-    
-    try:
-        url = f"http://d1.weather.com.cn/sk_2d/{first_city_code}.html"
-        headers = {
-            'Referer': 'http://www.weather.com.cn/',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            content = response.text
-            
-            # 解析天气信息
-            temp_match = re.search(r'"temp":"([^"]*)"', content)
-            weather_match = re.search(r'"weather1":"([^"]*)"', content)
-            if not weather_match:
-                weather_match = re.search(r'"weather":"([^"]*)"', content)
-            
-            if temp_match:
-                temp = temp_match.group(1)
-                weather = weather_match.group(1) if weather_match else "未知"
-                
-                return f"{province_name}({first_city_name}): {weather} {temp}°C"
-            else:
-                return f"{province_name}: 无法解析天气数据"
-        else:
-            return f"{province_name}: 请求失败 (状态码: {response.status_code})"
-    
-    except Exception as e:
-        return f"{province_name}: 请求异常 - {str(e)}"
+        row['error'] = f"未找到 {province_name} 的城市数据"
+        return row
+    row['city'], row['code'] = cities[0]
+    return row
+
+def get_province_weather_overview(province_name: str) -> str:
+    """获取省份天气概览"""
+    row = _province_row(province_name, load_province_codes())
+    if row['code'] is None:
+        return row['error']
+    row.update(fetch_city_weather(row['city'], row['code']))
+    return format_province_row(row)
+
+def sweep_provinces_weather(provinces: Optional[List[str]] = None,
+                            max_workers: int = DEFAULT_SWEEP_WORKERS) -> List[Dict]:
+    """
+    并发获取多个省份的天气概览，返回按输入顺序排列的结构化结果表
+    省份与城市代码只加载一次；请求在有界线程池中并发执行，并按主机限流
+    每行包含 province, province_code, city, code, observation, error
+    """
+    province_codes = load_province_codes()
+    if provinces is None:
+        provinces = list(province_codes)
+
+    rows = [_province_row(name, province_codes) for name in provinces]
+    pending = [row for row in rows if row['code'] is not None]
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            results = executor.map(lambda row: fetch_city_weather(row['city'], row['code']), pending)
+            for row, result in zip(pending, results):
+                row.update(result)
+    return rows
 
 def get_all_provinces_weather():
     """获取所有省份的天气概览"""
-    province_codes = load_province_codes()
-    
+    rows = sweep_provinces_weather()
+
     print("中国各省份天气概览:")
     print("=" * 40)
-    
-    for province_name in province_codes:
-        weather_info = get_province_weather_overview(province_name)
-        print(weather_info)
+
+    for row in rows:
+        print(format_province_row(row))
+
+def sample_cities(cities: List[tuple], sample_size: Optional[int] = None) -> List[tuple]:
+    """从城市列表中等间隔抽取代表城市；sample_size 为None时返回全部城市"""
+    if sample_size is None or sample_size >= len(cities):
+        return list(cities)
+    if sample_size <= 0:
+        return []
+    step = len(cities) / sample_size
+    return [cities[int(i * step)] for i in range(sample_size)]
+
+def summarize_city_weather(province_name: str, province_code: Optional[str],
+                           rows: List[Dict]) -> Dict:
+    """
+    汇总一个省份各城市的实况：最低/最高/平均气温和最常见的天气
+    没有任何城市返回有效温度时 error 不为None
+    """
+    reported = [row['observation'] for row in rows if row['observation'] is not None]
+    reported = [obs for obs in reported if obs.temp is not None]
+    summary = {
+        'province': province_name,
+        'province_code': province_code,
+        'cities': len(rows),
+        'reported': len(reported),
+        'min_temp': None, 'min_city': None,
+        'max_temp': None, 'max_city': None,
+        'mean_temp': None,
+        'dominant_weather': None,
+        'weather_counts': {},
+        'error': None,
+    }
+    if not reported:
+        summary['error'] = f"{province_name}: 没有可用的城市天气数据"
+        return summary
+
+    temps = [obs.temp for obs in reported]
+    coldest = min(reported, key=lambda obs: obs.temp)
+    hottest = max(reported, key=lambda obs: obs.temp)
+    counts = Counter(obs.condition for obs in reported)
+
+    summary.update({
+        'min_temp': coldest.temp, 'min_city': coldest.location,
+        'max_temp': hottest.temp, 'max_city': hottest.location,
+        'mean_temp': round(statistics.fmean(temps), 1),
+        'dominant_weather': counts.most_common(1)[0][0],
+        'weather_counts': dict(counts),
+    })
+    return summary
+
+def aggregate_provinces_weather(provinces: Optional[List[str]] = None,
+                                sample_size: Optional[int] = None,
+                                max_workers: int = DEFAULT_SWEEP_WORKERS,
+                                use_cache: bool = True) -> List[Dict]:
+    """
+    按省份汇总多个城市的天气，返回按输入顺序排列的汇总结果
+    所有未缓存省份的城市请求放在同一个有界线程池中并发执行并按主机限流；
+    汇总结果按省份缓存，有效期与sk_2d实况数据相同；部分城市查询失败的汇总不缓存
+    """
+    province_codes = load_province_codes()
+    if provinces is None:
+        provinces = list(province_codes)
+    cache = get_weather_cache()
+
+    summaries: List[Optional[Dict]] = [None] * len(provinces)
+    to_fetch = []  # (位置, 省份名, 省份代码, 缓存键, 城市列表)
+    for i, province_name in enumerate(provinces):
+        if province_name not in province_codes:
+            summaries[i] = summarize_city_weather(province_name, None, [])
+            summaries[i]['error'] = f"未找到省份: {province_name}"
+            continue
+        province_code = province_codes[province_name]["code"]
+        key = f"province:{province_code}:{sample_size or 'all'}"
+        cached = cache.get(key) if use_cache else None
+        if cached is not None:
+            summaries[i] = cached
+            continue
+        cities = sample_cities(get_city_codes_by_province(province_code), sample_size)
+        to_fetch.append((i, province_name, province_code, key, cities))
+
+    jobs = [city for *_, cities in to_fetch for city in cities]
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+            results = iter(list(executor.map(lambda city: fetch_city_weather(*city), jobs)))
+    else:
+        results = iter(())
+
+    for i, province_name, province_code, key, cities in to_fetch:
+        rows = [next(results) for _ in cities]
+        summary = summarize_city_weather(province_name, province_code, rows)
+        if not cities:
+            summary['error'] = f"未找到 {province_name} 的城市数据"
+        elif use_cache and summary['error'] is None and summary['reported'] == summary['cities']:
+            cache.put(key, summary, SK_2D_SOURCE)
+        summaries[i] = summary
+    return summaries
+
+def get_province_aggregate(province_name: str, sample_size: Optional[int] = None) -> Dict:
+    """汇总单个省份的天气"""
+    return aggregate_provinces_weather([province_name], sample_size=sample_size)[0]
+
+def format_province_aggregate(summary: Dict) -> str:
+    """把省份汇总结果格式化为一行文本"""
+    if summary['error']:
+        return summary['error']
+    return (f"{summary['province']}: {summary['dominant_weather']} "
+            f"{summary['min_temp']:g}~{summary['max_temp']:g}°C 平均{summary['mean_temp']:g}°C "
+            f"(最低 {summary['min_city']}, 最高 {summary['max_city']}, "
+            f"{summary['reported']}/{summary['cities']} 个城市)")
 
 def main():
     """主函数"""
+    # 带参数时输出指定省份的多城市汇总，例如: province_weather_demo.py 广东 浙江
+    if len(sys.argv) > 1:
+        for summary in aggregate_provinces_weather(sys.argv[1:]):
+            print(format_province_aggregate(summary))
+        return
+
     print("使用省份代码获取天气信息...")
     
     # 示例：获取北京天气
@@ -8,46 +8,73 @@ import json
 import os
 import sys
 import urllib.parse
-import requests
 from datetime import datetime
 import time
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from geocode_cache import get_geocode_cache
+from weather_backends import get_backend_registry
+from weather_cache import get_weather_cache, weather_cache_key
+from weather_http import fetch_wttr_in, http_get
+from weather_observation import WeatherObservation, parse_percent, parse_temp
 
 class ChinaWeather:
-    def __init__(self):
-        self.qweather_key = os.environ.get('QWEATHER_API_KEY')
-        self.amap_key = os.environ.get('AMAP_API_KEY')
+    def __init__(self, use_cache=True):
+        self.backends = get_backend_registry()
+        # 密钥优先取环境变量，其次取 clawdbot_weather_config.ini
+        self.qweather_key = self.backends.config.api_key('qweather')
+        self.amap_key = self.backends.config.api_key('amap')
+        self.use_cache = use_cache
+        self.cache = get_weather_cache()
+        self.geocode_cache = get_geocode_cache()
         
     def get_location_coords(self, location):
         """
         通过高德地图API获取坐标
+        坐标会持久化缓存，同一地名只需查询一次
         """
         if not self.amap_key:
             # 如果没有高德API密钥，则使用OpenStreetMap
-            try:
-                geocode_url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(location)}&format=json&addressdetails=1&limit=1"
-                response = requests.get(geocode_url, headers={'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'})
-                
-                if response.status_code == 200 and response.json():
-                    data = response.json()[0]
-                    return float(data['lat']), float(data['lon'])
-            except:
-                pass
-            return None, None
+            coords = self.geocode_cache.get_or_lookup('nominatim', location,
+                                                      partial(self._geocode_nominatim, location))
         else:
             # 使用高德地图API
-            try:
-                geocode_url = f"https://restapi.amap.com/v3/geocode/geo?key={self.amap_key}&address={urllib.parse.quote(location)}"
-                response = requests.get(geocode_url)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('status') == '1' and data.get('geocodes'):
-                        location_str = data['geocodes'][0]['location']
-                        lon, lat = location_str.split(',')
-                        return float(lat), float(lon)
-            except:
-                pass
-            return None, None
+            coords = self.geocode_cache.get_or_lookup('amap', location,
+                                                      partial(self._geocode_amap, location))
+        if coords:
+            return coords
+        return None, None
+    
+    def _geocode_nominatim(self, location):
+        """使用OpenStreetMap获取坐标，失败时返回None"""
+        try:
+            geocode_url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(location)}&format=json&addressdetails=1&limit=1"
+            response = http_get(geocode_url, headers={'User-Agent': 'Mozilla/5.0 (compatible; Clawbot Weather)'})
+            
+            if response.status_code == 200 and response.json():
+                data = response.json()[0]
+                return float(data['lat']), float(data['lon'])
+        except:
+            pass
+        return None
+    
+    def _geocode_amap(self, location):
+        """使用高德地图API获取坐标，失败时返回None"""
+        try:
+            geocode_url = f"https://restapi.amap.com/v3/geocode/geo?key={self.amap_key}&address={urllib.parse.quote(location)}"
+            response = http_get(geocode_url)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get('status') == '1' and data.get('geocodes'):
+                    location_str = data['geocodes'][0]['location']
+                    lon, lat = location_str.split(',')
+                    return float(lat), float(lon)
+        except:
+            pass
+        return None
     
     def query_qweather(self, location):
         """
@@ -62,7 +89,7 @@ class ChinaWeather:
             if not lat or not lon:
                 # 尝试直接使用地点名称
                 search_url = f"https://geoapi.qweather.com/v2/city/lookup?location={urllib.parse.quote(location)}&key={self.qweather_key}"
-                search_resp = requests.get(search_url)
+                search_resp = http_get(search_url)
                 if search_resp.status_code == 200:
                     search_data = search_resp.json()
                     if search_data.get('code') == '200' and search_data.get('location'):
@@ -74,19 +101,22 @@ class ChinaWeather:
             else:
                 # 使用坐标查询天气
                 weather_url = f"https://devapi.qweather.com/v7/weather/now?location={lon},{lat}&key={self.qweather_key}"
-            response = requests.get(weather_url)
+            response = http_get(weather_url)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('code') == '200':
                     now = data['now']
-                    temp = now['temp']
-                    text = now['text']
-                    wind_dir = now['windDir']
-                    wind_scale = now['windScale']
-                    
-                    result = f"{location}: {text} {temp}°C 风向:{wind_dir} 风力:{wind_scale}级"
-                    return result
+                    return WeatherObservation(
+                        location,
+                        condition=now['text'],
+                        temp=parse_temp(now['temp']),
+                        condition_code=now.get('icon'),
+                        wind_dir=now['windDir'],
+                        wind_scale=now['windScale'],
+                        humidity=parse_percent(now.get('humidity')),
+                        source='qweather',
+                    )
         except Exception as e:
             print(f"QWeather查询失败: {e}", file=sys.stderr)
         
@@ -102,7 +132,7 @@ class ChinaWeather:
         try:
             # 先获取城市编码
             city_url = f"https://restapi.amap.com/v3/config/district?keywords={urllib.parse.quote(location)}&subdistrict=0&key={self.amap_key}"
-            city_resp = requests.get(city_url)
+            city_resp = http_get(city_url)
             
             if city_resp.status_code == 200:
                 city_data = city_resp.json()
@@ -111,19 +141,21 @@ class ChinaWeather:
                     
                     # 查询天气
                     weather_url = f"https://restapi.amap.com/v3/weather/weatherInfo?city={city_code}&key={self.amap_key}&extensions=base"
-                    weather_resp = requests.get(weather_url)
+                    weather_resp = http_get(weather_url)
                     
                     if weather_resp.status_code == 200:
                         weather_data = weather_resp.json()
                         if weather_data.get('status') == '1' and weather_data.get('lives'):
                             live = weather_data['lives'][0]
-                            weather = live['weather']
-                            temperature = live['temperature']
-                            wind_direction = live['winddirection']
-                            wind_power = live['windpower']
-                            
-                            result = f"{location}: {weather} {temperature}°C 风向:{wind_direction} 风力:{wind_power}级"
-                            return result
+                            return WeatherObservation(
+                                location,
+                                condition=live['weather'],
+                                temp=parse_temp(live['temperature']),
+                                wind_dir=live['winddirection'],
+                                wind_scale=live['windpower'],
+                                humidity=parse_percent(live.get('humidity')),
+                                source='amap',
+                            )
         except Exception as e:
             print(f"AMap天气查询失败: {e}", file=sys.stderr)
         
@@ -141,15 +173,12 @@ class ChinaWeather:
             
             # 查询天气
             meteo_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&temperature_unit=celsius&windspeed_unit=kmh&precipitation_unit=mm"
-            response = requests.get(meteo_url)
+            response = http_get(meteo_url)
             
             if response.status_code == 200:
                 weather_data = response.json()
                 current = weather_data['current_weather']
                 
-                temp = current['temperature']
-                windspeed = current['windspeed']
-                wind_direction = current['winddirection']
                 weathercode = current.get('weathercode', 0)
                 
                 # 天气代码映射（简化版）
@@ -160,10 +189,14 @@ class ChinaWeather:
                     95: '雷暴', 96: '雷暴伴冰雹', 99: '雷暴伴大冰雹'
                 }
                 
-                desc = weather_map.get(weathercode, '天气')
-                
-                result = f"{location}: {desc} {temp}°C 风速:{windspeed}km/h"
-                return result
+                return WeatherObservation(
+                    location,
+                    condition=weather_map.get(weathercode, '天气'),
+                    temp=parse_temp(current['temperature']),
+                    condition_code=weathercode,
+                    wind_speed=parse_temp(current['windspeed']),
+                    source='openmeteo',
+                )
         except Exception as e:
             print(f"Open-Meteo查询失败: {e}", file=sys.stderr)
         
@@ -174,11 +207,8 @@ class ChinaWeather:
         查询wttr.in服务（最后尝试）
         """
         try:
-            import subprocess
-            cmd = f'curl -s "wttr.in/{location}?format=3"'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0 and result.stdout.strip():
-                output = result.stdout.strip()
+            output = fetch_wttr_in(location)
+            if output:
                 # 简单的英文天气描述翻译
                 translations = {
                     'Clear': '晴', 'Sunny': '晴', 'Partly cloudy': '多云', 
@@ -193,7 +223,7 @@ class ChinaWeather:
                 for eng, chi in translations.items():
                     output = output.replace(eng, chi)
                 
-                return output
+                return WeatherObservation.from_text(location, output, 'wttr_in')
         except Exception as e:
             print(f"wttr.in查询失败: {e}", file=sys.stderr)
         
@@ -202,35 +232,46 @@ class ChinaWeather:
     def query_weather(self, location):
         """
         查询天气信息，按优先级尝试不同服务
+        同一城市在有效期内直接返回缓存结果
+        """
+        observation = self.query_observation(location)
+        if observation is None:
+            return f"无法获取 {location} 的天气信息"
+        return observation.render()
+    
+    def query_observation(self, location):
+        """
+        与 query_weather 相同，但返回 WeatherObservation，全部服务失败时返回None
         """
         print(f"正在查询 {location} 的天气信息...")
         
-        # 1. 尝试和风天气
-        result = self.query_qweather(location)
-        if result:
-            print("使用和风天气服务")
-            return result
-        
-        # 2. 尝试高德地图天气
-        result = self.query_amap_weather(location)
-        if result:
-            print("使用高德地图天气服务")
-            return result
-        
-        # 3. 尝试Open-Meteo
-        result = self.query_open_meteo(location)
-        if result:
-            print("使用Open-Meteo服务")
-            return result
-        
-        # 4. 最后尝试wttr.in
-        result = self.query_wttr_in(location)
-        if result:
-            print("使用wttr.in服务")
-            return result
+        fetch = partial(self._query_weather_uncached, location)
+        if not self.use_cache:
+            return fetch()[0]
+        return self.cache.get_or_fetch(weather_cache_key(location), fetch)
+    
+    def services(self):
+        """服务名 -> 查询方法"""
+        return {
+            'qweather': self.query_qweather,
+            'amap': self.query_amap_weather,
+            'openmeteo': self.query_open_meteo,
+            'wttr_in': self.query_wttr_in,
+        }
+    
+    def _query_weather_uncached(self, location):
+        """
+        按 clawdbot_weather_config.ini 中 [china_weather] service_priority 的顺序尝试各个服务，
+        返回 (观测结果, 服务名)；全部失败时均为None
+        """
+        services = self.services()
+        for name in self.backends.china_service_priority(services):
+            result = services[name](location)
+            if result:
+                print(f"使用{self.backends.label(name)}")
+                return result, name
         
-        return f"无法获取 {location} 的天气信息"
-
+        return None, None
 
 def main():
     if len(sys.argv) < 2:
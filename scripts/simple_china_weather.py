@@ -3,19 +3,33 @@
 Simplified China Weather Query - Mimics original weather skill style
 """
 
+import os
 import sys
 import urllib.parse
-import subprocess
 import json
-import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from geocode_cache import get_geocode_cache
+from weather_http import fetch_wttr_in, http_get
 
 def get_coordinates(location):
     """
     Get coordinates for a location using OpenStreetMap
+    Results are kept in the persistent geocode cache
+    """
+    coords = get_geocode_cache().get_or_lookup('nominatim', location, lambda: _lookup_coordinates(location))
+    if coords:
+        return coords
+    return None, None
+
+def _lookup_coordinates(location):
+    """
+    Query OpenStreetMap Nominatim, returning None on failure
     """
     try:
         url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(location)}&format=json&limit=1"
-        response = requests.get(url, headers={'User-Agent': 'Clawbot-China-Weather'})
+        response = http_get(url, headers={'User-Agent': 'Clawbot-China-Weather'})
         if response.status_code == 200:
             data = response.json()
             if data and len(data) > 0:
@@ -24,7 +38,7 @@ def get_coordinates(location):
                 return lat, lon
     except:
         pass
-    return None, None
+    return None
 
 def query_opentempero(lat, lon):
     """
@@ -32,7 +46,7 @@ def query_opentempero(lat, lon):
     """
     try:
         url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&temperature_unit=celsius&windspeed_unit=kmh"
-        response = requests.get(url)
+        response = http_get(url)
         if response.status_code == 200:
             data = response.json()
             current = data['current_weather']
@@ -62,10 +76,8 @@ def query_wttr_in(location):
     Query wttr.in service
     """
     try:
-        cmd = f'curl -s "wttr.in/{location}?format=3"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-        if result.returncode == 0 and result.stdout.strip():
-            output = result.stdout.strip()
+        output = fetch_wttr_in(location)
+        if output:
             # Translate common weather terms
             translations = {
                 'Clear': '晴', 'Sunny': '晴', 'Partly cloudy': '多云', 
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+请求合并（single-flight）
+同一个键同时只执行一次查询，并发的相同请求等待并共享这次查询的结果（或异常）
+查询中发生的上游错误（见 backend_health.BackendAttempt）也记到每个调用者的服务调用中
+提供线程版本 SingleFlight 和asyncio版本 AsyncSingleFlight
+"""
+
+import threading
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable
+
+from backend_health import BackendAttempt, report_upstream_error
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'upstream_errors')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.upstream_errors = 0
+
+
+class SingleFlight:
+    """线程安全的请求合并；第一个调用者执行 fn，其余调用者阻塞等待同一结果"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            report_upstream_error(call.upstream_errors)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with BackendAttempt() as attempt:
+                try:
+                    call.result = fn()
+                finally:
+                    call.upstream_errors = attempt.errors
+            report_upstream_error(call.upstream_errors)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class _AsyncCall:
+    __slots__ = ('task', 'waiters', 'upstream_errors')
+
+    def __init__(self):
+        self.task: 'asyncio.Future' = None
+        self.waiters = 0
+        self.upstream_errors = 0
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with BackendAttempt() as attempt:
+            try:
+                return await fn()
+            finally:
+                self.upstream_errors = attempt.errors
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的asyncio版本
+    查询在独立的任务中执行，调用者通过 shield 等待：被取消的调用者不影响其他等待者；
+    最后一个等待者也被取消时（对冲中落败的阶段、超时）取消查询任务，不再等待上游
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _AsyncCall] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def _forget(self, loop_key: Hashable, call: _AsyncCall):
+        if self._calls.get(loop_key) is call:
+            del self._calls[loop_key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        import asyncio
+
+        # 任务绑定在事件循环上，不同事件循环的相同请求不合并
+        loop_key = (id(asyncio.get_running_loop()), key)
+        call = self._calls.get(loop_key)
+        if call is None:
+            call = self._calls[loop_key] = _AsyncCall()
+            call.task = asyncio.ensure_future(call.run(fn))
+            call.task.add_done_callback(lambda _, call=call: self._forget(loop_key, call))
+            self.executions += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+            report_upstream_error(call.upstream_errors)
+            return result
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+                # 之后的相同请求重新发起查询，而不是等待这个已取消的任务
+                self._forget(loop_key, call)
+            raise
+        finally:
+            call.waiters -= 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)
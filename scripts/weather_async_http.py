@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+天气服务的asyncio HTTP客户端
+安装了aiohttp时使用非阻塞连接池；否则在线程池中调用共享的同步连接池
+asyncio 和 aiohttp 在第一次请求时才导入，只走同步路径的进程不付出这部分启动开销
+"""
+
+import json
+import threading
+import urllib.parse
+import weakref
+from typing import Dict, Optional
+
+from backend_health import report_upstream_error
+from weather_http import DEFAULT_TIMEOUT, WTTR_IN_URL, http_get, upstream_url
+from weather_trace import CAT_HTTP, trace_span
+
+# 默认连接数限制（仅aiohttp生效）
+DEFAULT_LIMIT = 100
+DEFAULT_LIMIT_PER_HOST = 16
+
+_aiohttp = False   # False 表示尚未尝试导入
+
+
+def load_aiohttp():
+    """导入aiohttp（可选依赖，导入较慢）；未安装时返回None"""
+    global _aiohttp
+    if _aiohttp is False:
+        try:
+            import aiohttp
+        except ImportError:
+            aiohttp = None
+        _aiohttp = aiohttp
+    return _aiohttp
+
+
+class AsyncResponse:
+    """与 requests.Response 常用属性一致的精简响应对象"""
+
+    __slots__ = ('status_code', 'content', 'encoding', 'url')
+
+    def __init__(self, status_code: int, content: bytes, encoding: Optional[str] = None, url: str = ''):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.url = url
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+async def _close_with_loop(session):
+    """
+    随事件循环关闭会话的异步生成器：启动后停在yield处，
+    asyncio.run 结束时（loop.shutdown_asyncgens）会关闭它，从而关闭会话
+    """
+    try:
+        yield
+    finally:
+        await session.close()
+
+
+class AsyncWeatherHttpClient:
+    """
+    asyncio HTTP客户端
+    aiohttp会话与事件循环绑定，因此每个事件循环各自持有一个会话；
+    会话在 asyncio.run 结束时自动关闭，也可以调用 close() 提前关闭
+    """
+
+    def __init__(self, limit: int = DEFAULT_LIMIT, limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        # 事件循环 -> (会话, 随事件循环关闭会话的异步生成器)
+        self._sessions = weakref.WeakKeyDictionary()
+
+    @property
+    def non_blocking(self) -> bool:
+        """是否使用真正的非阻塞客户端"""
+        return load_aiohttp() is not None
+
+    async def _session(self):
+        import asyncio
+
+        aiohttp = load_aiohttp()
+        loop = asyncio.get_running_loop()
+        entry = self._sessions.get(loop)
+        if entry is None or entry[0].closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            session = aiohttp.ClientSession(connector=connector)
+            # 第一次迭代时异步生成器登记到当前事件循环，事件循环结束时随之关闭会话
+            closer = _close_with_loop(session)
+            await closer.asend(None)
+            entry = self._sessions[loop] = (session, closer)
+        return entry[0]
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None,
+                  timeout: Optional[float] = None) -> AsyncResponse:
+        """发送GET请求，超时或被取消时抛出异常"""
+        import asyncio
+
+        timeout = self.timeout if timeout is None else timeout
+        aiohttp = load_aiohttp()
+        if aiohttp is None:
+            # to_thread 会复制contextvars，线程中的请求仍记在当前trace中
+            response = await asyncio.to_thread(http_get, url, headers=headers, timeout=timeout)
+            return AsyncResponse(response.status_code, response.content, response.encoding, url)
+
+        with trace_span(urllib.parse.urlsplit(url).netloc, CAT_HTTP) as http_span:
+            try:
+                session = await self._session()
+                async with session.get(upstream_url(url), headers=headers,
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                report_upstream_error()
+                raise
+            if response.status >= 500:
+                report_upstream_error()
+            http_span.set(status=response.status, bytes=len(content))
+            return AsyncResponse(response.status, content, response.charset, url)
+
+    async def close(self):
+        """关闭当前事件循环上的会话"""
+        import asyncio
+
+        if load_aiohttp() is None:
+            return
+        entry = self._sessions.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            # 关闭异步生成器时在其finally中关闭会话
+            await entry[1].aclose()
+
+
+_client: Optional[AsyncWeatherHttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_async_http_client() -> AsyncWeatherHttpClient:
+    """获取进程内共享的asyncio HTTP客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsyncWeatherHttpClient()
+    return _client
+
+
+async def async_http_get(url: str, **kwargs) -> AsyncResponse:
+    """通过共享客户端发送GET请求"""
+    return await get_async_http_client().get(url, **kwargs)
+
+
+async def async_fetch_wttr_in(location: str, fmt: str = '3', timeout: Optional[float] = None) -> Optional[str]:
+    """fetch_wttr_in 的asyncio版本"""
+    url = f"{WTTR_IN_URL}/{urllib.parse.quote(location, safe='')}?format={urllib.parse.quote(fmt)}"
+    response = await async_http_get(url, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    response.encoding = 'utf-8'
+    output = response.text.strip()
+    return output or None
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+天气服务插件注册表
+每个服务声明名称、成本、超时和能力；各脚本按 clawdbot_weather_config.ini 中的优先级生成执行计划
+"""
+
+import configparser
+import json
+import os
+import re
+import sys
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 配置文件位置，可用环境变量 CLAWDBOT_WEATHER_CONFIG 覆盖
+CONFIG_FILENAME = 'clawdbot_weather_config.ini'
+CONFIG_PATHS = [
+    os.path.join(os.path.dirname(SCRIPT_DIR), CONFIG_FILENAME),
+    os.path.join(SCRIPT_DIR, CONFIG_FILENAME),
+]
+
+# 服务能力
+CAP_CHINA = 'china'                  # 适用于中国境内位置
+CAP_INTERNATIONAL = 'international'  # 适用于境外位置
+CAP_CITY_CODE = 'city_code'          # 需要中国天气网城市代码，而不是地名
+CAP_FALLBACK = 'fallback'            # 组合回退策略（如查询省会），内部会调用其他服务
+
+# 配置文件缺失或未设置时的默认执行计划
+DEFAULT_REQUEST_TIMEOUT = 10.0
+DEFAULT_CHINA_FALLBACK_CHAIN = [
+    'weather_com_cn_v2', 'weather_com_cn_v1', 'qweather', 'amap', 'wttr_in',
+    'province_capital', 'similar_city', 'openmeteo', 'province_wttr',
+]
+DEFAULT_CHINA_SERVICE_PRIORITY = ['qweather', 'amap', 'openmeteo', 'wttr_in']
+DEFAULT_INTERNATIONAL_SERVICE_PRIORITY = ['wttr_in', 'openmeteo']
+
+
+class WeatherBackend:
+    """
+    一个天气服务插件的声明
+    cost 为相对请求成本（大致对应需要的HTTP请求数）；timeout 为整个查询的默认超时（秒），
+    只发一次请求的服务不需要声明，使用配置中的 request_timeout；
+    requires 为需要的API密钥名称，如 'qweather' 对应配置中的 qweather_api_key
+    """
+
+    __slots__ = ('name', 'label', 'cost', 'timeout', 'capabilities', 'requires', 'aliases')
+
+    def __init__(self, name: str, label: str, cost: int = 1, timeout: Optional[float] = None,
+                 capabilities: Iterable[str] = (), requires: Optional[str] = None,
+                 aliases: Iterable[str] = ()):
+        self.name = name
+        self.label = label
+        self.cost = cost
+        self.timeout = timeout
+        self.capabilities: FrozenSet[str] = frozenset(capabilities)
+        self.requires = requires
+        self.aliases = tuple(aliases)
+
+    def __repr__(self) -> str:
+        return f"WeatherBackend({self.name!r}, cost={self.cost}, timeout={self.timeout})"
+
+
+# 内置服务
+BUILTIN_BACKENDS = [
+    WeatherBackend('weather_com_cn_v2', '中国天气网API v2', cost=1,
+                   capabilities=(CAP_CHINA, CAP_CITY_CODE), aliases=('weather_index',)),
+    WeatherBackend('weather_com_cn_v1', '中国天气网API v1', cost=1,
+                   capabilities=(CAP_CHINA, CAP_CITY_CODE), aliases=('data_sk',)),
+    WeatherBackend('sk_2d', '中国天气网实况', cost=1,
+                   capabilities=(CAP_CHINA, CAP_CITY_CODE), aliases=('weather_com_cn_sk_2d',)),
+    WeatherBackend('qweather', '和风天气服务', cost=2, timeout=20,
+                   capabilities=(CAP_CHINA, CAP_INTERNATIONAL), requires='qweather'),
+    WeatherBackend('amap', '高德地图天气服务', cost=2, timeout=20,
+                   capabilities=(CAP_CHINA,), requires='amap'),
+    WeatherBackend('openmeteo', 'Open-Meteo服务', cost=2, timeout=20,
+                   capabilities=(CAP_CHINA, CAP_INTERNATIONAL), aliases=('open_meteo', 'open-meteo')),
+    WeatherBackend('wttr_in', 'wttr.in服务', cost=1,
+                   capabilities=(CAP_CHINA, CAP_INTERNATIONAL), aliases=('wttrin', 'wttr.in')),
+    WeatherBackend('province_capital', '省会城市回退', cost=2, timeout=20,
+                   capabilities=(CAP_CHINA, CAP_FALLBACK)),
+    WeatherBackend('similar_city', '相近城市回退', cost=3, timeout=30,
+                   capabilities=(CAP_CHINA, CAP_FALLBACK)),
+    WeatherBackend('province_wttr', '省份天气回退', cost=1,
+                   capabilities=(CAP_CHINA, CAP_FALLBACK)),
+]
+
+
+_ENV_REF = re.compile(r'\$\{(\w+)\}')
+
+
+def _expand_env(value: str) -> str:
+    """展开 ${ENV} 引用，未设置的环境变量展开为空串"""
+    return _ENV_REF.sub(lambda m: os.environ.get(m.group(1), ''), value)
+
+
+def _parse_value(value: str):
+    """配置值可以是JSON（列表、带引号的字符串、数字）或裸字符串"""
+    value = _expand_env(value.strip())
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class WeatherConfig:
+    """clawdbot_weather_config.ini 中与服务选择相关的配置"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._parser = configparser.ConfigParser(interpolation=None)
+        if path:
+            try:
+                self._parser.read(path, encoding='utf-8')
+            except (OSError, configparser.Error) as e:
+                print(f"读取配置文件 {path} 失败，使用默认配置: {e}", file=sys.stderr)
+
+    def get(self, section: str, key: str, default=None):
+        if not self._parser.has_option(section, key):
+            return default
+        return _parse_value(self._parser.get(section, key))
+
+    def getboolean(self, section: str, key: str, default: bool) -> bool:
+        """布尔值：true/false、yes/no、on/off、1/0（不区分大小写），无法识别时使用默认值"""
+        if not self._parser.has_option(section, key):
+            return default
+        value = _expand_env(self._parser.get(section, key).strip()).lower()
+        return configparser.ConfigParser.BOOLEAN_STATES.get(value, default)
+
+    def priority(self, section: str, key: str, default: List[str]) -> List[str]:
+        value = self.get(section, key)
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        if not isinstance(value, list):
+            return list(default)
+        return [str(item) for item in value]
+
+    @property
+    def request_timeout(self) -> float:
+        try:
+            return float(self.get('timeout', 'request_timeout', DEFAULT_REQUEST_TIMEOUT))
+        except (TypeError, ValueError):
+            return DEFAULT_REQUEST_TIMEOUT
+
+    def backend_timeout(self, name: str) -> Optional[float]:
+        """[timeout] 中单独为某个服务设置的超时"""
+        value = self.get('timeout', name)
+        try:
+            return float(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def api_key(self, name: str) -> Optional[str]:
+        """API密钥：环境变量优先，其次 [china_weather] 中的 <name>_api_key"""
+        value = os.environ.get(f"{name.upper()}_API_KEY") or self.get('china_weather', f"{name}_api_key")
+        return value or None
+
+
+def find_config_path() -> Optional[str]:
+    path = os.environ.get('CLAWDBOT_WEATHER_CONFIG')
+    if path:
+        return path
+    for path in CONFIG_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class BackendRegistry:
+    """
+    服务插件注册表
+    根据配置中的服务名（支持别名）生成执行计划，跳过未知和缺少API密钥的服务
+    """
+
+    def __init__(self, config: Optional[WeatherConfig] = None,
+                 backends: Iterable[WeatherBackend] = BUILTIN_BACKENDS):
+        self.config = config or WeatherConfig()
+        self._backends: Dict[str, WeatherBackend] = {}
+        self._aliases: Dict[str, str] = {}
+        self._warned = set()
+        self._lock = threading.Lock()
+        for backend in backends:
+            self.register(backend)
+
+    def register(self, backend: WeatherBackend):
+        """注册（或替换）一个服务"""
+        with self._lock:
+            self._backends[backend.name] = backend
+            for alias in (backend.name,) + backend.aliases:
+                self._aliases[alias.lower()] = backend.name
+
+    def canonical(self, name: str) -> Optional[str]:
+        return self._aliases.get(name.strip().lower())
+
+    def get(self, name: str) -> Optional[WeatherBackend]:
+        canonical = self.canonical(name)
+        return self._backends.get(canonical) if canonical else None
+
+    def names(self) -> List[str]:
+        return list(self._backends)
+
+    def label(self, name: str) -> str:
+        backend = self.get(name)
+        return backend.label if backend else name
+
+    def available(self, name: str) -> bool:
+        """服务已注册，且需要的API密钥已配置"""
+        backend = self.get(name)
+        if backend is None:
+            return False
+        return backend.requires is None or self.config.api_key(backend.requires) is not None
+
+    def timeout_for(self, name: str) -> float:
+        """服务超时：配置中的单独设置 > 服务声明的超时 > 全局 request_timeout"""
+        backend = self.get(name)
+        timeout = self.config.backend_timeout(backend.name if backend else name)
+        if timeout is not None:
+            return timeout
+        if backend is not None and backend.timeout:
+            return backend.timeout
+        return self.config.request_timeout
+
+    def order(self, names: Iterable[str], supported: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        把配置中的服务名列表转换为可执行的服务名（去重、解析别名）
+        supported 为调用方实现了的服务，不在其中或不可用的服务会被跳过
+        """
+        supported = set(supported) if supported is not None else None
+        plan = []
+        for name in names:
+            canonical = self.canonical(name)
+            if canonical is None:
+                if name not in self._warned:
+                    self._warned.add(name)
+                    print(f"配置中的未知天气服务: {name}", file=sys.stderr)
+                continue
+            if canonical in plan or (supported is not None and canonical not in supported):
+                continue
+            if self.available(canonical):
+                plan.append(canonical)
+        return plan
+
+    def china_fallback_chain(self, supported: Optional[Iterable[str]] = None) -> List[str]:
+        """智能路由中国境内位置的回退链"""
+        names = self.config.priority('china_weather', 'fallback_chain', DEFAULT_CHINA_FALLBACK_CHAIN)
+        return self.order(names, supported)
+
+    def china_service_priority(self, supported: Optional[Iterable[str]] = None) -> List[str]:
+        """ChinaWeather 等按地名查询的脚本使用的服务顺序"""
+        names = self.config.priority('china_weather', 'service_priority', DEFAULT_CHINA_SERVICE_PRIORITY)
+        return self.order(names, supported)
+
+    def international_service_priority(self, supported: Optional[Iterable[str]] = None) -> List[str]:
+        """境外位置的服务顺序"""
+        names = self.config.priority('international_weather', 'service_priority',
+                                     DEFAULT_INTERNATIONAL_SERVICE_PRIORITY)
+        return self.order(names, supported)
+
+    def stage_timeouts(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """各服务的超时，用于asyncio执行器"""
+        return {name: self.timeout_for(name) for name in (names or self._backends)}
+
+
+_registry: Optional[BackendRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_backend_registry() -> BackendRegistry:
+    """获取进程内共享的服务注册表，首次使用时读取配置文件"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = BackendRegistry(WeatherConfig(find_config_path()))
+    return _registry
+
+
+def load_backend_registry(path: Optional[str] = None) -> BackendRegistry:
+    """重新读取配置文件并替换共享注册表，path 为None时按默认位置查找"""
+    global _registry
+    registry = BackendRegistry(WeatherConfig(path or find_config_path()))
+    with _registry_lock:
+        _registry = registry
+    return registry
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+天气结果缓存
+按解析后的城市代码缓存查询结果，支持按服务设置TTL、LRU淘汰，
+以及过期后先返回旧结果、同时在后台刷新（stale-while-revalidate）；
+查询失败的位置在短时间内记为"无结果"（负缓存），重复查询不再请求上游；
+同一个键并发未命中时只查询一次（single-flight）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from city_code_registry import CityCodeRegistry
+from single_flight import AsyncSingleFlight, SingleFlight
+from weather_backends import get_backend_registry
+
+# 默认配置（秒）
+DEFAULT_TTL = 600
+DEFAULT_STALE_TTL = 1800
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_NEGATIVE_TTL = 120
+DEFAULT_MAX_NEGATIVE_ENTRIES = 1024
+
+# 各服务结果的有效期（秒），键为服务注册表（weather_backends）中的服务名，也可以写别名；
+# data/sk 接口本身更新较慢，可以缓存得更久
+DEFAULT_BACKEND_TTLS = {
+    'weather_com_cn_v2': 600,
+    'weather_com_cn_v1': 1200,
+    'sk_2d': 900,
+    'wttr_in': 900,
+    'openmeteo': 900,
+    'qweather': 600,
+    'amap': 600,
+}
+
+
+def _canonical_backend(name: str) -> str:
+    """服务名解析为注册表中的规范名，未注册的名称原样返回"""
+    return get_backend_registry().canonical(name) or name
+
+
+# fetch 返回 (结果, 服务名)；服务名为None表示结果不应缓存（例如查询失败）
+FetchResult = Tuple[Any, Optional[str]]
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'backend', 'expires_at', 'stale_until')
+
+    def __init__(self, value: Any, backend: str, expires_at: float, stale_until: float):
+        self.value = value
+        self.backend = backend
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+
+class NegativeEntry:
+    """一次失败查询的记录；stages 为按完成顺序排列的失败阶段"""
+
+    __slots__ = ('stages', 'failed_at', 'expires_at')
+
+    def __init__(self, stages: Tuple[str, ...], failed_at: float, expires_at: float):
+        self.stages = stages
+        self.failed_at = failed_at
+        self.expires_at = expires_at
+
+    @property
+    def last_stage(self) -> Optional[str]:
+        """最后一个失败的阶段，没有可执行的阶段时为None"""
+        return self.stages[-1] if self.stages else None
+
+
+class WeatherResultCache:
+    """
+    线程安全的天气结果缓存
+    过期但仍在 stale_ttl 窗口内的条目会直接返回，并在后台刷新一次；
+    没有可用结果、但有未过期的失败记录时直接返回None，不调用 fetch；
+    同一个键同时未命中的多个调用只执行一次 fetch，共享其结果
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, default_ttl: float = DEFAULT_TTL,
+                 backend_ttls: Optional[Dict[str, float]] = None,
+                 stale_ttl: float = DEFAULT_STALE_TTL,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+                 max_negative_entries: int = DEFAULT_MAX_NEGATIVE_ENTRIES):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.backend_ttls = {_canonical_backend(name): ttl for name, ttl in
+                             (DEFAULT_BACKEND_TTLS if backend_ttls is None else backend_ttls).items()}
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_negative_entries = max_negative_entries
+
+        self._entries: 'OrderedDict[str, _CacheEntry]' = OrderedDict()
+        # 负缓存单独限制大小，大量无效输入不会挤掉正常结果
+        self._negatives: 'OrderedDict[str, NegativeEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._async_tasks = set()
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+        self.negative_hits = 0
+
+    def ttl_for(self, backend: str) -> float:
+        """服务的结果有效期，别名（如 wttrin、weather_com_cn_sk_2d）按服务注册表解析"""
+        return self.backend_ttls.get(_canonical_backend(backend), self.default_ttl)
+
+    def put(self, key: str, value: Any, backend: str):
+        """写入结果，有效期由产生结果的服务决定"""
+        now = time.monotonic()
+        expires_at = now + self.ttl_for(backend)
+        entry = _CacheEntry(value, backend, expires_at, expires_at + self.stale_ttl)
+        with self._lock:
+            self._negatives.pop(key, None)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """只读取未过期的结果，不触发刷新"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry.expires_at:
+                self._entries.move_to_end(key)
+                return entry.value
+        return None
+
+    def put_negative(self, key: str, stages: Iterable[str] = ()):
+        """记录一次失败的查询，negative_ttl 秒内同一个键不再调用 fetch"""
+        now = time.monotonic()
+        entry = NegativeEntry(tuple(stages), now, now + self.negative_ttl)
+        with self._lock:
+            self._negatives[key] = entry
+            self._negatives.move_to_end(key)
+            while len(self._negatives) > self.max_negative_entries:
+                self._negatives.popitem(last=False)
+
+    def get_negative(self, key: str) -> Optional[NegativeEntry]:
+        """未过期的失败记录；命中时计入 negative_hits"""
+        with self._lock:
+            entry = self._negatives.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry.expires_at:
+                del self._negatives[key]
+                return None
+            self.negative_hits += 1
+            return entry
+
+    def invalidate(self, key: Optional[str] = None):
+        """删除一个键（包括失败记录）；不传key时清空缓存"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._negatives.clear()
+            else:
+                self._entries.pop(key, None)
+                self._negatives.pop(key, None)
+
+    def _lookup(self, key: str) -> Tuple[str, Any]:
+        """返回 ('fresh'|'stale'|'miss', 值)，并更新计数"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now < entry.expires_at:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return 'fresh', entry.value
+                if now < entry.stale_until:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    return 'stale', entry.value
+                del self._entries[key]
+            self.misses += 1
+            return 'miss', None
+
+    def _claim_refresh(self, key: str) -> bool:
+        """同一个键同时只允许一个后台刷新"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='weather-cache')
+            return self._executor
+
+    def _store(self, key: str, fetched: FetchResult) -> Any:
+        value, backend = fetched
+        if backend is not None:
+            self.put(key, value, backend)
+        return value
+
+    def _fetch_and_store(self, key: str, fetch: Callable[[], FetchResult]) -> Any:
+        # 排队期间其他调用者可能刚刚写入了结果或失败记录
+        state, value = self._lookup_quiet(key)
+        if state == 'fresh':
+            return value
+        if self.get_negative(key) is not None:
+            return None
+        return self._store(key, fetch())
+
+    async def _async_fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[FetchResult]]) -> Any:
+        state, value = self._lookup_quiet(key)
+        if state == 'fresh':
+            return value
+        if self.get_negative(key) is not None:
+            return None
+        return self._store(key, await fetch())
+
+    def _lookup_quiet(self, key: str) -> Tuple[str, Any]:
+        """与 _lookup 相同但不更新计数"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry.expires_at:
+                return 'fresh', entry.value
+        return 'miss', None
+
+    def _refresh(self, key: str, fetch: Callable[[], FetchResult]):
+        try:
+            value, backend = fetch()
+            if backend is None:
+                with self._lock:
+                    self.refresh_failures += 1
+            else:
+                self.put(key, value, backend)
+        except Exception:
+            with self._lock:
+                self.refresh_failures += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], FetchResult]) -> Any:
+        """
+        读取缓存，未命中时调用 fetch() 并写入
+        命中过期条目时直接返回旧值，并在后台线程中刷新；近期查询失败过的键直接返回None
+        """
+        state, value = self._lookup(key)
+        if state == 'fresh':
+            return value
+        if state == 'stale':
+            if self._claim_refresh(key):
+                self._get_executor().submit(self._refresh, key, fetch)
+            return value
+        if self.get_negative(key) is not None:
+            return None
+        return self._flight.do(key, lambda: self._fetch_and_store(key, fetch))
+
+    async def _async_refresh(self, key: str, fetch: Callable[[], Awaitable[FetchResult]]):
+        try:
+            value, backend = await fetch()
+            if backend is None:
+                with self._lock:
+                    self.refresh_failures += 1
+            else:
+                self.put(key, value, backend)
+        except Exception:
+            with self._lock:
+                self.refresh_failures += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def async_get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[FetchResult]]) -> Any:
+        """get_or_fetch 的asyncio版本，后台刷新在当前事件循环中以任务运行"""
+        state, value = self._lookup(key)
+        if state == 'fresh':
+            return value
+        if state == 'stale':
+            if self._claim_refresh(key):
+                import asyncio
+
+                task = asyncio.ensure_future(self._async_refresh(key, fetch))
+                self._async_tasks.add(task)
+                task.add_done_callback(self._async_tasks.discard)
+            return value
+        if self.get_negative(key) is not None:
+            return None
+        return await self._async_flight.do(key, lambda: self._async_fetch_and_store(key, fetch))
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息，用于评估缓存大小和TTL"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'evictions': self.evictions,
+                'negative_size': len(self._negatives),
+                'negative_hits': self.negative_hits,
+                'coalesced': self._flight.shared + self._async_flight.shared,
+            }
+
+
+def weather_cache_key(location: str, city_code: Optional[str] = None) -> str:
+    """
+    缓存键：能解析出城市代码时按代码，否则按规范化后的地名
+    不传city_code时只做精确的代码表查找，避免把不同地名模糊地归到同一个键
+    """
+    if city_code is None:
+        city_code = CityCodeRegistry.instance().city_codes.get(location.strip())
+    if city_code:
+        return f"code:{city_code}"
+    return f"name:{' '.join(location.split()).lower()}"
+
+
+_cache: Optional[WeatherResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_weather_cache() -> WeatherResultCache:
+    """获取进程内共享的天气结果缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = WeatherResultCache()
+    return _cache
+
+
+def configure_weather_cache(**kwargs) -> WeatherResultCache:
+    """
+    使用新的参数替换共享缓存（原有条目丢弃），用于按负载调整容量和有效期
+    参数同 WeatherResultCache，例如 max_entries=512, negative_ttl=30
+    """
+    global _cache
+    with _cache_lock:
+        _cache = WeatherResultCache(**kwargs)
+    return _cache
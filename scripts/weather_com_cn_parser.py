@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+中国天气网响应解析
+同一个解析器处理 d1.weather.com.cn 的 weather_index / sk_2d 和 www.weather.com.cn 的 data/sk 格式，
+包括 "var x = {...};" 形式的JS包装、多个变量拼接和编码识别
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterator, Optional, Union
+
+from weather_observation import WeatherObservation, parse_percent, parse_temp
+
+# JS变量包装 "var 名称 = "，weather_index 一次返回多个变量
+_VAR = re.compile(r'var\s+([A-Za-z_$][\w$]*)\s*=\s*')
+
+# JSON损坏时的兜底：一次扫描提取需要的字段
+_FIELD = re.compile(r'"(temp|weather1?|cityname|city|SD|sd|weathercode)"\s*:\s*"([^"]*)"')
+
+_DECODER = json.JSONDecoder()
+
+# 实况数据所在的变量，优先于其他变量（如城市预报 cityDZ、告警 alarmDZ、指数 dataZS）
+REALTIME_VARS = ('dataSK', 'weatherinfo')
+
+# 中国天气网用来表示"暂无数据"的值
+MISSING_VALUES = frozenset(['', '999', '9999', '暂无', 'null'])
+
+Payload = Union[str, bytes]
+
+
+def decode_payload(payload: Payload, encoding: Optional[str] = None) -> str:
+    """
+    解码响应内容：优先使用响应声明的编码，其次UTF-8，最后GB18030（兼容GBK）
+    已经是字符串时原样返回
+    """
+    if isinstance(payload, str):
+        return payload
+    if encoding:
+        try:
+            return payload.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    try:
+        return payload.decode('utf-8')
+    except UnicodeDecodeError:
+        return payload.decode('gb18030', errors='replace')
+
+
+def _has_temp(data: Dict[str, Any]) -> bool:
+    temp = data.get('temp')
+    return temp is not None and str(temp) not in MISSING_VALUES
+
+
+def _find_realtime(data: Any, depth: int = 2) -> Optional[Dict[str, Any]]:
+    """
+    在解析出的对象中找到带有效温度的实况字段
+    支持顶层字段、{"weatherinfo": {...}}、{"real": {...}} 和 {"data": {"real": {...}}}，
+    嵌套对象的字段覆盖外层同名字段
+    """
+    if not isinstance(data, dict):
+        return None
+    if _has_temp(data):
+        return data
+    if depth == 0:
+        return None
+    for value in data.values():
+        found = _find_realtime(value, depth - 1)
+        if found is not None:
+            outer = {k: v for k, v in data.items() if not isinstance(v, (dict, list))}
+            return {**outer, **found}
+    return None
+
+
+def _json_starts(text: str) -> Iterator[int]:
+    """
+    按优先级依次给出待解析JSON对象的起始位置
+    先用 str.find 直接定位实况变量，绝大多数响应在这里就能解析成功；
+    其次是第一个对象（无JS包装的data/sk），最后才扫描其余JS变量
+    """
+    for name in REALTIME_VARS:
+        index = text.find(name)
+        if index != -1:
+            start = text.find('{', index)
+            if start != -1:
+                yield start
+    start = text.find('{')
+    if start != -1:
+        yield start
+    for match in _VAR.finditer(text):
+        if match.group(1) not in REALTIME_VARS:
+            yield match.end()
+
+
+def _scan_fields(text: str) -> Optional[Dict[str, str]]:
+    """JSON无法解析时，一次正则扫描取出各字段的第一个有效值"""
+    fields: Dict[str, str] = {}
+    for key, value in _FIELD.findall(text):
+        if value not in MISSING_VALUES:
+            fields.setdefault(key, value)
+    return fields if 'temp' in fields else None
+
+
+def parse_weather_fields(payload: Payload, encoding: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    解析响应内容，返回实况字段字典；没有有效温度时返回None
+    只用C实现的json解码器解析需要的那个JS变量，不做整段切片和多次正则搜索；
+    实况变量（dataSK、weatherinfo）优先，表示"暂无"的温度（如 "999"）会被跳过
+    """
+    text = decode_payload(payload, encoding)
+    malformed = False
+    tried = set()
+    for start in _json_starts(text):
+        if start in tried:
+            continue
+        tried.add(start)
+        try:
+            data, _ = _DECODER.raw_decode(text, start)
+        except ValueError:
+            malformed = True
+            continue
+        fields = _find_realtime(data)
+        if fields is not None:
+            return fields
+    return _scan_fields(text) if malformed else None
+
+
+def fields_to_observation(fields: Dict[str, str], source: str,
+                          default_city: str = '未知城市') -> WeatherObservation:
+    """
+    由实况字段构造观测结果；cityname 为中文名，city 在部分接口中是城市代码，
+    部分接口只有 weather1（sk_2d 的天气描述）而没有 weather
+    """
+    return WeatherObservation(
+        fields.get('cityname') or fields.get('city') or default_city,
+        condition=fields.get('weather') or fields.get('weather1') or '未知',
+        temp=parse_temp(fields.get('temp')),
+        condition_code=fields.get('weathercode'),
+        humidity=parse_percent(fields.get('SD') or fields.get('sd')),
+        source=source,
+    )
+
+
+def parse_weather_observation(payload: Payload, source: str, encoding: Optional[str] = None,
+                              default_city: str = '未知城市') -> Optional[WeatherObservation]:
+    """解析响应内容为观测结果，无法解析时返回None"""
+    fields = parse_weather_fields(payload, encoding)
+    if fields is None:
+        return None
+    return fields_to_observation(fields, source, default_city)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+对冲请求（hedged request）执行器
+按优先级启动各个查询阶段，慢的阶段不再阻塞后面的阶段
+提供线程池版本 run_hedged 和asyncio版本 async_run_hedged
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from backend_health import BackendAttempt
+from daemon_executor import DaemonThreadPoolExecutor
+from weather_trace import CAT_STAGE, bind_trace_context, trace_span
+
+# 执行模式
+MODE_SEQUENTIAL = 'sequential'  # 依次执行，前一个失败才执行下一个
+MODE_HEDGED = 'hedged'          # 先执行第一个，超过hedge_delay仍无结果就再启动下一个
+MODE_RACE = 'race'              # 同时启动全部阶段
+MODES = (MODE_SEQUENTIAL, MODE_HEDGED, MODE_RACE)
+
+DEFAULT_HEDGE_DELAY = 1.5
+DEFAULT_MAX_WORKERS = 32
+
+Stage = Tuple[str, Callable[[], Any]]
+
+# 阶段完成回调 observer(阶段名, 耗时秒数, 结果)，被取消的阶段不回调
+# 结果为 backend_health 的 OUTCOME_OK / OUTCOME_MISS（上游正常应答但没有结果）/ OUTCOME_ERROR（传输错误、超时、5xx或异常）
+Observer = Callable[[str, float, str], None]
+
+_executor: Optional[DaemonThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> DaemonThreadPoolExecutor:
+    """
+    对冲请求共用的线程池
+    使用守护线程：已返回结果后，落败的阶段不会拖住进程退出
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = DaemonThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS,
+                                                     thread_name_prefix='weather-hedge')
+    return _executor
+
+
+def _run_stage(name: str, fn: Callable[[], Any], accept: Callable[[Any], bool] = bool,
+               observer: Optional[Observer] = None) -> Any:
+    started = time.monotonic()
+    result = None
+    stage_span = trace_span(name, CAT_STAGE)
+    with stage_span, BackendAttempt() as attempt:
+        try:
+            result = fn()
+        except Exception as e:
+            print(f"{name} 查询失败: {e}", file=sys.stderr)
+            stage_span.set(error=str(e))
+            attempt.errors += 1
+    outcome = attempt.outcome(accept(result))
+    stage_span.set(outcome=outcome)
+    if observer is not None:
+        observer(name, time.monotonic() - started, outcome)
+    return result
+
+
+def run_hedged(stages: Sequence[Stage], mode: str = MODE_HEDGED,
+               hedge_delay: float = DEFAULT_HEDGE_DELAY,
+               accept: Callable[[Any], bool] = bool,
+               executor: Optional[Executor] = None,
+               observer: Optional[Observer] = None) -> Tuple[Optional[str], Any]:
+    """
+    执行查询阶段并返回第一个有效结果 (阶段名, 结果)，全部失败时返回 (None, None)
+    stages 按优先级排列；同一时刻有多个阶段完成时，优先级高的胜出
+    已返回结果后，尚未开始的阶段会被取消，正在执行的阶段不会被中断，结果被丢弃（仍会通知observer）；
+    默认线程池为守护线程，进程退出时不等待这些阶段
+    """
+    if mode not in MODES:
+        raise ValueError(f"未知的执行模式: {mode}")
+
+    if mode == MODE_SEQUENTIAL:
+        for name, fn in stages:
+            result = _run_stage(name, fn, accept, observer)
+            if accept(result):
+                return name, result
+        return None, None
+
+    executor = executor or get_executor()
+    pending = {}
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        name, fn = stages[next_index]
+        # 在trace中时，阶段在线程池中也记在当前阶段之下
+        pending[executor.submit(bind_trace_context(_run_stage), name, fn, accept, observer)] = next_index
+        next_index += 1
+
+    initial = len(stages) if mode == MODE_RACE else 1
+    while next_index < min(initial, len(stages)):
+        launch()
+
+    try:
+        while pending:
+            timeout = hedge_delay if next_index < len(stages) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 超过对冲延迟仍无结果，启动下一个阶段
+                launch()
+                continue
+
+            winners: List[Tuple[int, Any]] = []
+            failed = 0
+            for future in done:
+                index = pending.pop(future)
+                result = future.result()
+                if accept(result):
+                    winners.append((index, result))
+                else:
+                    failed += 1
+
+            if winners:
+                index, result = min(winners, key=lambda item: item[0])
+                return stages[index][0], result
+
+            # 失败的阶段立即由下一个阶段顶替，不必等待对冲延迟
+            for _ in range(failed):
+                if next_index < len(stages):
+                    launch()
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return None, None
+
+
+async def _async_run_stage(name: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float],
+                           accept: Callable[[Any], bool] = bool,
+                           observer: Optional[Observer] = None) -> Any:
+    import asyncio
+
+    started = time.monotonic()
+    result = None
+    stage_span = trace_span(name, CAT_STAGE)
+    with stage_span, BackendAttempt() as attempt:
+        try:
+            result = await asyncio.wait_for(fn(), timeout)
+        except asyncio.TimeoutError:
+            print(f"{name} 查询超时", file=sys.stderr)
+            stage_span.set(timeout=timeout)
+            attempt.errors += 1
+        except Exception as e:
+            print(f"{name} 查询失败: {e}", file=sys.stderr)
+            stage_span.set(error=str(e))
+            attempt.errors += 1
+    outcome = attempt.outcome(accept(result))
+    stage_span.set(outcome=outcome)
+    if observer is not None:
+        observer(name, time.monotonic() - started, outcome)
+    return result
+
+
+async def async_run_hedged(stages: Sequence[Tuple[str, Callable[[], Awaitable[Any]]]],
+                           mode: str = MODE_HEDGED,
+                           hedge_delay: float = DEFAULT_HEDGE_DELAY,
+                           accept: Callable[[Any], bool] = bool,
+                           timeouts: Optional[Dict[str, float]] = None,
+                           default_timeout: Optional[float] = None,
+                           observer: Optional[Observer] = None) -> Tuple[Optional[str], Any]:
+    """
+    run_hedged 的asyncio版本，stages 中的函数返回协程
+    timeouts 按阶段名设置单个阶段的超时（秒），未设置的使用 default_timeout；超时计为失败
+    返回结果后，其余仍在执行的阶段会被取消
+    """
+    import asyncio
+
+    if mode not in MODES:
+        raise ValueError(f"未知的执行模式: {mode}")
+    timeouts = timeouts or {}
+
+    def start(index: int):
+        name, fn = stages[index]
+        return _async_run_stage(name, fn, timeouts.get(name, default_timeout), accept, observer)
+
+    if mode == MODE_SEQUENTIAL:
+        for index, (name, _) in enumerate(stages):
+            result = await start(index)
+            if accept(result):
+                return name, result
+        return None, None
+
+    pending = {}
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        pending[asyncio.ensure_future(start(next_index))] = next_index
+        next_index += 1
+
+    initial = len(stages) if mode == MODE_RACE else 1
+    while next_index < min(initial, len(stages)):
+        launch()
+
+    try:
+        while pending:
+            timeout = hedge_delay if next_index < len(stages) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                launch()
+                continue
+
+            winners: List[Tuple[int, Any]] = []
+            failed = 0
+            for task in done:
+                index = pending.pop(task)
+                result = task.result()
+                if accept(result):
+                    winners.append((index, result))
+                else:
+                    failed += 1
+
+            if winners:
+                index, result = min(winners, key=lambda item: item[0])
+                return stages[index][0], result
+
+            for _ in range(failed):
+                if next_index < len(stages):
+                    launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return None, None
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+天气服务共享HTTP传输层
+每个主机一个 requests.Session 连接池（keep-alive），带重试与退避
+requests 在创建第一个连接池时才导入（约70ms），只读缓存或只打印用法的进程不付出这部分启动开销
+"""
+
+import os
+import threading
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, Optional
+
+from backend_health import report_upstream_error
+from weather_trace import CAT_HTTP, trace_span
+
+if TYPE_CHECKING:
+    import requests
+
+# 默认配置
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_MAX_RETRIES = 1
+DEFAULT_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+DEFAULT_HOST_RATE = 20     # 每个主机每秒请求数
+DEFAULT_HOST_BURST = 40    # 允许的突发请求数
+
+# 设置后所有上游请求改发到这个地址（本地替身服务，用于离线基准和故障注入），
+# 原URL的主机名作为第一级路径：https://api.open-meteo.com/v1/forecast?... -> {base}/api.open-meteo.com/v1/forecast?...
+UPSTREAM_BASE_ENV = 'WEATHER_UPSTREAM_BASE'
+_upstream_base: Optional[str] = os.environ.get(UPSTREAM_BASE_ENV, '').rstrip('/') or None
+
+
+def set_upstream_base(base: Optional[str]):
+    """设置（或用None取消）上游替身服务地址，覆盖 WEATHER_UPSTREAM_BASE"""
+    global _upstream_base
+    _upstream_base = base.rstrip('/') if base else None
+
+
+def upstream_url(url: str) -> str:
+    """设置了替身服务时，把上游URL改写为替身服务上的对应路径"""
+    if _upstream_base is None:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ''
+    return f"{_upstream_base}/{parts.netloc}{parts.path}{query}"
+
+
+class WeatherHttpClient:
+    """
+    按主机划分连接池的HTTP客户端
+    同一主机的请求复用TCP/TLS连接，不同主机互不占用连接池
+    """
+
+    def __init__(self, pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._sessions: Dict[str, 'requests.Session'] = {}
+        self._lock = threading.Lock()
+
+    def _new_session(self) -> 'requests.Session':
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # 只重试连接失败和5xx：读超时时请求已经发出，重试会让慢上游的耗时翻倍，交给回退链和对冲处理
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            other=0,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, url: str) -> 'requests.Session':
+        """获取url所属主机的会话"""
+        parts = urllib.parse.urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._new_session()
+                    self._sessions[key] = session
+        return session
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        """发送GET请求，未指定timeout时使用默认超时"""
+        kwargs.setdefault('timeout', self.timeout)
+        with trace_span(urllib.parse.urlsplit(url).netloc, CAT_HTTP) as http_span:
+            url = upstream_url(url)
+            try:
+                response = self.session_for(url).get(url, **kwargs)
+            except Exception:
+                # 传输错误和超时计为服务失败；4xx（如地名不存在）不计
+                report_upstream_error()
+                raise
+            if response.status_code >= 500:
+                report_upstream_error()
+            if http_span:
+                http_span.set(status=response.status_code, bytes=len(response.content))
+            return response
+
+    def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+class HostRateLimiter:
+    """
+    按主机划分的令牌桶限流器
+    并发批量请求前调用 acquire(url)，同一主机的请求速率不超过 rate，
+    短时间内最多允许 burst 个请求同时发出
+    """
+
+    def __init__(self, rate: float = DEFAULT_HOST_RATE, burst: int = DEFAULT_HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, host: str) -> float:
+        """取一个令牌，返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = [float(self.burst), now]
+            tokens, updated = bucket
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            # 令牌可以透支，透支部分按速率折算为等待时间
+            tokens -= 1
+            bucket[0], bucket[1] = tokens, now
+            return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def acquire(self, url: str):
+        """阻塞到url所属主机有可用配额为止"""
+        delay = self._reserve(urllib.parse.urlsplit(url).netloc)
+        if delay > 0:
+            time.sleep(delay)
+
+
+_client: Optional[WeatherHttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> WeatherHttpClient:
+    """获取进程内共享的HTTP客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WeatherHttpClient()
+    return _client
+
+
+def configure_http_client(**kwargs) -> WeatherHttpClient:
+    """
+    使用新的连接池参数替换共享客户端
+    参数同 WeatherHttpClient，例如 pool_maxsize=32, max_retries=2
+    """
+    global _client
+    with _client_lock:
+        old = _client
+        _client = WeatherHttpClient(**kwargs)
+    if old is not None:
+        old.close()
+    return _client
+
+
+def http_get(url: str, **kwargs) -> 'requests.Response':
+    """通过共享连接池发送GET请求"""
+    return get_http_client().get(url, **kwargs)
+
+
+_rate_limiter: Optional[HostRateLimiter] = None
+
+
+def get_rate_limiter() -> HostRateLimiter:
+    """获取进程内共享的按主机限流器"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _client_lock:
+            if _rate_limiter is None:
+                _rate_limiter = HostRateLimiter()
+    return _rate_limiter
+
+
+def rate_limited_get(url: str, **kwargs) -> 'requests.Response':
+    """先按主机限流，再通过共享连接池发送GET请求，用于批量并发查询"""
+    get_rate_limiter().acquire(url)
+    return http_get(url, **kwargs)
+
+
+# wttr.in 纯文本接口
+WTTR_IN_URL = 'http://wttr.in'
+
+
+def fetch_wttr_in(location: str, fmt: str = '3', timeout: Optional[float] = None) -> Optional[str]:
+    """
+    通过共享连接池查询wttr.in，返回去掉首尾空白的纯文本结果
+    位置名称按URL路径编码，查询失败或结果为空时返回None
+    """
+    url = f"{WTTR_IN_URL}/{urllib.parse.quote(location, safe='')}?format={urllib.parse.quote(fmt)}"
+    response = http_get(url) if timeout is None else http_get(url, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    response.encoding = 'utf-8'
+    output = response.text.strip()
+    return output or None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+天气实况观测结果
+各服务解析后统一返回 WeatherObservation，缓存、批量和汇总直接使用其中的数值字段，
+只在输出给用户时才渲染为文本
+"""
+
+import re
+import time
+from typing import Any, Dict, Optional
+
+# wttr.in 等纯文本结果中的温度，例如 "+21°C"
+_TEMP_IN_TEXT = re.compile(r'([+-]?\d+(?:\.\d+)?)\s*°C')
+
+
+def parse_temp(value: Any) -> Optional[float]:
+    """解析温度，"暂无"、空串等无效值返回None"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_percent(value: Any) -> Optional[float]:
+    """解析湿度等百分比，例如 "28%" -> 28.0"""
+    if isinstance(value, str):
+        value = value.strip().rstrip('%')
+    return parse_temp(value)
+
+
+def format_temp(temp: Optional[float]) -> str:
+    """渲染温度数值：整数不带小数点，缺失时显示"未知\""""
+    if temp is None:
+        return '未知'
+    return f"{temp:g}"
+
+
+class WeatherObservation:
+    """
+    一次天气实况
+    temp/wind_speed/humidity 为数值；text 仅用于只有纯文本结果的服务（如wttr.in）；
+    note 是回退查询时加在结果前面的说明
+    """
+
+    __slots__ = ('location', 'condition', 'temp', 'condition_code', 'wind_dir', 'wind_scale',
+                 'wind_speed', 'humidity', 'source', 'observed_at', 'text', 'note')
+
+    def __init__(self, location: str, condition: Optional[str] = None, temp: Optional[float] = None,
+                 condition_code: Optional[Any] = None, wind_dir: Optional[str] = None,
+                 wind_scale: Optional[str] = None, wind_speed: Optional[float] = None,
+                 humidity: Optional[float] = None, source: Optional[str] = None,
+                 observed_at: Optional[float] = None, text: Optional[str] = None,
+                 note: Optional[str] = None):
+        self.location = location
+        self.condition = condition
+        self.temp = temp
+        self.condition_code = condition_code
+        self.wind_dir = wind_dir
+        self.wind_scale = wind_scale
+        self.wind_speed = wind_speed
+        self.humidity = humidity
+        self.source = source
+        self.observed_at = time.time() if observed_at is None else observed_at
+        self.text = text
+        self.note = note
+
+    @classmethod
+    def from_text(cls, location: str, text: str, source: str) -> 'WeatherObservation':
+        """由纯文本结果构造，尽量从文本中取出温度"""
+        match = _TEMP_IN_TEXT.search(text)
+        return cls(location, temp=float(match.group(1)) if match else None, source=source, text=text)
+
+    def replace(self, **changes) -> 'WeatherObservation':
+        """返回修改了部分字段的副本"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return WeatherObservation(**values)
+
+    def render(self) -> str:
+        """渲染为一行文本，格式与各服务原有输出一致"""
+        if self.text is not None:
+            body = self.text
+        else:
+            parts = [f"{self.location}: {self.condition or '未知'} {format_temp(self.temp)}°C"]
+            if self.wind_dir is not None:
+                parts.append(f"风向:{self.wind_dir}")
+            if self.wind_scale is not None:
+                parts.append(f"风力:{self.wind_scale}级")
+            if self.wind_speed is not None:
+                parts.append(f"风速:{self.wind_speed:g}km/h")
+            body = ' '.join(parts)
+        return f"{self.note} {body}" if self.note else body
+
+    __str__ = render
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可JSON序列化的字典"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return (f"WeatherObservation(location={self.location!r}, condition={self.condition!r}, "
+                f"temp={self.temp!r}, source={self.source!r})")
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+查询过程的阶段耗时追踪（可选开启）
+每次查询记录一棵嵌套的阶段（span）树：位置补全、境内判断、代码表加载、回退规划、各服务的尝试和其中的HTTP请求，
+阶段带有名称、类别、服务、主机、状态码、字节数和耗时，可导出为JSON Lines或Chrome trace格式（chrome://tracing、Perfetto）
+未开启时 trace_span() 只读取一次contextvar并返回共享的空对象，几乎没有开销
+
+开启方式:
+  with tracing() as trace:               # 追踪代码块中的查询，得到 Trace 对象
+      query_china_weather('杭州')
+  WEATHER_TRACE=/tmp/weather-trace.jsonl  # 每次查询的trace追加写入文件，每行一个阶段
+  WEATHER_TRACE=-                         # 每次查询结束后把阶段树输出到标准错误
+
+用法: python3 scripts/weather_trace.py traces.jsonl [--slowest N] [--chrome out.json]
+"""
+
+import argparse
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+TRACE_ENV = 'WEATHER_TRACE'
+
+# 类别
+CAT_QUERY = 'query'        # 一次查询（trace的根）
+CAT_RESOLVE = 'resolve'    # 位置补全、境内判断
+CAT_LOAD = 'load'          # 代码表加载、索引构建
+CAT_PLAN = 'plan'          # 回退规划
+CAT_CACHE = 'cache'        # 结果缓存（未命中时下面是回退链）
+CAT_FALLBACK = 'fallback'  # 回退链/境外服务链
+CAT_STAGE = 'stage'        # 一个服务（或相近城市候选）的尝试，名称为服务名
+CAT_HTTP = 'http'          # 一次上游HTTP请求，名称为主机名
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('weather_trace_span', default=None)
+_trace_ids = itertools.count(1)
+
+
+class Span:
+    """一个阶段：名称、类别、属性、起止时间（perf_counter秒）和子阶段"""
+
+    __slots__ = ('trace', 'id', 'parent', 'name', 'cat', 'attrs', 'start', 'end',
+                 'thread', 'tid', 'children', '_token')
+
+    def __init__(self, trace: 'Trace', parent: Optional['Span'], name: str, cat: str, attrs: dict):
+        self.trace = trace
+        self.id = next(trace._span_ids)
+        self.parent = parent
+        self.name = name
+        self.cat = cat
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.thread = None
+        self.tid = None
+        self.children: List['Span'] = []
+        self._token = None
+
+    def __enter__(self) -> 'Span':
+        self.thread = threading.current_thread().name
+        self.tid = threading.get_native_id()
+        self.start = time.perf_counter()
+        if self.parent is not None:
+            # list.append是原子的，不同线程中的子阶段可以同时加入
+            self.parent.children.append(self)
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None and 'error' not in self.attrs:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}" if str(exc) else exc_type.__name__
+        return False
+
+    def set(self, **attrs):
+        """添加或更新属性（服务、状态码、字节数等）"""
+        self.attrs.update(attrs)
+
+    @property
+    def finished(self) -> bool:
+        return self.end is not None
+
+    @property
+    def duration(self) -> float:
+        """耗时秒数；尚未结束的阶段（如被对冲放弃后仍在执行的服务）计到当前时刻"""
+        if self.start is None:
+            return 0.0
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def walk(self) -> Iterable['Span']:
+        """先序遍历，子阶段按开始时间排序"""
+        yield self
+        for child in sorted(self.children, key=lambda span: span.start):
+            yield from child.walk()
+
+    def to_dict(self) -> dict:
+        """嵌套的字典表示"""
+        return {
+            'name': self.name,
+            'cat': self.cat,
+            'start_ms': round((self.start - self.trace.root.start) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+            'thread': self.thread,
+            'attrs': dict(self.attrs),
+            'finished': self.finished,
+            'children': [child.to_dict() for child in sorted(self.children, key=lambda span: span.start)],
+        }
+
+
+class _NoopSpan:
+    """未开启追踪时使用的空阶段，为假值，set() 不做任何事"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def __bool__(self) -> bool:
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    一次追踪：根阶段及其下所有阶段
+    作为上下文管理器使用，期间（包括经 bind_trace_context 提交到线程池的任务和asyncio任务中）的阶段都记在这里
+    sink 不为None时，结束后把trace交给 sink(trace)
+    """
+
+    def __init__(self, name: str = 'trace', cat: str = CAT_QUERY, sink: Optional[Callable[['Trace'], None]] = None,
+                 **attrs):
+        self.id = f"{os.getpid()}-{next(_trace_ids)}"
+        self.pid = os.getpid()
+        self.sink = sink
+        self.wall_start = None
+        self._span_ids = itertools.count(1)
+        self.root = Span(self, None, name, cat, attrs)
+
+    def __enter__(self) -> 'Trace':
+        self.wall_start = time.time()
+        self.root.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.root.__exit__(exc_type, exc, tb)
+        if self.sink is not None:
+            try:
+                self.sink(self)
+            except Exception as e:
+                print(f"输出查询追踪失败: {e}", file=sys.stderr)
+        return False
+
+    def set(self, **attrs):
+        """设置根阶段的属性"""
+        self.root.set(**attrs)
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+    def spans(self) -> List[Span]:
+        """所有阶段，先序"""
+        return list(self.root.walk())
+
+    def find(self, name: str) -> List[Span]:
+        """名称为 name 的阶段"""
+        return [span for span in self.root.walk() if span.name == name]
+
+    def to_dict(self) -> dict:
+        return {'trace': self.id, 'pid': self.pid, 'time': self.wall_start, **self.root.to_dict()}
+
+    def records(self) -> List[dict]:
+        """扁平的阶段记录，每个阶段一条，按 parent 关联；JSON Lines 和 Chrome trace 都由此导出"""
+        records = []
+        for span in self.root.walk():
+            if span.start is None:
+                continue
+            record = {
+                'trace': self.id,
+                'id': span.id,
+                'parent': span.parent.id if span.parent is not None else None,
+                'name': span.name,
+                'cat': span.cat,
+                'start': round(self.wall_start + (span.start - self.root.start), 6),
+                'duration_ms': round(span.duration * 1000, 3),
+                'pid': self.pid,
+                'tid': span.tid,
+                'thread': span.thread,
+                'attrs': dict(span.attrs),
+            }
+            if not span.finished:
+                record['unfinished'] = True
+            records.append(record)
+        return records
+
+    def to_json_lines(self) -> str:
+        return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in self.records())
+
+    def to_chrome_trace(self) -> dict:
+        return chrome_trace(self.records())
+
+    def format_tree(self) -> str:
+        return format_tree(self.records())
+
+
+def trace_span(name: str, cat: str = '', **attrs):
+    """
+    在当前trace中开始一个子阶段，用作上下文管理器
+    没有进行中的trace时返回 NOOP_SPAN（假值），调用方可用 if span: 跳过只为追踪准备的计算
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, parent, name, cat, attrs)
+
+
+def current_span():
+    """当前阶段，没有进行中的trace时返回None"""
+    return _current_span.get()
+
+
+def tracing(name: str = 'trace', **attrs) -> Trace:
+    """开始一个新的trace：with tracing() as trace: ..."""
+    return Trace(name, **attrs)
+
+
+def traced(name: Optional[str] = None, cat: str = '', result: Optional[str] = None):
+    """
+    装饰器：在trace中时把函数调用记为一个阶段（默认以函数名命名）
+    result 不为None时，把返回值记为该名称的属性
+    """
+    def decorate(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with trace_span(span_name, cat) as span:
+                value = fn(*args, **kwargs)
+                if result is not None:
+                    span.attrs[result] = value
+                return value
+        return wrapper
+    return decorate
+
+
+def bind_trace_context(fn: Callable) -> Callable:
+    """提交到线程池前调用：让fn在当前trace中执行；没有进行中的trace时原样返回fn"""
+    if _current_span.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+class JsonLinesSink:
+    """把每个trace追加写入JSON Lines文件，每行一个阶段"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __call__(self, trace: Trace):
+        text = trace.to_json_lines()
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(text)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def print_trace_tree(trace: Trace):
+    """把trace的阶段树输出到标准错误"""
+    print(trace.format_tree(), file=sys.stderr)
+
+
+def _sink_from_environment() -> Optional[Callable[[Trace], None]]:
+    """WEATHER_TRACE 为文件路径时追加写入该文件，为 - 时把阶段树输出到标准错误"""
+    target = os.environ.get(TRACE_ENV)
+    if not target:
+        return None
+    return print_trace_tree if target == '-' else JsonLinesSink(target)
+
+
+_sink: Optional[Callable[[Trace], None]] = _sink_from_environment()
+
+
+def set_trace_sink(sink: Optional[Callable[[Trace], None]]):
+    """设置（或用None取消）每次查询结束后接收trace的回调，覆盖 WEATHER_TRACE"""
+    global _sink
+    _sink = sink
+
+
+def get_trace_sink() -> Optional[Callable[[Trace], None]]:
+    return _sink
+
+
+def trace_query(name: str = 'query', cat: str = CAT_QUERY, **attrs):
+    """
+    查询入口使用：已在trace中时记为子阶段；否则设置了sink（WEATHER_TRACE）时开始新的trace，结束后交给sink；
+    两者都没有时返回 NOOP_SPAN
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(parent.trace, parent, name, cat, attrs)
+    if _sink is None:
+        return NOOP_SPAN
+    return Trace(name, cat, sink=_sink, **attrs)
+
+
+def chrome_trace(records: Iterable[dict]) -> dict:
+    """阶段记录转换为Chrome trace格式（完整事件 ph=X，时间单位微秒），可在 chrome://tracing 或 Perfetto 中打开"""
+    events = []
+    threads = {}
+    for record in records:
+        args = dict(record.get('attrs') or {})
+        if record.get('unfinished'):
+            args['unfinished'] = True
+        events.append({
+            'name': record['name'],
+            'cat': record.get('cat') or 'span',
+            'ph': 'X',
+            'ts': round(record['start'] * 1e6, 1),
+            'dur': round(record['duration_ms'] * 1000, 1),
+            'pid': record['pid'],
+            'tid': record['tid'],
+            'args': {'trace': record['trace'], **args},
+        })
+        threads[(record['pid'], record['tid'])] = record.get('thread')
+    for (pid, tid), thread in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def group_traces(records: Iterable[dict]) -> Dict[str, List[dict]]:
+    """按trace分组，保持记录顺序"""
+    traces = {}
+    for record in records:
+        traces.setdefault(record['trace'], []).append(record)
+    return traces
+
+
+def format_tree(records: List[dict]) -> str:
+    """一个trace的阶段树，每行：缩进的阶段名、耗时和属性"""
+    children = {}
+    for record in records:
+        children.setdefault(record['parent'], []).append(record)
+
+    lines = []
+
+    def render(record: dict, depth: int):
+        attrs = ' '.join(f"{key}={value}" for key, value in (record.get('attrs') or {}).items())
+        flag = ' (未结束)' if record.get('unfinished') else ''
+        label = f"{record['name']} [{record['cat']}]" if record.get('cat') else record['name']
+        lines.append(f"{'  ' * depth}{label:<{max(1, 40 - 2 * depth)}}{record['duration_ms']:>10.1f} ms{flag}  {attrs}".rstrip())
+        for child in sorted(children.get(record['id'], []), key=lambda item: item['start']):
+            render(child, depth + 1)
+
+    for root in children.get(None, []):
+        render(root, 0)
+    return '\n'.join(lines)
+
+
+def read_json_lines(paths: Iterable[str]) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='查看或转换 WEATHER_TRACE 写出的查询追踪')
+    parser.add_argument('files', nargs='+', help='JSON Lines 追踪文件')
+    parser.add_argument('--slowest', type=int, default=5, help='显示最慢的N次查询的阶段树（0 不显示）')
+    parser.add_argument('--chrome', help='转换为Chrome trace格式写入该文件')
+    args = parser.parse_args(argv)
+
+    try:
+        records = read_json_lines(args.files)
+    except (OSError, ValueError) as e:
+        print(f"读取追踪文件失败: {e}", file=sys.stderr)
+        return 1
+
+    traces = group_traces(records)
+    roots = sorted((record for record in records if record['parent'] is None),
+                   key=lambda record: record['duration_ms'], reverse=True)
+    print(f"{len(traces)} 次查询，{len(records)} 个阶段")
+    for root in roots[:max(0, args.slowest)]:
+        print()
+        print(format_tree(traces[root['trace']]))
+
+    if args.chrome:
+        with open(args.chrome, 'w', encoding='utf-8') as f:
+            json.dump(chrome_trace(records), f, ensure_ascii=False)
+        print(f"已写入 {args.chrome}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())